@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#Benchmark for repeated bulk jobs over hosts that have stopped answering: 'host send-all' run every
+#round over a set of enumerated hosts, some of which have hung. Without the circuit breaker each hung
+#host costs a full read timeout in every round; with it, hung hosts are skipped after a few failures.
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from upnp import upnp
+from standin import StandInDevice
+
+def run(hp,indexes,rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        results = hp.sendAll('BenchDevice','Service0','Service0Action0',{'NewIn0' : '1'},indexes)
+    elapsed = time.perf_counter() - start
+    failed = len([result for result in results if result[1] is None])
+    return (elapsed,failed)
+
+def main():
+    live = 8
+    hung = 4
+    rounds = 10
+    with contextlib.redirect_stdout(io.StringIO()):
+        hp = upnp(False,False,None,None)
+    hp.setCache(None)
+    hp.HOST_WORKERS = 4
+    hp.httpPool.timeout = 0.5
+
+    devices = [StandInDevice(serviceCount=1,actionCount=1) for i in range(live + hung)]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            indexes = [hp.addHostByLocation(device.location) for device in devices]
+            hp.enumerateHosts(indexes)
+        for device in devices[live:]:
+            device.hang = True
+
+        print('%d rounds of send-all to %d hosts, %d of them hung, %.1fs read timeout, %d at a time' % (rounds,live + hung,hung,hp.httpPool.timeout,hp.HOST_WORKERS))
+        for (label,failureLimit) in (('no circuit breaker',10 ** 9),('circuit breaker',3)):
+            hp.health.reset()
+            hp.health.FAILURE_LIMIT = failureLimit
+            (elapsed,failed) = run(hp,indexes,rounds)
+            assert failed == hung
+            refused = sum(counters['refused'] for (name,counters) in hp.health.stats())
+            print('%-20s %8.2fs %6d requests refused' % (label,elapsed,refused))
+    finally:
+        hp.httpPool.close()
+        for device in devices:
+            device.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+#Benchmark for parsing device and service descriptions: the streaming parser versus the minidom
+#tree the parsing code used to walk. The minidom side runs the same upnp parsing code through a
+#small adapter, so both sides build the ENUM_HOSTS structures the same way and can be compared.
+
+import contextlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+from xml.dom import minidom
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+import upnp as upnpModule
+from upnp import upnp
+from descparser import parseDescription, parseSCPD
+from standin import buildSCPD, buildDescription
+
+#Answers the Record queries with getElementsByTagName, the way the parsing code used to
+class DOMRecord:
+    def __init__(self,node):
+        self.node = node
+
+    def children(self,kind):
+        return [DOMRecord(node) for node in self.node.getElementsByTagName(kind)]
+
+    def firstText(self,tag):
+        return self.node.getElementsByTagName(tag)[0].childNodes[0].data
+
+    def getText(self):
+        return self.node.childNodes[0].data
+
+    #Element attributes, e.g. sendEvents on <stateVariable>
+    @property
+    def attributes(self):
+        if self.node.attributes is None:
+            return {}
+        return dict(self.node.attributes.items())
+
+def domParser(data):
+    return DOMRecord(minidom.parseString(data))
+
+#Parse a device description and one service description, returning the resulting host entry
+def parseHost(hp,description,scpd):
+    hp.setHosts({})
+    hp.addHost({
+        'name' : '127.0.0.1:1900',
+        'dataComplete' : False,
+        'proto' : 'http://',
+        'xmlFile' : 'http://127.0.0.1:1900/desc.xml',
+        'serverType' : None,
+        'upnpServer' : None,
+        'usn' : None,
+        'iface' : None,
+        'deviceList' : {}
+    })
+    #Service descriptions are parsed below rather than fetched
+    hp.parseServices = lambda services,index: None
+    hp.getHostInfo(description,{},0)
+    for device in hp.ENUM_HOSTS[0]['deviceList'].values():
+        for service in device['services'].values():
+            hp.parseServiceXML(service,'scpd.xml',scpd)
+    return hp.ENUM_HOSTS[0]
+
+#Time and peak memory of parsing with the given description and SCPD parsers
+def measure(hp,description,scpd,descParser,scpdParser,rounds):
+    upnpModule.parseDescription = descParser
+    upnpModule.parseSCPD = scpdParser
+    try:
+        start = time.perf_counter()
+        for i in range(rounds):
+            host = parseHost(hp,description,scpd)
+        elapsed = (time.perf_counter() - start) / rounds
+
+        tracemalloc.start()
+        parseHost(hp,description,scpd)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        upnpModule.parseDescription = parseDescription
+        upnpModule.parseSCPD = parseSCPD
+    return (elapsed,peak,host)
+
+def main():
+    services = 4
+    actions = 400
+    rounds = 5
+    description = buildDescription(services)
+    scpd = buildSCPD('ContentDirectory',actions)
+    print('Device description: %d services, %d bytes' % (services,len(description)))
+    print('Service description: %d actions, %d bytes (parsed once per service)' % (actions,len(scpd)))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        hp = upnp(False,False,None,None)
+    hp.setCache(None)
+
+    (domTime,domPeak,domHost) = measure(hp,description,scpd,domParser,domParser,rounds)
+    (streamTime,streamPeak,streamHost) = measure(hp,description,scpd,parseDescription,parseSCPD,rounds)
+
+    assert domHost['dataComplete'] and domHost == streamHost
+    print('%-12s %8.1fms %8.1fMB peak' % ('minidom',domTime * 1000,domPeak / 1048576.0))
+    print('%-12s %8.1fms %8.1fMB peak' % ('streaming',streamTime * 1000,streamPeak / 1048576.0))
+    print('Speedup: %.1fx, peak memory: %.1fx smaller' % (domTime / streamTime,float(domPeak) / streamPeak))
+
+if __name__ == "__main__":
+    main()
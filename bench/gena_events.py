@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#Benchmark for event subscriptions: subscribe to many services across a set of stand-in devices,
+#then have every device send events to all of its subscribers at once, and measure how fast the
+#callback server takes them. NOTIFYs for every subscription are handled by one event loop thread, and
+#renewals share a timer wheel rather than having a timer thread each.
+
+import contextlib
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from upnp import upnp
+from standin import StandInDevice
+
+def main():
+    deviceCount = 20
+    serviceCount = 50
+    rounds = 5
+    with contextlib.redirect_stdout(io.StringIO()):
+        hp = upnp(False,False,None,None)
+    hp.setCache(None)
+
+    devices = [StandInDevice(serviceCount=serviceCount,actionCount=1) for i in range(deviceCount)]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            indexes = [hp.addHostByLocation(device.location) for device in devices]
+            hp.enumerateHosts(indexes)
+        targets = hp.findEventServices(indexes)
+
+        start = time.perf_counter()
+        results = hp.events.subscribe(targets)
+        elapsed = time.perf_counter() - start
+        assert not [error for (subscription,error) in results if error is not None]
+        print('Subscribed to %d services on %d devices in %.2fs (%d at a time)' % (len(results),deviceCount,elapsed,hp.HOST_WORKERS))
+
+        pool = ThreadPoolExecutor(max_workers=deviceCount)
+        start = time.perf_counter()
+        for i in range(rounds):
+            accepted = sum(pool.map(lambda device: device.notify({'Counter' : str(i)}),devices))
+            assert accepted == len(results)
+        elapsed = time.perf_counter() - start
+        pool.shutdown()
+        print('%d NOTIFYs received in %.2fs: %d events/s' % (hp.events.notifies,elapsed,hp.events.notifies / elapsed))
+        print('%d renewals scheduled on the timer wheel' % len(hp.events.wheel))
+
+        start = time.perf_counter()
+        hp.events.stop()
+        print('Unsubscribed in %.2fs' % (time.perf_counter() - start))
+    finally:
+        hp.httpPool.close()
+        for device in devices:
+            device.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#Memory used by the host inventory (ENUM_HOSTS): nested dicts, as hosts used to be stored, versus
+#the __slots__ host model, with and without service schemas shared between hosts of the same model.
+#Hosts are measured both as found by discovery and after 'host get'.
+
+import contextlib
+import gc
+import io
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from upnp import upnp
+from hostmodel import Host, SchemaTable, toDict
+from standin import buildSCPD, buildDescription
+from desc_parse import parseHost
+
+#Copy a structure of dicts and lists with new string objects, the way parsing each host's XML produced them
+def freshCopy(value):
+    if type(value) is dict:
+        return dict((freshCopy(key),freshCopy(val)) for (key,val) in value.items())
+    if type(value) is list:
+        return [freshCopy(val) for val in value]
+    if type(value) is str and len(value) > 1:
+        return (value + ' ')[:-1]
+    return value
+
+#A host as reported by discovery
+def discoveredHost(i):
+    address = '10.%d.%d.%d' % ((i >> 16) & 255,(i >> 8) & 255,i & 255)
+    return {
+        'name' : address + ':1900',
+        'dataComplete' : False,
+        'proto' : 'http://',
+        'xmlFile' : 'http://%s:1900/rootDesc.xml' % address,
+        'serverType' : None,
+        'upnpServer' : 'Linux/3.14 UPnP/1.0 MiniUPnPd/2.1',
+        'usn' : 'uuid:%08x-0000-1000-8000-001122334455::upnp:rootdevice' % i,
+        'iface' : 'eth0',
+        'deviceList' : {}
+    }
+
+#A host after 'host get', built from an enumerated template
+def enumeratedHost(i,template):
+    host = discoveredHost(i)
+    host['deviceList'] = template['deviceList']
+    host['dataComplete'] = True
+    return host
+
+#A host in the host model, with its service schemas shared through table
+def sharedHost(hostInfo,table):
+    hostInfo = Host.fromDict(hostInfo)
+    table.shareHost(hostInfo)
+    return hostInfo
+
+#Bytes retained by count hosts built with makeHost
+def measure(count,makeHost):
+    gc.collect()
+    tracemalloc.start()
+    hosts = {}
+    for i in range(count):
+        hosts[i] = makeHost(i)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del hosts
+    gc.collect()
+    return used
+
+def main():
+    services = 3
+    actions = 8
+    with contextlib.redirect_stdout(io.StringIO()):
+        hp = upnp(False,False,None,None)
+    hp.setCache(None)
+    template = toDict(parseHost(hp,buildDescription(services),buildSCPD('WANIPConnection',actions)))
+    print('Enumerated hosts: %d services of %d actions each' % (services,actions))
+    print('%-8s %-10s %10s %10s %10s' % ('hosts','state','dicts','slots','shared'))
+
+    #100k enumerated hosts stored as dicts would need about 6GB
+    for (state,counts) in (('found',(10000,100000)),('enumerated',(1000,10000))):
+        for count in counts:
+            if state == 'found':
+                makeHost = lambda i: freshCopy(discoveredHost(i))
+            else:
+                makeHost = lambda i: freshCopy(enumeratedHost(i,template))
+            table = SchemaTable()
+            dicts = measure(count,makeHost)
+            slots = measure(count,lambda i: Host.fromDict(makeHost(i)))
+            shared = measure(count,lambda i: sharedHost(makeHost(i),table))
+            print('%-8d %-10s %8.1fMB %8.1fMB %8.1fMB' % (count,state,dicts / 1048576.0,slots / 1048576.0,shared / 1048576.0))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#Benchmark for the inventory database: recording hosts as they are enumerated, with the writes batched
+#into transactions by the writer thread, against a transaction per host; and finding the hosts with a
+#given service through the database, against walking ENUM_HOSTS.
+
+import contextlib
+import copy
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from upnp import upnp
+from inventorydb import InventoryDB
+from standin import StandInDevice
+
+def newUPnP():
+    with contextlib.redirect_stdout(io.StringIO()):
+        hp = upnp(False,False,None,None)
+    hp.setCache(None)
+    return hp
+
+def main():
+    hostCount = 5000
+    hp = newUPnP()
+    device = StandInDevice(serviceCount=8,actionCount=10)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            index = hp.addHostByLocation(device.location)
+            hp.enumerateHosts([index])
+    finally:
+        device.stop()
+    template = hp.ENUM_HOSTS[index]
+    hosts = {}
+    for i in range(hostCount):
+        hostInfo = copy.deepcopy(template)
+        hostInfo['name'] = '10.%d.%d.%d:5000' % (i // 65536,(i // 256) % 256,i % 256)
+        hostInfo['xmlFile'] = 'http://%s/desc.xml' % hostInfo['name']
+        hosts[i] = hostInfo
+    hp.setHosts(hosts)
+    print('%d enumerated hosts, 8 services of 10 actions each' % hostCount)
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory,'single.db')
+    db = InventoryDB(path,hp.schemas)
+    start = time.perf_counter()
+    for index,hostInfo in hp.ENUM_HOSTS.items():
+        db.writeHosts([(index,hostInfo)])
+    print('%-40s %7.2fs' % ('transaction per host: write all',time.perf_counter() - start))
+    db.close()
+    os.remove(path)
+
+    path = os.path.join(directory,'batched.db')
+    hp.setDatabase(path)
+    hp.db.flush()
+    start = time.perf_counter()
+    for index in hp.ENUM_HOSTS:
+        hp.recordHost(index)
+    recorded = time.perf_counter() - start
+    hp.db.flush()
+    written = time.perf_counter() - start
+    print('%-40s %7.4fs' % ('batched: recordHost, caller time',recorded))
+    print('%-40s %7.2fs' % ('batched: write all',written))
+
+    serviceName = 'Service7'
+    start = time.perf_counter()
+    found = []
+    for index,hostInfo in hp.ENUM_HOSTS.items():
+        for deviceName,device in hostInfo['deviceList'].items():
+            if serviceName in device['services']:
+                found.append(index)
+    print('%-40s %7.4fs (%d hosts)' % ('walk ENUM_HOSTS for a service',time.perf_counter() - start,len(found)))
+    start = time.perf_counter()
+    (columns,rows) = hp.db.query('SELECT host FROM hostServices WHERE service LIKE ?',(serviceName,))
+    print('%-40s %7.4fs (%d hosts)' % ('query the database for a service',time.perf_counter() - start,len(rows)))
+
+    print('Database size: %.1f MB' % (os.path.getsize(path) / 1e6))
+    hp.setDatabase(None)
+    os.remove(path)
+    os.rmdir(directory)
+
+if __name__ == "__main__":
+    main()
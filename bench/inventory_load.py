@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#Benchmark for saving and loading a large host inventory: the pickle of ENUM_HOSTS that 'save data'
+#used to write, against the inventory file. Opening an inventory file only reads each host's summary,
+#so the host list is ready long before every host's device data has been read.
+
+import contextlib
+import copy
+import io
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from upnp import upnp
+from standin import StandInDevice
+
+def newUPnP():
+    with contextlib.redirect_stdout(io.StringIO()):
+        hp = upnp(False,False,None,None)
+    hp.setCache(None)
+    return hp
+
+def main():
+    hostCount = 5000
+    hp = newUPnP()
+    device = StandInDevice(serviceCount=8,actionCount=10)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            index = hp.addHostByLocation(device.location)
+            hp.enumerateHosts([index])
+    finally:
+        device.stop()
+    template = hp.ENUM_HOSTS[index]
+    hosts = {}
+    for i in range(hostCount):
+        hostInfo = copy.deepcopy(template)
+        hostInfo['name'] = '10.%d.%d.%d:5000' % (i // 65536,(i // 256) % 256,i % 256)
+        hostInfo['xmlFile'] = 'http://%s/desc.xml' % hostInfo['name']
+        hosts[i] = hostInfo
+    hp.setHosts(hosts)
+
+    directory = tempfile.mkdtemp()
+    picklePath = os.path.join(directory,'hosts.pickle')
+    inventoryPath = os.path.join(directory,'hosts.mir')
+    print('%d enumerated hosts, 8 services of 10 actions each' % hostCount)
+
+    start = time.perf_counter()
+    with open(picklePath,'wb') as fp:
+        pickle.dump(hp.ENUM_HOSTS,fp)
+    print('%-36s %7.2fs' % ('pickle: save',time.perf_counter() - start))
+    start = time.perf_counter()
+    with open(picklePath,'rb') as fp:
+        newUPnP().setHosts(pickle.load(fp))
+    print('%-36s %7.2fs' % ('pickle: load',time.perf_counter() - start))
+
+    start = time.perf_counter()
+    hp.saveInventory(inventoryPath)
+    print('%-36s %7.2fs' % ('inventory: save',time.perf_counter() - start))
+    start = time.perf_counter()
+    hp.recordHost(hostCount - 1)
+    print('%-36s %7.4fs' % ('inventory: record one host',time.perf_counter() - start))
+    hp.inventory.close()
+
+    loaded = newUPnP()
+    start = time.perf_counter()
+    loaded.loadInventory(inventoryPath)
+    print('%-36s %7.2fs' % ('inventory: open, host list ready',time.perf_counter() - start))
+    start = time.perf_counter()
+    loaded.ENUM_HOSTS[hostCount // 2]['deviceList']
+    print('%-36s %7.4fs' % ('inventory: read one host',time.perf_counter() - start))
+    start = time.perf_counter()
+    for hostInfo in loaded.ENUM_HOSTS.values():
+        hostInfo['deviceList']
+    print('%-36s %7.2fs' % ('inventory: read every host',time.perf_counter() - start))
+    loaded.inventory.close()
+
+    print('File sizes: pickle %.1f MB, inventory %.1f MB' % (os.path.getsize(picklePath) / 1e6,os.path.getsize(inventoryPath) / 1e6))
+    os.remove(picklePath)
+    os.remove(inventoryPath)
+    os.rmdir(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#Benchmark for dumping the port-mapping tables of many gateways: one GetGenericPortMappingEntry call
+#at a time, gateway after gateway (as with 'host send'), versus dumpPortMappings, which keeps several
+#indexes in flight to each gateway and reads several gateways at once.
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from upnp import upnp
+from httppool import HTTPStatusError
+from standin import StandInDevice, buildPortMappings
+
+#Read each table in turn, one entry at a time, until the gateway faults
+def sequentialDump(hp,targets):
+    tables = {}
+    for target in targets:
+        (index,deviceName,serviceName) = target
+        entries = []
+        while True:
+            try:
+                entries.append(hp.invokeAction(index,deviceName,serviceName,'GetGenericPortMappingEntry',{'NewPortMappingIndex' : str(len(entries))}))
+            except HTTPStatusError:
+                break
+        tables[target] = entries
+    return tables
+
+def pipelinedDump(hp,targets):
+    tables = dict((target,[]) for target in targets)
+    def onEntry(target,entryIndex,outputs):
+        assert entryIndex == len(tables[target])
+        tables[target].append(outputs)
+    results = hp.dumpPortMappings(targets,onEntry)
+    assert all(error is None for (count,error) in results.values())
+    return tables
+
+def run(hp,gateways,entries,delay):
+    devices = [StandInDevice(serviceCount=2,actionCount=2,delay=delay,portMappings=buildPortMappings(entries)) for i in range(gateways)]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            indexes = [hp.addHostByLocation(device.location) for device in devices]
+            hp.enumerateHosts(indexes)
+        targets = hp.findPortMappingServices(indexes)
+        assert len(targets) == gateways
+
+        print('%d gateways, %d port mappings each, %dms per request' % (gateways,entries,delay * 1000))
+        start = time.perf_counter()
+        sequential = sequentialDump(hp,targets)
+        sequentialTime = time.perf_counter() - start
+        print('%-24s %8.3fs' % ('one request at a time',sequentialTime))
+
+        for pipeline in (1,2,4,8):
+            hp.PORTMAP_PIPELINE = pipeline
+            #Start each depth without the connections the previous one left open
+            hp.httpPool.close()
+            start = time.perf_counter()
+            pipelined = pipelinedDump(hp,targets)
+            pipelinedTime = time.perf_counter() - start
+            assert pipelined == sequential
+            print('%-24s %8.3fs %6.1fx' % ('pipeline depth %d' % pipeline,pipelinedTime,sequentialTime / pipelinedTime))
+    finally:
+        hp.httpPool.close()
+        for device in devices:
+            device.stop()
+    print('')
+
+def main():
+    with contextlib.redirect_stdout(io.StringIO()):
+        hp = upnp(False,False,None,None)
+    hp.setCache(None)
+
+    #An embedded web server taking 5ms to answer each request
+    run(hp,1,200,0.005)
+    run(hp,4,100,0.005)
+    run(hp,16,40,0.005)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#Benchmark for enumerating one host ('host get'): service descriptions fetched serially versus
+#in parallel. Runs against a local stand-in device that delays every HTTP response.
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from upnp import upnp
+from standin import StandInDevice
+
+#Enumerate the stand-in device from scratch, returning the elapsed time and the host entry
+def enumerateHost(device,workers):
+    with contextlib.redirect_stdout(io.StringIO()):
+        hp = upnp(False,False,None,None)
+    hp.SCPD_WORKERS = workers
+    #Measure the network path, not the service description cache
+    hp.setCache(None)
+    hp.setHosts({})
+    hp.addHost({
+        'name' : device.name,
+        'dataComplete' : False,
+        'proto' : 'http://',
+        'xmlFile' : device.location,
+        'serverType' : None,
+        'upnpServer' : None,
+        'usn' : None,
+        'iface' : None,
+        'deviceList' : {}
+    })
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        (xmlHeaders,xmlData) = hp.getXML(device.location)
+        hp.getHostInfo(xmlData,xmlHeaders,0)
+    return (time.perf_counter() - start,hp.ENUM_HOSTS[0])
+
+def main():
+    services = 8
+    delay = 0.1
+    device = StandInDevice(serviceCount=services,actionCount=10,delay=delay)
+    print('Stand-in device: %d services, %dms per response' % (services,delay * 1000))
+
+    try:
+        (serialTime,serialHost) = enumerateHost(device,1)
+        (parallelTime,parallelHost) = enumerateHost(device,upnp.SCPD_WORKERS)
+    finally:
+        device.stop()
+
+    assert serialHost['dataComplete'] and serialHost == parallelHost
+    print('%-12s %8.3fs' % ('serial',serialTime))
+    print('%-12s %8.3fs' % ('parallel',parallelTime))
+    print('Speedup: %.1fx' % (serialTime / parallelTime))
+
+if __name__ == "__main__":
+    main()
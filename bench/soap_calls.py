@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#Benchmark for back-to-back SOAP calls to one host: a new TCP connection per call, read until the
+#envelope end tag (how sendSOAP used to work), versus sendSOAP over a persistent connection.
+
+import contextlib
+import io
+import os
+import re
+import sys
+import time
+from socket import socket, AF_INET, SOCK_STREAM
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from upnp import upnp
+from standin import StandInDevice
+
+SERVICE = 'urn:schemas-upnp-org:service:WANIPConnection:1'
+ACTION = 'GetExternalIPAddress'
+soapEnd = re.compile('<\/.*:envelope>')
+
+#One SOAP call over its own connection, as the old sendSOAP made it
+def connectPerCall(hostName,controlURL):
+    (host,port) = hostName.split(':')
+    soapBody = '<?xml version="1.0"?>\n'\
+        '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">\n'\
+        '<SOAP-ENV:Body>\n    <m:%s xmlns:m="%s">\n\n    </m:%s>\n</SOAP-ENV:Body>\n</SOAP-ENV:Envelope>' % (ACTION,SERVICE,ACTION)
+    soapRequest = 'POST %s HTTP/1.1\r\nHost: %s\r\nContent-Length: %d\r\nContent-Type: text/xml\r\nSOAPAction: "%s#%s"\r\n\r\n%s' % \
+        (controlURL,hostName,len(soapBody),SERVICE,ACTION,soapBody)
+
+    soapResponse = ''
+    sock = socket(AF_INET,SOCK_STREAM)
+    sock.connect((host,int(port)))
+    sock.send(soapRequest.encode())
+    while True:
+        data = sock.recv(8192)
+        if not data:
+            break
+        soapResponse += data.decode()
+        if soapEnd.search(soapResponse.lower()) != None:
+            break
+    sock.close()
+    return soapResponse.split('\r\n\r\n',1)[1]
+
+def run(label,calls,send):
+    start = time.perf_counter()
+    for i in range(calls):
+        body = send()
+    elapsed = time.perf_counter() - start
+    assert '<NewOut>1</NewOut>' in body
+    print('%-24s %8.3fs %8.0f calls/sec' % (label,elapsed,calls / elapsed))
+    return elapsed
+
+def main():
+    calls = 2000
+    with contextlib.redirect_stdout(io.StringIO()):
+        hp = upnp(False,False,None,None)
+
+    #Each new connection to the second device costs an extra 2ms, as on a slow embedded web server
+    for (chunked,connectDelay) in ((False,0),(False,0.002),(True,0)):
+        device = StandInDevice(serviceCount=1,actionCount=1,chunked=chunked,connectDelay=connectDelay)
+        try:
+            print('%d calls to %s, %s responses, %dms connection setup' % (calls,ACTION,'chunked' if chunked else 'Content-Length',connectDelay * 1000))
+            if not chunked:
+                perCall = run('connection per call',calls,lambda: connectPerCall(device.name,'/ctl/0'))
+            connections = device.connections
+            persistent = run('persistent connection',calls,lambda: hp.sendSOAP(device.name,SERVICE,'/ctl/0',ACTION,{}))
+            print('%-24s %8d' % ('connections opened',device.connections - connections))
+            if not chunked:
+                print('Speedup: %.1fx' % (perCall / persistent))
+        finally:
+            hp.httpPool.close()
+            device.stop()
+        print('')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#Benchmark for building SOAP requests: the envelope and headers formatted from scratch for every
+#call (how requestSOAP used to build them), versus filling in the action's compiled SOAPEnvelope.
+
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from soapenvelope import SOAPEnvelope
+
+SERVICE = 'urn:schemas-upnp-org:service:WANIPConnection:1'
+ACTION = 'AddPortMapping'
+ARGUMENTS = {
+    'NewRemoteHost' : ('','string'),
+    'NewExternalPort' : ('8080','ui2'),
+    'NewProtocol' : ('TCP','string'),
+    'NewInternalPort' : ('80','ui2'),
+    'NewInternalClient' : ('192.168.1.20','string'),
+    'NewEnabled' : ('1','boolean'),
+    'NewPortMappingDescription' : ('web server','string'),
+    'NewLeaseDuration' : ('0','ui4')
+}
+
+#The old request building, which didn't escape argument values
+def formatRequest(serviceType,actionName,actionArguments):
+    argList = ''
+    for arg,(val,dt) in actionArguments.items():
+        argList += '<%s>%s</%s>' % (arg,val,arg)
+    soapBody =     '<?xml version="1.0"?>\n'\
+            '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">\n'\
+            '<SOAP-ENV:Body>\n'\
+            '    <m:%s xmlns:m="%s">\n'\
+            '%s\n'\
+            '    </m:%s>\n'\
+            '</SOAP-ENV:Body>\n'\
+            '</SOAP-ENV:Envelope>' % (actionName,serviceType,argList,actionName)
+    headers =     {
+            'Content-Type':'text/xml; charset="utf-8"',
+            'SOAPAction':'"%s#%s"' % (serviceType,actionName)
+            }
+    return (soapBody.encode('utf-8'),headers)
+
+#Look up the action's template, as requestSOAP does, and fill it in
+def renderRequest(envelopes,serviceType,actionName,actionArguments):
+    key = (serviceType,actionName,tuple(actionArguments))
+    envelope = envelopes.get(key)
+    if envelope is None:
+        envelope = envelopes.setdefault(key,SOAPEnvelope(serviceType,actionName,tuple(actionArguments)))
+    return (envelope.render(actionArguments.values()),envelope.headers)
+
+def timeRequests(calls,build):
+    start = time.perf_counter()
+    for i in range(calls):
+        build()
+    return time.perf_counter() - start
+
+def main():
+    calls = 100000
+    envelopes = {}
+    assert renderRequest(envelopes,SERVICE,ACTION,ARGUMENTS) == formatRequest(SERVICE,ACTION,ARGUMENTS)
+
+    #Best of several runs, to keep other processes out of the timings
+    print('%d %s requests with %d arguments' % (calls,ACTION,len(ARGUMENTS)))
+    formatted = min(timeRequests(calls,lambda: formatRequest(SERVICE,ACTION,ARGUMENTS)) for i in range(5))
+    print('%-24s %8.3fs %8.2fus/call' % ('formatted per call',formatted,formatted * 1e6 / calls))
+    rendered = min(timeRequests(calls,lambda: renderRequest(envelopes,SERVICE,ACTION,ARGUMENTS)) for i in range(5))
+    print('%-24s %8.3fs %8.2fus/call' % ('compiled template',rendered,rendered * 1e6 / calls))
+    print('Speedup: %.1fx' % (formatted / rendered))
+
+    #Values with XML markup in them used to break the request
+    arguments = dict(ARGUMENTS)
+    arguments['NewPortMappingDescription'] = ('R&D <test>','string')
+    for (label,body) in (('formatted per call',formatRequest(SERVICE,ACTION,arguments)[0]),('compiled template',renderRequest(envelopes,SERVICE,ACTION,arguments)[0])):
+        try:
+            ET.fromstring(body)
+            wellFormed = 'well-formed'
+        except ET.ParseError as e:
+            wellFormed = 'malformed (%s)' % e
+        print("%-24s %s" % (label,"description 'R&D <test>' is %s" % wellFormed))
+
+if __name__ == "__main__":
+    main()
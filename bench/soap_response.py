@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#Benchmark for reading large SOAP responses, such as ContentDirectory Browse results from media
+#servers. The old receive loop appended each recv() to a string and re-ran the envelope regex over
+#a lower-cased copy of the whole response after every one; sendSOAP now reads the body as HTTP
+#frames it and parses the envelope incrementally.
+
+import contextlib
+import io
+import os
+import re
+import sys
+import time
+from socket import socket, AF_INET, SOCK_STREAM
+from xml.sax.saxutils import escape
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from upnp import upnp
+from standin import StandInDevice
+
+SERVICE = 'urn:schemas-upnp-org:service:ContentDirectory:1'
+ACTION = 'Browse'
+soapEnd = re.compile('<\/.*:envelope>')
+
+#Escaped DIDL-Lite listing of about the given size, as returned in a Browse Result
+def buildResult(size):
+    item = '<item id="%d" parentID="0" restricted="1"><dc:title>Track %d</dc:title><upnp:class>object.item.audioItem.musicTrack</upnp:class>'\
+        '<res protocolInfo="http-get:*:audio/mpeg:*" size="4194304">http://192.168.1.10:8200/MediaItems/%d.mp3</res></item>'
+    items = []
+    length = 0
+    while length < size:
+        items.append(item % (len(items),len(items),len(items)))
+        length += len(items[-1])
+    didl = '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" xmlns:dc="http://purl.org/dc/elements/1.1/" '\
+        'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/">%s</DIDL-Lite>' % ''.join(items)
+    return (escape(didl),len(items))
+
+#The old sendSOAP receive loop and tag extraction, over a new connection
+def legacyCall(hp,hostName,controlURL):
+    (host,port) = hostName.split(':')
+    soapBody = '<?xml version="1.0"?>\n'\
+        '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">\n'\
+        '<SOAP-ENV:Body>\n    <m:%s xmlns:m="%s">\n\n    </m:%s>\n</SOAP-ENV:Body>\n</SOAP-ENV:Envelope>' % (ACTION,SERVICE,ACTION)
+    soapRequest = 'POST %s HTTP/1.1\r\nHost: %s\r\nContent-Length: %d\r\nContent-Type: text/xml\r\nSOAPAction: "%s#%s"\r\n\r\n%s' % \
+        (controlURL,hostName,len(soapBody),SERVICE,ACTION,soapBody)
+
+    soapResponse = ''
+    sock = socket(AF_INET,SOCK_STREAM)
+    sock.connect((host,int(port)))
+    sock.send(soapRequest.encode())
+    while True:
+        data = sock.recv(8192)
+        if not data:
+            break
+        soapResponse += data.decode()
+        if soapEnd.search(soapResponse.lower()) != None:
+            break
+    sock.close()
+    body = soapResponse.split('\r\n\r\n',1)[1]
+    return hp.extractSingleTag(body,'Result')
+
+def streamingCall(hp,hostName,controlURL):
+    soapResponse = hp.callSOAP(hostName,SERVICE,controlURL,ACTION,{})
+    return soapResponse.getValue('Result')
+
+def main():
+    with contextlib.redirect_stdout(io.StringIO()):
+        hp = upnp(False,False,None,None)
+
+    print('%-8s %8s %12s %12s' % ('DIDL','items','old loop','streaming'))
+    for megabytes in (1,2,4,16):
+        (result,items) = buildResult(megabytes * 1024 * 1024)
+        device = StandInDevice(serviceCount=1,actionCount=1,outArgs=(('Result',result),('NumberReturned',items),('TotalMatches',items),('UpdateID',1)))
+        try:
+            start = time.perf_counter()
+            didl = streamingCall(hp,device.name,'/ctl/0')
+            streaming = time.perf_counter() - start
+            assert didl.startswith('<DIDL-Lite') and didl.count('<item ') == items
+
+            #The old loop's cost grows with the square of the response size
+            if megabytes <= 4:
+                start = time.perf_counter()
+                assert legacyCall(hp,device.name,'/ctl/0') == result
+                legacy = '%10.2fs' % (time.perf_counter() - start)
+            else:
+                legacy = '%11s' % '-'
+        finally:
+            hp.httpPool.close()
+            device.stop()
+        print('%-8s %8d %12s %10.2fs' % ('%dMB' % megabytes,items,legacy,streaming))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#Microbenchmark for SSDP header parsing: the original decode + parseHeader-per-header approach
+#versus the single-pass upnp.parseSSDPHeaders. Reports packets/sec for a mix of NOTIFY and reply packets.
+
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from upnp import upnp
+
+PACKETS = [
+    b"NOTIFY * HTTP/1.1\r\n"
+    b"HOST: 239.255.255.250:1900\r\n"
+    b"CACHE-CONTROL: max-age=1800\r\n"
+    b"LOCATION: http://192.168.1.1:2869/IGatewayDeviceDescDoc\r\n"
+    b"NT: urn:schemas-upnp-org:service:WANIPConnection:1\r\n"
+    b"NTS: ssdp:alive\r\n"
+    b"SERVER: VxWorks/5.4.2 UPnP/1.0 iGateway/1.1\r\n"
+    b"USN: uuid:34bc065f-e59a-1612-9be5-c67e816b4bfb::urn:schemas-upnp-org:service:WANIPConnection:1\r\n"
+    b"BOOTID.UPNP.ORG: 1\r\n"
+    b"CONFIGID.UPNP.ORG: 1337\r\n"
+    b"\r\n",
+    b"HTTP/1.1 200 OK\r\n"
+    b"CACHE-CONTROL: max-age=120\r\n"
+    b"DATE: Sat, 18 Oct 2026 12:00:00 GMT\r\n"
+    b"EXT:\r\n"
+    b"LOCATION: http://192.168.1.20:49152/description.xml\r\n"
+    b"SERVER: Linux/3.14 UPnP/1.0 IpBridge/1.26.0\r\n"
+    b"ST: upnp:rootdevice\r\n"
+    b"USN: uuid:2f402f80-da50-11e1-9b23-001788255acc::upnp:rootdevice\r\n"
+    b"\r\n"
+]
+
+#The parsing work done by parseSSDPInfo before the single-pass parser was added
+def legacyParse(hp,data_bytes):
+    knownHeaders = {
+        'NOTIFY' : 'notification',
+        'HTTP/1.1 200 OK' : 'reply'
+    }
+    data = data_bytes.decode("utf-8")
+    for text,messageType in knownHeaders.items():
+        if data.upper().startswith(text):
+            break
+        else:
+            messageType = False
+    if messageType == False:
+        return (False,{})
+
+    headers = {}
+    for header in ['LOCATION','SERVER','ST','NT','NTS','USN','CACHE-CONTROL','BOOTID.UPNP.ORG']:
+        headers[header] = hp.parseHeader(data,header)
+    return (messageType,headers)
+
+def newParse(hp,data_bytes):
+    return hp.parseSSDPHeaders(data_bytes)
+
+def bench(name,func,hp,count):
+    packets = PACKETS * (count // len(PACKETS))
+    start = time.perf_counter()
+    for packet in packets:
+        func(hp,packet)
+    elapsed = time.perf_counter() - start
+    rate = len(packets) / elapsed
+    print('%-22s %10.0f packets/sec' % (name,rate))
+    return rate
+
+def main():
+    count = 200000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    #Bypass socket setup; only the parsing methods are exercised
+    hp = upnp.__new__(upnp)
+
+    #Sanity check: both parsers must agree on the headers the old code extracted
+    for packet in PACKETS:
+        (oldType,oldHeaders) = legacyParse(hp,packet)
+        (newType,newHeaders) = newParse(hp,packet)
+        assert oldType == newType
+        assert oldHeaders['LOCATION'] == newHeaders.get('LOCATION')
+        assert oldHeaders['SERVER'] == newHeaders.get('SERVER')
+        assert oldHeaders['USN'] == newHeaders.get('USN')
+
+    before = bench('legacy parseHeader',legacyParse,hp,count)
+    after = bench('parseSSDPHeaders',newParse,hp,count)
+    print('Speedup: %.1fx' % (after / before))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#Local stand-in UPnP device for the benchmarks: serves a generated device description and
+#service descriptions (SCPDs) over HTTP, and answers SOAP action requests, with an optional
+#artificial delay per request. Services accept GENA event subscriptions, and notify() sends events
+#to the subscribers.
+
+import http.client
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#Build a service description with the given number of actions, each with a few arguments
+def buildSCPD(serviceName,actionCount):
+    actions = ''
+    variables = ''
+    for i in range(actionCount):
+        actions += \
+            '<action><name>%sAction%d</name><argumentList>'\
+            '<argument><name>NewIn%d</name><direction>in</direction><relatedStateVariable>Var%d</relatedStateVariable></argument>'\
+            '<argument><name>NewOut%d</name><direction>out</direction><relatedStateVariable>Var%d</relatedStateVariable></argument>'\
+            '</argumentList></action>' % (serviceName,i,i,i,i,i)
+        variables += \
+            '<stateVariable sendEvents="no"><name>Var%d</name><dataType>ui4</dataType>'\
+            '<allowedValueRange><minimum>0</minimum><maximum>%d</maximum></allowedValueRange></stateVariable>' % (i,i + 100)
+    variables += \
+        '<stateVariable sendEvents="yes"><name>Mode</name><dataType>string</dataType>'\
+        '<allowedValueList><allowedValue>TCP</allowedValue><allowedValue>UDP</allowedValue></allowedValueList></stateVariable>'
+
+    return ('<?xml version="1.0"?>\n'\
+        '<scpd xmlns="urn:schemas-upnp-org:service-1-0"><specVersion><major>1</major><minor>0</minor></specVersion>'\
+        '<actionList>%s</actionList><serviceStateTable>%s</serviceStateTable></scpd>' % (actions,variables)).encode()
+
+#Build a service description whose only action, GetState, returns the given number of state variables
+#(NewVar0.. as Var0..), none of them evented
+def buildGetterSCPD(variableCount):
+    arguments = ''
+    variables = ''
+    for i in range(variableCount):
+        arguments += '<argument><name>NewVar%d</name><direction>out</direction><relatedStateVariable>Var%d</relatedStateVariable></argument>' % (i,i)
+        variables += '<stateVariable sendEvents="no"><name>Var%d</name><dataType>ui4</dataType></stateVariable>' % i
+
+    return ('<?xml version="1.0"?>\n'\
+        '<scpd xmlns="urn:schemas-upnp-org:service-1-0"><specVersion><major>1</major><minor>0</minor></specVersion>'\
+        '<actionList><action><name>GetState</name><argumentList>%s</argumentList></action></actionList>'\
+        '<serviceStateTable>%s</serviceStateTable></scpd>' % (arguments,variables)).encode()
+
+PORT_MAPPING_ARGS = (('NewRemoteHost','string'),('NewExternalPort','ui2'),('NewProtocol','string'),('NewInternalPort','ui2'),
+    ('NewInternalClient','string'),('NewEnabled','boolean'),('NewPortMappingDescription','string'),('NewLeaseDuration','ui4'))
+
+#Build a service description offering GetGenericPortMappingEntry, as an IGD's WANIPConnection does
+def buildPortMappingSCPD():
+    arguments = '<argument><name>NewPortMappingIndex</name><direction>in</direction><relatedStateVariable>PortMappingNumberOfEntries</relatedStateVariable></argument>'
+    variables = '<stateVariable sendEvents="yes"><name>PortMappingNumberOfEntries</name><dataType>ui2</dataType></stateVariable>'
+    for (name,dataType) in PORT_MAPPING_ARGS:
+        variable = name.replace('New','',1)
+        arguments += '<argument><name>%s</name><direction>out</direction><relatedStateVariable>%s</relatedStateVariable></argument>' % (name,variable)
+        variables += '<stateVariable sendEvents="no"><name>%s</name><dataType>%s</dataType></stateVariable>' % (variable,dataType)
+
+    return ('<?xml version="1.0"?>\n'\
+        '<scpd xmlns="urn:schemas-upnp-org:service-1-0"><specVersion><major>1</major><minor>0</minor></specVersion>'\
+        '<actionList><action><name>GetGenericPortMappingEntry</name><argumentList>%s</argumentList></action></actionList>'\
+        '<serviceStateTable>%s</serviceStateTable></scpd>' % (arguments,variables)).encode()
+
+#Build a port-mapping table with the given number of entries, as lists of (name,value) output arguments
+def buildPortMappings(count):
+    mappings = []
+    for i in range(count):
+        values = ('',10000 + i,('TCP','UDP')[i % 2],20000 + i,'192.168.1.%d' % (2 + i % 250),1,'mapping %d' % i,0)
+        mappings.append(tuple(zip([name for (name,dataType) in PORT_MAPPING_ARGS],values)))
+    return mappings
+
+#Build a SOAP fault carrying a UPnP error
+def buildSOAPFault(errorCode,errorDescription):
+    return ('<?xml version="1.0"?>\n'\
+        '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'\
+        '<s:Body><s:Fault><faultcode>s:Client</faultcode><faultstring>UPnPError</faultstring><detail>'\
+        '<UPnPError xmlns="urn:schemas-upnp-org:control-1-0"><errorCode>%d</errorCode><errorDescription>%s</errorDescription></UPnPError>'\
+        '</detail></s:Fault></s:Body></s:Envelope>' % (errorCode,errorDescription)).encode()
+
+#Build a device description listing the given number of services
+def buildDescription(serviceCount):
+    services = ''
+    for i in range(serviceCount):
+        services += \
+            '<service><serviceType>urn:schemas-upnp-org:service:Service%d:1</serviceType>'\
+            '<serviceId>urn:upnp-org:serviceId:Service%d</serviceId><controlURL>/ctl/%d</controlURL>'\
+            '<eventSubURL>/evt/%d</eventSubURL><SCPDURL>/scpd/%d.xml</SCPDURL></service>' % (i,i,i,i,i)
+
+    return ('<?xml version="1.0"?>\n'\
+        '<root xmlns="urn:schemas-upnp-org:device-1-0"><specVersion><major>1</major><minor>0</minor></specVersion>'\
+        '<device><deviceType>urn:schemas-upnp-org:device:BenchDevice:1</deviceType><friendlyName>Bench</friendlyName>'\
+        '<manufacturer>Miranda</manufacturer><modelName>Stand-in</modelName><UDN>uuid:bench</UDN>'\
+        '<serviceList>%s</serviceList></device></root>' % services).encode()
+
+#Build the body of an event NOTIFY from a dict of state variable names and values
+def buildPropertySet(variables):
+    properties = ''.join('<e:property><%s>%s</%s></e:property>' % (name,value,name) for (name,value) in variables.items())
+    return ('<?xml version="1.0"?>\n'\
+        '<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">%s</e:propertyset>' % properties).encode()
+
+#Build the SOAP response to an action: every output argument is set to value
+def buildSOAPResponse(serviceType,actionName,outArgs):
+    args = ''.join('<%s>%s</%s>' % (name,value,name) for (name,value) in outArgs)
+    return ('<?xml version="1.0"?>\n'\
+        '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'\
+        '<s:Body><u:%sResponse xmlns:u="%s">%s</u:%sResponse></s:Body></s:Envelope>' % (actionName,serviceType,args,actionName)).encode()
+
+class StandInDevice:
+    #SOAP responses carry these output arguments; chunked sends them with chunked transfer encoding.
+    #connectDelay is added to each new connection, like an embedded server forking a handler per connection.
+    #If portMappings is given, the first service answers GetGenericPortMappingEntry from it instead.
+    #Setting hang makes the device stop answering requests, as if it had crashed with its sockets open.
+    #Event subscriptions are granted for eventTimeout seconds. QueryStateVariable answers from stateValues
+    #(every variable is 0 unless set there), or with a fault if queryable is cleared.
+    def __init__(self,serviceCount=8,actionCount=10,delay=0.0,outArgs=(('NewOut','1'),),chunked=False,connectDelay=0.0,portMappings=None,eventTimeout=1800):
+        self.delay = delay
+        self.hang = False
+        self.connectDelay = connectDelay
+        self.outArgs = outArgs
+        self.chunked = chunked
+        self.requests = 0
+        self.connections = 0
+        self.eventTimeout = eventTimeout
+        self.stateValues = {}
+        self.queryable = True
+        #Event subscribers by SID: [event path,callback URL,next SEQ]
+        self.subscribers = {}
+        self.subscriptions = 0
+        self.renewals = 0
+        self.subscriberLock = threading.Lock()
+        self.documents = {'/desc.xml' : buildDescription(serviceCount)}
+        for i in range(serviceCount):
+            self.documents['/scpd/%d.xml' % i] = buildSCPD('Service%d' % i,actionCount)
+        self.portMappings = portMappings
+        if portMappings is not None:
+            self.documents['/scpd/0.xml'] = buildPortMappingSCPD()
+
+        device = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            #Headers and body are written separately; don't let Nagle hold the body back on kept-alive connections
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                device.connections += 1
+                if device.connectDelay:
+                    time.sleep(device.connectDelay)
+                BaseHTTPRequestHandler.setup(self)
+
+            def do_GET(self):
+                device.requests += 1
+                device.waitWhileHung()
+                if device.delay:
+                    time.sleep(device.delay)
+                body = device.documents.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type','text/xml')
+                self.send_header('Content-Length',str(len(body)))
+                self.send_header('Server','StandIn/1.0 UPnP/1.0')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                device.requests += 1
+                request = self.rfile.read(int(self.headers.get('Content-Length',0)))
+                device.waitWhileHung()
+                if device.delay:
+                    time.sleep(device.delay)
+                (serviceType,actionName) = self.headers.get('SOAPAction','"#"').strip('"').split('#',1)
+                status = 200
+                if actionName == 'QueryStateVariable':
+                    varName = re.search(rb'<varName>([^<]*)<',request).group(1).decode()
+                    if device.queryable:
+                        body = buildSOAPResponse(serviceType,actionName,(('return',device.stateValues.get(varName,'0')),))
+                    else:
+                        (status,body) = (500,buildSOAPFault(401,'Invalid Action'))
+                elif actionName == 'GetGenericPortMappingEntry' and device.portMappings is not None:
+                    entryIndex = int(re.search(rb'<NewPortMappingIndex>(\d+)<',request).group(1))
+                    if entryIndex < len(device.portMappings):
+                        body = buildSOAPResponse(serviceType,actionName,device.portMappings[entryIndex])
+                    else:
+                        (status,body) = (500,buildSOAPFault(713,'SpecifiedArrayIndexInvalid'))
+                else:
+                    body = buildSOAPResponse(serviceType,actionName,device.outArgs)
+                self.send_response(status)
+                self.send_header('Content-Type','text/xml; charset="utf-8"')
+                if device.chunked:
+                    self.send_header('Transfer-Encoding','chunked')
+                    self.end_headers()
+                    half = len(body) // 2
+                    for chunk in (body[:half],body[half:],b''):
+                        self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk),chunk))
+                else:
+                    self.send_header('Content-Length',str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            def do_SUBSCRIBE(self):
+                device.requests += 1
+                device.waitWhileHung()
+                sid = self.headers.get('SID')
+                with device.subscriberLock:
+                    if sid:
+                        if sid not in device.subscribers:
+                            self.send_error(412)
+                            return
+                        device.renewals += 1
+                    else:
+                        callback = self.headers.get('CALLBACK','').strip('<>')
+                        if self.headers.get('NT') != 'upnp:event' or not callback:
+                            self.send_error(412)
+                            return
+                        device.subscriptions += 1
+                        sid = 'uuid:standin-%d-%d' % (device.port,device.subscriptions)
+                        device.subscribers[sid] = [self.path,callback,0]
+                self.send_response(200)
+                self.send_header('SID',sid)
+                self.send_header('TIMEOUT','Second-%d' % device.eventTimeout)
+                self.send_header('Content-Length','0')
+                self.end_headers()
+
+            def do_UNSUBSCRIBE(self):
+                device.requests += 1
+                with device.subscriberLock:
+                    subscriber = device.subscribers.pop(self.headers.get('SID'),None)
+                if subscriber is None:
+                    self.send_error(412)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length','0')
+                self.end_headers()
+
+            def log_message(self,format,*args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1',0),Handler)
+        self.server.daemon_threads = True
+        #Clients that give up on a hung device leave handlers writing to closed sockets
+        self.server.handle_error = lambda request,clientAddress: None
+        self.port = self.server.server_address[1]
+        self.name = '127.0.0.1:%d' % self.port
+        self.location = 'http://%s/desc.xml' % self.name
+        self.thread = threading.Thread(target=self.server.serve_forever,daemon=True)
+        self.thread.start()
+
+    def waitWhileHung(self):
+        while self.hang:
+            time.sleep(0.05)
+
+    #Send an event with the given state variables to every subscriber, one NOTIFY at a time over a
+    #kept-alive connection per callback host; returns the number of NOTIFYs accepted
+    def notify(self,variables):
+        body = buildPropertySet(variables)
+        with self.subscriberLock:
+            subscribers = []
+            for sid,subscriber in self.subscribers.items():
+                subscribers.append((sid,subscriber[1],subscriber[2]))
+                subscriber[2] += 1
+        accepted = 0
+        connections = {}
+        try:
+            for (sid,callback,seq) in subscribers:
+                parts = urlsplit(callback)
+                conn = connections.get(parts.netloc)
+                if conn is None:
+                    conn = connections[parts.netloc] = http.client.HTTPConnection(parts.netloc,timeout=5)
+                headers = {'Content-Type' : 'text/xml; charset="utf-8"','NT' : 'upnp:event','NTS' : 'upnp:propchange','SID' : sid,'SEQ' : str(seq)}
+                conn.request('NOTIFY',parts.path,body,headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status == 200:
+                    accepted += 1
+        finally:
+            for conn in connections.values():
+                conn.close()
+        return accepted
+
+    def stop(self):
+        self.hang = False
+        self.server.shutdown()
+        self.server.server_close()
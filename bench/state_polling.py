@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#Benchmark for the state poller: poll 10,000 non-evented state variables (100 hosts with 10 services of
+#10 variables each, read by one getter action per service) at a 30 second interval, and measure the CPU
+#time Miranda spends on it. The stand-in devices run in a separate process, so that their CPU time
+#isn't counted; one variable of every service changes every few seconds.
+#Usage: state_polling.py [interval] [seconds to run]
+
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+from upnp import upnp
+from standin import StandInDevice, buildGetterSCPD
+
+HOSTS = 100
+SERVICES = 10
+VARIABLES = 10
+
+#Run the stand-in devices until told to stop, changing Var0 of every device every few seconds
+def serveDevices(conn):
+    devices = []
+    for i in range(HOSTS):
+        device = StandInDevice(serviceCount=SERVICES,actionCount=1)
+        for j in range(SERVICES):
+            device.documents['/scpd/%d.xml' % j] = buildGetterSCPD(VARIABLES)
+        devices.append(device)
+    counter = 0
+    conn.send([device.location for device in devices])
+    while not conn.poll(3):
+        counter += 1
+        for device in devices:
+            device.outArgs = tuple(('NewVar%d' % i,counter if i == 0 else i) for i in range(VARIABLES))
+    for device in devices:
+        device.stop()
+
+def main():
+    interval = 30
+    duration = 30
+    if len(sys.argv) > 1:
+        interval = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        duration = float(sys.argv[2])
+
+    (conn,childConn) = multiprocessing.Pipe()
+    child = multiprocessing.Process(target=serveDevices,args=(childConn,))
+    child.start()
+    try:
+        locations = conn.recv()
+        with contextlib.redirect_stdout(io.StringIO()):
+            hp = upnp(False,False,None,None)
+            hp.setCache(None)
+            indexes = [hp.addHostByLocation(location) for location in locations]
+            hp.enumerateHosts(indexes)
+
+        hp.poller.INTERVAL = interval
+        startCPU = time.process_time()
+        start = time.time()
+        variables = hp.poller.start(hp.findStateServices(indexes))
+        time.sleep(duration)
+        hp.poller.stop()
+        elapsed = time.time() - start
+        cpu = time.process_time() - startCPU
+
+        stats = hp.poller.stats()
+        print('Polled %d variables on %d hosts every %ss for %.0fs' % (variables,stats['hosts'],interval,elapsed))
+        print('%d requests, %d variables read, %d not read, %d polls skipped, %d changes' % (stats['requests'],stats['reads'],stats['failures'],stats['skipped'],stats['changes']))
+        print('%.2fs CPU: %.1f%% of one core, %.0fus per variable read' % (cpu,100 * cpu / elapsed,1000000 * cpu / max(1,stats['reads'])))
+        hp.httpPool.close()
+    finally:
+        conn.send(None)
+        child.join()
+
+if __name__ == "__main__":
+    main()
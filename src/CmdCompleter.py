@@ -1,4 +1,26 @@
 import readline
+from collections.abc import Mapping
+
+# A completion tree that is only built when it is first traversed. Used for trees that would otherwise
+# read every host's device and service data when hosts are loaded lazily from an inventory file.
+class LazyTree(Mapping):
+    def __init__(self, build):
+        self.build = build
+        self.tree = None
+
+    def getTree(self):
+        if self.tree is None:
+            self.tree = self.build()
+        return self.tree
+
+    def __getitem__(self, key):
+        return self.getTree()[key]
+
+    def __iter__(self):
+        return iter(self.getTree())
+
+    def __len__(self):
+        return len(self.getTree())
 
 # Most of the CmdCompleter class was originally written by John Kenyan
 # It serves to tab-complete commands inside the program's shell
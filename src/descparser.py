@@ -0,0 +1,126 @@
+import xml.etree.ElementTree as ET
+
+#Streaming parsers for UPnP device and service descriptions.
+#
+#A description is read in one pass with an incremental (iterparse-style) parser. Only the elements
+#named in a spec become Records; every other element is discarded as soon as it has been seen, so
+#memory use does not grow with the size of the document. Records answer the same questions the old
+#minidom code asked with getElementsByTagName: all descendants of a given kind (in document order),
+#and the text of the first descendant with a given tag.
+
+#Records in a spec: kind -> (captureTexts,collectAll,collectFirst)
+#    captureTexts: remember the text of the first descendant element of each tag
+#    collectAll:   descendant kinds to collect every occurrence of
+#    collectFirst: descendant kinds to collect only the first occurrence of
+#The None kind is the document itself.
+DESCRIPTION_SPEC = {
+    None : (False,('device',),()),
+    'device' : (True,(),('serviceList',)),
+    'serviceList' : (False,('service',),()),
+    'service' : (True,(),())
+}
+
+SCPD_SPEC = {
+    None : (False,(),('actionList','serviceStateTable')),
+    'actionList' : (False,('action',),()),
+    'action' : (True,(),('argumentList',)),
+    'argumentList' : (False,('argument',),()),
+    'argument' : (True,(),()),
+    'serviceStateTable' : (False,('stateVariable',),()),
+    'stateVariable' : (True,(),('allowedValueList','allowedValueRange')),
+    'allowedValueList' : (False,('allowedValue',),()),
+    'allowedValue' : (False,(),()),
+    'allowedValueRange' : (True,(),())
+}
+
+#Size of the chunks fed to the parser
+CHUNK_SIZE = 64 * 1024
+
+class Record:
+    __slots__ = ('kind','text','texts','kids','attributes')
+
+    def __init__(self,kind):
+        self.kind = kind
+        self.text = None
+        self.texts = {}
+        self.kids = {}
+        self.attributes = {}
+
+    #All collected descendants of the given kind, in document order
+    def children(self,kind):
+        return self.kids.get(kind,[])
+
+    #Text of the first descendant element with the given tag. Like the DOM lookups this replaces,
+    #this raises if there is no such element or if it has no text.
+    def firstText(self,tag):
+        text = self.texts[tag]
+        if text is None:
+            raise ValueError('<%s> has no text' % tag)
+        return text
+
+    #Text of this record's own element; raises if it has none
+    def getText(self):
+        if self.text is None:
+            raise ValueError('<%s> has no text' % self.kind)
+        return self.text
+
+#Strip the namespace from an ElementTree tag
+def localName(tag):
+    if tag[:1] == '{':
+        return tag.rsplit('}',1)[1]
+    return tag
+
+#Parse a description in a single streaming pass, returning the document Record
+def streamParse(data,spec):
+    top = Record(None)
+    records = [top]
+    owners = []
+    elements = []
+    parser = ET.XMLPullParser(('start','end'))
+
+    def handle(events):
+        for (event,elem) in events:
+            tag = localName(elem.tag)
+            if event == 'start':
+                record = None
+                for parent in records:
+                    (captureTexts,collectAll,collectFirst) = spec[parent.kind]
+                    if tag in collectAll or (tag in collectFirst and tag not in parent.kids):
+                        if record is None:
+                            record = Record(tag)
+                            record.attributes = elem.attrib
+                        parent.kids.setdefault(tag,[]).append(record)
+                owners.append(record)
+                if record is not None:
+                    records.append(record)
+                elements.append(elem)
+            else:
+                record = owners.pop()
+                if record is not None:
+                    records.pop()
+                    record.text = elem.text
+
+                text = elem.text
+                for parent in records:
+                    if spec[parent.kind][0] and tag not in parent.texts:
+                        parent.texts[tag] = text
+
+                #Detach the finished element from its parent so it can be freed; it is always the last child
+                elements.pop()
+                if elements:
+                    del elements[-1][-1]
+
+    for offset in range(0,len(data),CHUNK_SIZE):
+        parser.feed(data[offset:offset + CHUNK_SIZE])
+        handle(parser.read_events())
+    parser.close()
+    handle(parser.read_events())
+    return top
+
+#Parse a device description (the XML file at a host's LOCATION)
+def parseDescription(data):
+    return streamParse(data,DESCRIPTION_SPEC)
+
+#Parse a service description (SCPD)
+def parseSCPD(data):
+    return streamParse(data,SCPD_SPEC)
@@ -0,0 +1,142 @@
+import asyncio
+from socket import SOL_SOCKET, SO_RCVBUF
+
+#Non-blocking SSDP discovery engine used by the msearch and pcap commands.
+#All sockets are serviced from a single asyncio event loop; each time a socket becomes
+#readable, every datagram queued on it is drained and handed to upnp.parseSSDPInfo.
+class DiscoveryEngine:
+    #Upper bound on datagrams read from one socket per wakeup, so one busy socket can't starve the others
+    MAX_DRAIN = 512
+    #Kernel receive buffer requested for discovery sockets; replies that arrive in a burst inside the MX window queue here
+    RCVBUF_SIZE = 4 * 1024 * 1024
+
+    def __init__(self,hp):
+        self.hp = hp
+        self.count = 0
+        self.sent = 0
+        self.done = None
+
+    #Prepare a socket for use by the engine
+    def adopt(self,sock):
+        sock.setblocking(False)
+        try:
+            sock.setsockopt(SOL_SOCKET,SO_RCVBUF,self.RCVBUF_SIZE)
+        except Exception as e:
+            if self.hp.VERBOSE:
+                print('WARNING: Failed to set receive buffer size:',e)
+        return sock
+
+    #Run discovery on the given sockets until the timeout or host limit is hit, or the user hits Ctl+C.
+    #packets is a list of (data,sock) tuples to send once the sockets are being serviced.
+    #tags optionally maps each socket to the name of the interface it is bound to.
+    #If linger is set, packets may be any iterable of (data,sock,(ip,port)) tuples; they are sent at up to
+    #rate packets/sec (0 for unlimited), and discovery ends linger seconds after the last one is sent.
+    #Returns the number of hosts reported by parseSSDPInfo.
+    def run(self,sockets,packets=None,timeout=0,maxHosts=0,tags=None,rate=0,linger=None):
+        self.count = 0
+        self.sent = 0
+        if packets is None:
+            packets = []
+        if tags is None:
+            tags = {}
+        try:
+            asyncio.run(self.discover(sockets,packets,timeout,maxHosts,tags,rate,linger))
+        finally:
+            #The shell and recv() expect blocking sockets
+            for sock in sockets:
+                try:
+                    sock.setblocking(True)
+                except Exception:
+                    pass
+        return self.count
+
+    async def discover(self,sockets,packets,timeout,maxHosts,tags,rate=0,linger=None):
+        loop = asyncio.get_running_loop()
+        self.maxHosts = maxHosts
+        self.done = loop.create_future()
+
+        for sock in sockets:
+            self.adopt(sock)
+            loop.add_reader(sock.fileno(),self.drain,sock,tags.get(sock))
+
+        sender = None
+        try:
+            if linger is None:
+                for (data,sock) in packets:
+                    if self.hp.send(data,sock):
+                        self.sent += 1
+            else:
+                sender = loop.create_task(self.sendPaced(packets,rate,linger))
+
+            if timeout > 0:
+                await asyncio.wait_for(self.done,timeout)
+            else:
+                await self.done
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if sender is not None:
+                sender.cancel()
+            for sock in sockets:
+                loop.remove_reader(sock.fileno())
+
+    #Send packets to individual addresses at a fixed rate, then end discovery once the replies have had time to arrive
+    async def sendPaced(self,packets,rate,linger):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        for (data,sock,addr) in packets:
+            if self.done.done():
+                return
+            if rate > 0:
+                delay = start + (self.sent / rate) - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif self.sent % 64 == 0:
+                #Unlimited rate; still let the reader drain replies between bursts
+                await asyncio.sleep(0)
+            data = str.encode(data)
+            while True:
+                try:
+                    sock.sendto(data,addr)
+                    break
+                except (BlockingIOError,InterruptedError):
+                    #Socket send buffer is full; give the kernel a moment to drain it
+                    await asyncio.sleep(0.001)
+                except Exception as e:
+                    if self.hp.VERBOSE:
+                        print("SendTo method failed for %s:%d : %s" % (addr[0],addr[1],e))
+                    break
+            self.sent += 1
+
+        await asyncio.sleep(linger)
+        if not self.done.done():
+            self.done.set_result(self.count)
+
+    #Reader callback: pull every queued datagram off the socket
+    def drain(self,sock,tag):
+        for i in range(self.MAX_DRAIN):
+            try:
+                data = sock.recv(self.hp.MAX_RECV)
+            except (BlockingIOError,InterruptedError):
+                return
+            except Exception as e:
+                print('Caught socket exception:',e)
+                return
+
+            self.handle(data,tag)
+            if self.done.done():
+                return
+
+    #Process a single datagram
+    def handle(self,data,tag=None):
+        try:
+            if self.hp.parseSSDPInfo(data,False,False,tag):
+                self.count += 1
+        except Exception as e:
+            if self.hp.DEBUG:
+                print('Caught exception while parsing SSDP data:',e)
+            return
+
+        if self.maxHosts > 0 and self.count >= self.maxHosts and not self.done.done():
+            self.done.set_result(self.count)
@@ -0,0 +1,433 @@
+import asyncio
+import collections
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from socket import socket, AF_INET, SOCK_DGRAM
+from urllib.parse import urlsplit
+
+from descparser import localName
+from httppool import HTTPStatusError
+from timerwheel import TimerWheel
+
+#GENA event subscriptions (UPnP Device Architecture, section 4).
+#Services are subscribed to with SUBSCRIBE requests sent over the shared HTTP connection pool, and
+#their NOTIFY messages are received by a single asyncio HTTP server, running in a background thread,
+#that serves every subscription. Each subscription has its own callback path, so events that arrive
+#before the SUBSCRIBE response has been read can still be matched to it. Renewals are scheduled on a
+#timer wheel and sent from a small pool of worker threads.
+class EventServer:
+    #Subscription duration requested from devices, in seconds
+    TIMEOUT = 1800
+    #Subscriptions are renewed once this fraction of the granted duration has passed
+    RENEW_AT = 0.5
+    #Shortest delay before renewing, and before trying again after a renewal has failed
+    MIN_RENEW = 5
+    RETRY_DELAY = 30
+    #Number of recent events kept for 'event log'
+    HISTORY = 1000
+    #Largest NOTIFY body accepted, and how long an idle callback connection is kept open
+    MAX_BODY = 1024 * 1024
+    IDLE_TIMEOUT = 30
+    CALLBACK_PREFIX = '/event/'
+
+    def __init__(self,hp,port=0,workers=16):
+        self.hp = hp
+        self.port = port
+        self.workers = workers
+        #Subscriptions by token (the number in their callback path)
+        self.subscriptions = {}
+        self.nextToken = 0
+        self.history = collections.deque(maxlen=self.HISTORY)
+        #Called with each event, from the server thread
+        self.listeners = []
+        self.wheel = TimerWheel()
+        self.localAddresses = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.loop = None
+        self.executor = None
+        self.notifies = 0
+        self.rejected = 0
+
+    #Start the callback server, if it isn't already running
+    def start(self):
+        if self.thread is not None:
+            return
+        ready = threading.Event()
+        self.startError = None
+        self.executor = ThreadPoolExecutor(max_workers=max(1,self.workers))
+        self.thread = threading.Thread(target=self.run,args=(ready,),daemon=True)
+        self.thread.start()
+        ready.wait()
+        if self.startError is not None:
+            self.thread = None
+            raise self.startError
+
+    def run(self,ready):
+        try:
+            asyncio.run(self.serve(ready))
+        except BaseException as e:
+            if not ready.is_set():
+                self.startError = e
+                ready.set()
+
+    async def serve(self,ready):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = self.loop.create_future()
+        server = await asyncio.start_server(self.handleConnection,'0.0.0.0',self.port,backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        ready.set()
+        ticker = self.loop.create_task(self.tick())
+        try:
+            await self.stopping
+        finally:
+            ticker.cancel()
+            server.close()
+            await server.wait_closed()
+
+    #Stop the server, unsubscribing from every service first
+    def stop(self):
+        if self.thread is None:
+            return
+        self.unsubscribe(list(self.subscriptions.keys()))
+        self.loop.call_soon_threadsafe(self.stopping.set_result,None)
+        self.thread.join()
+        self.thread = None
+        self.executor.shutdown(wait=False)
+
+    ################ Subscriptions ######################
+
+    #Subscribe to the events of many services, given as (index,deviceName,serviceName) tuples, at most
+    #'workers' at a time. Returns a list of (subscription,error) tuples in the order of targets.
+    def subscribe(self,targets):
+        self.start()
+        results = {}
+        pool = ThreadPoolExecutor(max_workers=max(1,min(self.workers,len(targets))))
+        try:
+            futures = {}
+            for target in targets:
+                subscription = self.addSubscription(target)
+                futures[pool.submit(self.sendSubscribe,subscription)] = subscription
+            for future in as_completed(futures):
+                subscription = futures[future]
+                results[subscription['token']] = (subscription,future.result())
+        finally:
+            pool.shutdown(wait=True)
+        return [results[token] for token in sorted(results.keys())]
+
+    def addSubscription(self,target):
+        (index,deviceName,serviceName) = target
+        with self.lock:
+            token = self.nextToken
+            self.nextToken += 1
+            subscription = {
+                'token' : token,
+                'index' : index,
+                'deviceName' : deviceName,
+                'serviceName' : serviceName,
+                'url' : self.hp.getEventSubURL(index,deviceName,serviceName),
+                'sid' : None,
+                'state' : 'subscribing',
+                'timeout' : 0,
+                'expires' : 0,
+                'seq' : None,
+                'events' : 0,
+                'missed' : 0,
+                'lastError' : None,
+                #Bumped whenever a renewal is scheduled, so that superseded timers are ignored
+                'generation' : 0
+            }
+            self.subscriptions[token] = subscription
+        return subscription
+
+    #Send the initial SUBSCRIBE for a subscription; returns None, or a description of the failure
+    def sendSubscribe(self,subscription):
+        host = urlsplit(subscription['url']).hostname
+        callback = 'http://%s:%d%s%d' % (self.localAddress(host),self.port,self.CALLBACK_PREFIX,subscription['token'])
+        headers = {'CALLBACK' : '<%s>' % callback,'NT' : 'upnp:event','TIMEOUT' : 'Second-%d' % self.TIMEOUT}
+        return self.request(subscription,headers,'subscribed')
+
+    #Renew a subscription, or subscribe again if the device has forgotten it
+    def sendRenewal(self,subscription):
+        if subscription['sid'] is None:
+            error = self.sendSubscribe(subscription)
+        else:
+            error = self.request(subscription,{'SID' : subscription['sid'],'TIMEOUT' : 'Second-%d' % self.TIMEOUT},'subscribed')
+            if error is not None and subscription['sid'] is None:
+                error = self.sendSubscribe(subscription)
+        if error is not None and subscription['state'] != 'cancelled':
+            self.scheduleRenewal(subscription,self.RETRY_DELAY)
+
+    #Send a SUBSCRIBE (initial or renewal) and record the result
+    def request(self,subscription,headers,state):
+        try:
+            (status,respHeaders,body) = self.hp.httpPool.request('SUBSCRIBE',subscription['url'],None,headers)
+        except HTTPStatusError as e:
+            #412 Precondition Failed: the SID is unknown to the device, or the request was malformed
+            if e.status == 412:
+                subscription['sid'] = None
+            return self.setError(subscription,'%d %s' % (e.status,e.reason))
+        except Exception as e:
+            return self.setError(subscription,str(e) or e.__class__.__name__)
+
+        sid = respHeaders.get('SID')
+        if not sid and subscription['sid'] is None:
+            return self.setError(subscription,'no SID in SUBSCRIBE response')
+        with self.lock:
+            if subscription['state'] == 'cancelled':
+                return None
+            if sid and sid.strip() != subscription['sid']:
+                #A new subscription starts counting events from SEQ 0 again
+                subscription['sid'] = sid.strip()
+                subscription['seq'] = None
+            subscription['timeout'] = parseTimeout(respHeaders.get('TIMEOUT'),self.TIMEOUT)
+            subscription['expires'] = time.time() + subscription['timeout']
+            subscription['state'] = state
+            subscription['lastError'] = None
+        self.scheduleRenewal(subscription,max(self.MIN_RENEW,subscription['timeout'] * self.RENEW_AT))
+        return None
+
+    def setError(self,subscription,error):
+        with self.lock:
+            subscription['lastError'] = error
+            if subscription['state'] != 'cancelled':
+                if subscription['expires'] > time.time():
+                    subscription['state'] = 'renewal failed'
+                else:
+                    subscription['state'] = 'failed'
+        return error
+
+    def scheduleRenewal(self,subscription,delay):
+        with self.lock:
+            subscription['generation'] += 1
+            self.wheel.schedule(delay,(subscription['token'],subscription['generation']))
+
+    #Cancel subscriptions, given by token; UNSUBSCRIBE requests are sent for those the device accepted
+    def unsubscribe(self,tokens):
+        cancelled = []
+        with self.lock:
+            for token in tokens:
+                subscription = self.subscriptions.pop(token,None)
+                if subscription is not None:
+                    subscription['state'] = 'cancelled'
+                    cancelled.append(subscription)
+
+        targets = [subscription for subscription in cancelled if subscription['sid'] is not None]
+        if not targets:
+            return len(cancelled)
+        pool = ThreadPoolExecutor(max_workers=max(1,min(self.workers,len(targets))))
+        try:
+            for subscription in targets:
+                pool.submit(self.sendUnsubscribe,subscription)
+        finally:
+            pool.shutdown(wait=True)
+        return len(cancelled)
+
+    #Cancel every subscription and forget the events received; used when the host list is replaced, as
+    #the host indexes they refer to would then name other hosts. Returns the number of subscriptions cancelled.
+    def clear(self):
+        with self.lock:
+            tokens = list(self.subscriptions.keys())
+        cancelled = self.unsubscribe(tokens)
+        with self.lock:
+            self.history.clear()
+        return cancelled
+
+    def sendUnsubscribe(self,subscription):
+        try:
+            self.hp.httpPool.request('UNSUBSCRIBE',subscription['url'],None,{'SID' : subscription['sid']})
+        except Exception:
+            #The device will drop the subscription when it expires anyway
+            pass
+
+    #Renew the subscriptions that have come due; runs on the server's event loop
+    async def tick(self):
+        while True:
+            await asyncio.sleep(self.wheel.untilNextTick())
+            for (token,generation) in self.wheel.advance():
+                subscription = self.subscriptions.get(token)
+                if subscription is None or subscription['generation'] != generation:
+                    continue
+                self.loop.run_in_executor(self.executor,self.sendRenewal,subscription)
+
+    #Get the address of the local interface used to reach a host, for callback URLs
+    def localAddress(self,host):
+        address = self.localAddresses.get(host)
+        if address is None:
+            sock = socket(AF_INET,SOCK_DGRAM)
+            try:
+                #Connecting a UDP socket sends nothing, but picks the route (and so the local address)
+                sock.connect((host,1900))
+                address = sock.getsockname()[0]
+            except OSError:
+                address = '127.0.0.1'
+            finally:
+                sock.close()
+            self.localAddresses[host] = address
+        return address
+
+    #Get a snapshot of the subscriptions, in the order they were made
+    def list(self):
+        with self.lock:
+            return [dict(self.subscriptions[token]) for token in sorted(self.subscriptions.keys())]
+
+    #Get the services whose subscriptions are currently live, as a dict of (index,deviceName,serviceName)
+    def activeServices(self):
+        active = {}
+        with self.lock:
+            for subscription in self.subscriptions.values():
+                if subscription['state'] == 'subscribed':
+                    active[(subscription['index'],subscription['deviceName'],subscription['serviceName'])] = True
+        return active
+
+    #Get the events received since the given total number of events had been received (None for
+    #none), oldest first, along with the new total
+    def since(self,total):
+        with self.lock:
+            if total is None:
+                return ([],self.notifies)
+            count = min(self.notifies - total,len(self.history))
+            events = []
+            if count > 0:
+                events = list(self.history)[-count:]
+            return (events,self.notifies)
+
+    #Get up to count of the most recent events, oldest first
+    def recent(self,count=None):
+        with self.lock:
+            events = list(self.history)
+        if count is not None:
+            events = events[-count:]
+        return events
+
+    ################ Callback server ######################
+
+    async def handleConnection(self,reader,writer):
+        try:
+            while True:
+                try:
+                    requestLine = await asyncio.wait_for(reader.readline(),self.IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not requestLine.strip():
+                    break
+                (method,path,version) = (requestLine.decode('latin-1').split() + ['','',''])[:3]
+
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(),self.IDLE_TIMEOUT)
+                    if not line.strip():
+                        break
+                    (name,sep,value) = line.decode('latin-1').partition(':')
+                    headers[name.strip().upper()] = value.strip()
+
+                body = await self.readBody(reader,headers)
+                if body is None:
+                    (status,reason) = (413,'Request Entity Too Large')
+                else:
+                    (status,reason) = self.handleNotify(method,path,headers,body)
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Length: 0\r\n\r\n' % (status,reason)).encode('latin-1'))
+                await writer.drain()
+
+                if body is None or version == 'HTTP/1.0' or headers.get('CONNECTION','').lower() == 'close':
+                    break
+        except (ConnectionError,asyncio.IncompleteReadError,asyncio.TimeoutError,ValueError):
+            pass
+        finally:
+            writer.close()
+
+    #Read a request body framed by Content-Length or chunked encoding; None if it is too large
+    async def readBody(self,reader,headers):
+        if headers.get('TRANSFER-ENCODING','').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip() or b'0',16)
+                if size == 0:
+                    #Skip any trailers
+                    while (await reader.readline()).strip():
+                        pass
+                    return bytes(body)
+                if len(body) + size > self.MAX_BODY:
+                    return None
+                body += await reader.readexactly(size)
+                await reader.readline()
+        length = int(headers.get('CONTENT-LENGTH','0') or '0')
+        if length > self.MAX_BODY:
+            return None
+        return await reader.readexactly(length)
+
+    #Handle a NOTIFY request; returns the HTTP (status,reason) to answer with
+    def handleNotify(self,method,path,headers,body):
+        if method != 'NOTIFY':
+            return (405,'Method Not Allowed')
+        if headers.get('NT') != 'upnp:event' or headers.get('NTS') != 'upnp:propchange':
+            self.rejected += 1
+            return (400,'Bad Request')
+        subscription = None
+        if path.startswith(self.CALLBACK_PREFIX) and path[len(self.CALLBACK_PREFIX):].isdigit():
+            subscription = self.subscriptions.get(int(path[len(self.CALLBACK_PREFIX):]))
+        sid = headers.get('SID')
+        if subscription is None or not sid or (subscription['sid'] is not None and subscription['sid'] != sid):
+            self.rejected += 1
+            return (412,'Precondition Failed')
+
+        try:
+            variables = parsePropertySet(body)
+            seq = int(headers.get('SEQ','0'))
+        except (ET.ParseError,ValueError):
+            self.rejected += 1
+            return (400,'Bad Request')
+
+        with self.lock:
+            #Cancelled while this NOTIFY was being read
+            if subscription['state'] == 'cancelled':
+                self.rejected += 1
+                return (412,'Precondition Failed')
+            #SEQ counts up from 0 for each subscription; a gap means events were lost
+            if subscription['seq'] is not None and seq > subscription['seq'] + 1:
+                subscription['missed'] += seq - subscription['seq'] - 1
+            subscription['seq'] = seq
+            subscription['events'] += 1
+            event = {
+                'time' : time.time(),
+                'token' : subscription['token'],
+                'index' : subscription['index'],
+                'deviceName' : subscription['deviceName'],
+                'serviceName' : subscription['serviceName'],
+                'seq' : seq,
+                'variables' : variables
+            }
+            self.history.append(event)
+            self.notifies += 1
+
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                if self.hp.DEBUG:
+                    print('Caught exception in event listener:',e)
+        return (200,'OK')
+
+#Get the evented state variables from the body of a NOTIFY: a dict of variable name to value
+def parsePropertySet(body):
+    variables = {}
+    for prop in ET.fromstring(body):
+        if localName(prop.tag) != 'property':
+            continue
+        for var in prop:
+            variables[localName(var.tag)] = (var.text or '').strip()
+    return variables
+
+#Get the subscription duration from a TIMEOUT header such as 'Second-1800'
+def parseTimeout(value,default):
+    if not value:
+        return default
+    value = value.strip().lower()
+    if value == 'second-infinite':
+        return default
+    try:
+        return max(1,int(value.split('-',1)[1]))
+    except (IndexError,ValueError):
+        return default
@@ -0,0 +1,123 @@
+import threading
+import time
+
+#Raised instead of contacting a host that has recently stopped responding
+class HostUnavailableError(Exception):
+    def __init__(self,host,failures,retryIn):
+        Exception.__init__(self,'%s is not responding (%d failures in a row); not retrying for another %ds' % (host,failures,retryIn))
+        self.host = host
+        self.failures = failures
+        self.retryIn = retryIn
+
+#Health of the hosts contacted over HTTP, keyed by (scheme,host,port) as in HTTPConnectionPool.
+#Each host has a circuit breaker: after FAILURE_LIMIT failed requests in a row the circuit opens, and
+#requests to the host fail at once, without touching the network, for COOLDOWN seconds. After that a
+#single request is let through to probe the host; if it succeeds the circuit closes again, and if it
+#fails the circuit re-opens for twice as long as before, up to MAX_COOLDOWN seconds.
+#Safe to share between threads.
+class HostHealth:
+    FAILURE_LIMIT = 3
+    COOLDOWN = 30
+    MAX_COOLDOWN = 600
+
+    def __init__(self,failureLimit=None,cooldown=None):
+        if failureLimit is not None:
+            self.FAILURE_LIMIT = failureLimit
+        if cooldown is not None:
+            self.COOLDOWN = cooldown
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def getHost(self,key):
+        host = self.hosts.get(key)
+        if host is None:
+            host = self.hosts[key] = {
+                'requests' : 0,
+                'failures' : 0,
+                'refused' : 0,
+                'consecutive' : 0,
+                'trips' : 0,
+                'cooldown' : 0,
+                'openUntil' : 0,
+                'probing' : False,
+                'lastError' : None
+            }
+        return host
+
+    #Called before each request to a host; raises HostUnavailableError while its circuit is open
+    def check(self,key):
+        with self.lock:
+            host = self.getHost(key)
+            host['requests'] += 1
+            if host['consecutive'] < self.FAILURE_LIMIT:
+                return
+            now = time.monotonic()
+            if now >= host['openUntil'] and not host['probing']:
+                #Half-open: let this one request find out whether the host is back
+                host['probing'] = True
+                return
+            host['requests'] -= 1
+            host['refused'] += 1
+            retryIn = max(1,int(host['openUntil'] - now + 0.5))
+            failures = host['consecutive']
+        raise HostUnavailableError(self.hostName(key),failures,retryIn)
+
+    #The host answered (with any HTTP status)
+    def success(self,key):
+        with self.lock:
+            host = self.getHost(key)
+            host['consecutive'] = 0
+            host['cooldown'] = 0
+            host['probing'] = False
+
+    #A request to the host failed to get an answer, after any retries
+    def failure(self,key,error):
+        with self.lock:
+            host = self.getHost(key)
+            host['failures'] += 1
+            host['consecutive'] += 1
+            host['lastError'] = str(error) or error.__class__.__name__
+            if host['consecutive'] >= self.FAILURE_LIMIT and (host['probing'] or host['consecutive'] == self.FAILURE_LIMIT):
+                #Open the circuit, for longer each time a probe fails
+                host['cooldown'] = min(self.MAX_COOLDOWN,host['cooldown'] * 2 or self.COOLDOWN)
+                host['openUntil'] = time.monotonic() + host['cooldown']
+                host['trips'] += 1
+            host['probing'] = False
+
+    #A request to the host was abandoned without an answer either way (e.g. interrupted by the user)
+    def cancel(self,key):
+        with self.lock:
+            self.getHost(key)['probing'] = False
+
+    #Get a snapshot of every host's counters, as a list of (host name,counters) sorted by host name.
+    #The counters are the 'requests' sent, the 'failures' among them, the requests 'refused' while the
+    #circuit was open, the circuit's 'trips' and the 'lastError'. 'state' is 'ok', 'failing' (failed, but
+    #fewer than FAILURE_LIMIT times in a row), 'open' (refusing requests for another 'retryIn' seconds)
+    #or 'probing'.
+    def stats(self):
+        now = time.monotonic()
+        snapshot = []
+        with self.lock:
+            for key,host in self.hosts.items():
+                host = dict(host)
+                host['retryIn'] = 0
+                if host['probing']:
+                    host['state'] = 'probing'
+                elif host['consecutive'] >= self.FAILURE_LIMIT and now < host['openUntil']:
+                    host['state'] = 'open'
+                    host['retryIn'] = int(host['openUntil'] - now + 0.5)
+                elif host['consecutive']:
+                    host['state'] = 'failing'
+                else:
+                    host['state'] = 'ok'
+                snapshot.append((self.hostName(key),host))
+        return sorted(snapshot,key=lambda item: item[0])
+
+    #Forget the history of every host, closing all circuits
+    def reset(self):
+        with self.lock:
+            self.hosts = {}
+
+    def hostName(self,key):
+        (scheme,host,port) = key
+        return '%s:%d' % (host,port)
@@ -0,0 +1,408 @@
+import copy
+import hashlib
+import sys
+import threading
+import weakref
+from collections.abc import MutableMapping
+
+#Compact object model for the host inventory (ENUM_HOSTS).
+#Each level of a host's data is a __slots__ object instead of a dict, so field names are stored once
+#per class rather than once per entry, and the strings that repeat across hosts (type names, action
+#and variable names, data types) are interned. Every class is also a mutable mapping keyed by the
+#same field names the dicts used, so code that indexes, iterates or tab-completes through the
+#inventory works unchanged. Collections keyed by name (deviceList, services, actions, arguments,
+#serviceStateVariables) remain plain dicts.
+#
+#A service's actions and state variables make up its schema. Devices of the same model share one
+#ServiceSchema object, frozen so that no host can modify it for the others (see SchemaTable).
+
+#Intern a string so that equal strings across hosts share one object
+def intern(value):
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+#Read-only dict used inside frozen schemas
+class FrozenDict(dict):
+    def readOnly(self,*args,**kwargs):
+        raise TypeError('shared service schemas are read-only')
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = readOnly
+
+    def __reduce__(self):
+        return (FrozenDict,(dict(self),))
+
+    def __deepcopy__(self,memo):
+        return self
+
+#Read-only list used inside frozen schemas
+class FrozenList(list):
+    def readOnly(self,*args,**kwargs):
+        raise TypeError('shared service schemas are read-only')
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = extend = insert = pop = remove = clear = sort = reverse = readOnly
+
+    def __reduce__(self):
+        return (FrozenList,(list(self),))
+
+    def __deepcopy__(self,memo):
+        return self
+
+#Marks a record without extra fields as frozen
+FROZEN = FrozenDict()
+
+class Record(MutableMapping):
+    #Fields, in display order; subclasses list them in __slots__
+    __slots__ = ('extraFields',)
+    FIELDS = ()
+    #Fields whose string values are interned
+    INTERNED = frozenset()
+
+    def __init__(self,*args,**kwargs):
+        self.update(*args,**kwargs)
+
+    #Build a record (and the records below it) from a plain dict, e.g. a host saved by an older version
+    @classmethod
+    def fromDict(cls,data):
+        if isinstance(data,cls):
+            return data
+        return cls(data)
+
+    #Convert a record and everything below it back into plain dicts
+    def toDict(self):
+        return toDict(self)
+
+    #Frozen records are read-only; their extra fields are kept in a FrozenDict
+    def isFrozen(self):
+        return type(getattr(self,'extraFields',None)) is FrozenDict
+
+    def hasField(self,key):
+        return hasattr(self,key)
+
+    def __getitem__(self,key):
+        if key in self.FIELDS:
+            try:
+                return getattr(self,key)
+            except AttributeError:
+                raise KeyError(key)
+        try:
+            return self.extraFields[key]
+        except (AttributeError,TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self,key,value):
+        if self.isFrozen():
+            FROZEN.readOnly()
+        if key in self.FIELDS:
+            if key in self.INTERNED:
+                value = intern(value)
+            setattr(self,key,value)
+            return
+        #Keys outside the model are kept, so the record can hold anything a dict could
+        try:
+            extra = self.extraFields
+        except AttributeError:
+            extra = self.extraFields = {}
+        extra[intern(key)] = value
+
+    def __delitem__(self,key):
+        if self.isFrozen():
+            FROZEN.readOnly()
+        if key in self.FIELDS:
+            try:
+                delattr(self,key)
+                return
+            except AttributeError:
+                raise KeyError(key)
+        try:
+            del self.extraFields[key]
+        except (AttributeError,TypeError):
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if self.hasField(key):
+                yield key
+        try:
+            for key in self.extraFields:
+                yield key
+        except AttributeError:
+            pass
+
+    def __len__(self):
+        count = 0
+        for key in self.FIELDS:
+            if self.hasField(key):
+                count += 1
+        try:
+            count += len(self.extraFields)
+        except AttributeError:
+            pass
+        return count
+
+    def __contains__(self,key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__,dict(self.items()))
+
+    def copy(self):
+        return self.__class__(self)
+
+    #Frozen records are immutable, so copies can share them
+    def __deepcopy__(self,memo):
+        if self.isFrozen():
+            return self
+        copied = self.__class__.__new__(self.__class__)
+        memo[id(self)] = copied
+        for cls in self.__class__.__mro__:
+            for key in cls.__dict__.get('__slots__',()):
+                if key != '__weakref__' and hasattr(self,key):
+                    setattr(copied,key,copy.deepcopy(getattr(self,key),memo))
+        return copied
+
+#A single argument of an action: direction and related state variable
+class Argument(Record):
+    __slots__ = ('direction','relatedStateVariable')
+    FIELDS = __slots__
+    INTERNED = frozenset(FIELDS)
+
+#An action offered by a service, with its arguments keyed by name
+class Action(Record):
+    __slots__ = ('arguments',)
+    FIELDS = __slots__
+
+    @classmethod
+    def fromDict(cls,data):
+        if isinstance(data,cls):
+            return data
+        action = cls(data)
+        if 'arguments' in action:
+            action['arguments'] = dict((intern(name),Argument.fromDict(arg)) for (name,arg) in action['arguments'].items())
+        return action
+
+#A service state variable: data type, eventing, and allowed values
+class StateVariable(Record):
+    __slots__ = ('dataType','sendEvents','allowedValueList','allowedValueRange')
+    FIELDS = __slots__
+    INTERNED = frozenset(('dataType','sendEvents'))
+
+    def __setitem__(self,key,value):
+        if key == 'allowedValueList' and type(value) is list:
+            value = [intern(val) for val in value]
+        Record.__setitem__(self,key,value)
+
+#A service's actions and state variables, as described by its SCPD
+class ServiceSchema(Record):
+    __slots__ = ('actions','serviceStateVariables','__weakref__')
+    FIELDS = ('actions','serviceStateVariables')
+
+    @classmethod
+    def fromDict(cls,data):
+        if isinstance(data,cls):
+            return data
+        schema = cls(data)
+        if 'actions' in schema:
+            schema['actions'] = dict((intern(name),Action.fromDict(action)) for (name,action) in schema['actions'].items())
+        if 'serviceStateVariables' in schema:
+            schema['serviceStateVariables'] = dict((intern(name),StateVariable.fromDict(var)) for (name,var) in schema['serviceStateVariables'].items())
+        return schema
+
+#A service offered by a device. The per-host URLs are stored with the service; its actions and
+#serviceStateVariables are read through to its schema, which is usually shared with other hosts.
+#Assigning either of them gives the service a private, modifiable copy of the schema.
+class Service(Record):
+    __slots__ = ('fullName','serviceId','controlURL','eventSubURL','SCPDURL','schema')
+    FIELDS = ('fullName','serviceId','controlURL','eventSubURL','SCPDURL','actions','serviceStateVariables')
+    INTERNED = frozenset(('fullName','serviceId'))
+
+    def hasField(self,key):
+        if key in ServiceSchema.FIELDS:
+            return hasattr(self,'schema') and key in self.schema
+        return hasattr(self,key)
+
+    def __getitem__(self,key):
+        if key in ServiceSchema.FIELDS:
+            try:
+                return self.schema[key]
+            except AttributeError:
+                raise KeyError(key)
+        return Record.__getitem__(self,key)
+
+    def __setitem__(self,key,value):
+        if key in ServiceSchema.FIELDS:
+            self.privateSchema()[key] = value
+            return
+        Record.__setitem__(self,key,value)
+
+    def __delitem__(self,key):
+        if key in ServiceSchema.FIELDS:
+            del self.privateSchema()[key]
+            return
+        Record.__delitem__(self,key)
+
+    #Get this service's schema, first copying it if it is shared
+    def privateSchema(self):
+        schema = getattr(self,'schema',None)
+        if schema is None:
+            schema = self.schema = ServiceSchema()
+        elif schema.isFrozen():
+            schema = self.schema = ServiceSchema(schema)
+        return schema
+
+    @classmethod
+    def fromDict(cls,data):
+        if isinstance(data,cls):
+            return data
+        service = cls()
+        schema = {}
+        for (key,value) in data.items():
+            if key in ServiceSchema.FIELDS:
+                schema[key] = value
+            else:
+                service[key] = value
+        if schema:
+            service.schema = ServiceSchema.fromDict(schema)
+        return service
+
+#A device listed in a host's device description, with its services keyed by name
+class Device(Record):
+    __slots__ = ('fullName','friendlyName','modelDescription','modelName','modelNumber','modelURL','presentationURL','UDN','UPC','manufacturer','manufacturerURL','services')
+    FIELDS = __slots__
+    INTERNED = frozenset(('fullName','modelDescription','modelName','modelNumber','modelURL','manufacturer','manufacturerURL'))
+
+    @classmethod
+    def fromDict(cls,data):
+        if isinstance(data,cls):
+            return data
+        device = cls(data)
+        if 'services' in device:
+            device['services'] = dict((intern(name),Service.fromDict(service)) for (name,service) in device['services'].items())
+        return device
+
+#A host found by discovery; deviceList is filled in by 'host get'
+class Host(Record):
+    __slots__ = ('name','dataComplete','proto','xmlFile','serverType','upnpServer','usn','iface','deviceList')
+    FIELDS = __slots__
+    INTERNED = frozenset(('proto','serverType','upnpServer','iface'))
+
+    @classmethod
+    def fromDict(cls,data):
+        if isinstance(data,cls):
+            return data
+        host = cls(data)
+        if 'deviceList' in host:
+            host['deviceList'] = dict((intern(name),Device.fromDict(device)) for (name,device) in host['deviceList'].items())
+        return host
+
+    #Whether the host's data is all in memory (see inventory.LazyHost)
+    def isLoaded(self):
+        return True
+
+#Convert a host inventory structure (records, dicts and lists) into plain dicts and lists
+def toDict(value):
+    if isinstance(value,Record):
+        return dict((key,toDict(value[key])) for key in value)
+    if isinstance(value,dict):
+        return dict((key,toDict(val)) for (key,val) in value.items())
+    if isinstance(value,list):
+        return [toDict(val) for val in value]
+    return value
+
+#Make a record, dict or list and everything below it read-only; returns the frozen value.
+#Records are frozen in place, dicts and lists are replaced by read-only copies.
+def freeze(value):
+    if isinstance(value,Record):
+        if not value.isFrozen():
+            for key in value.FIELDS:
+                if hasattr(value,key):
+                    setattr(value,key,freeze(getattr(value,key)))
+            extra = getattr(value,'extraFields',None)
+            value.extraFields = FrozenDict((key,freeze(val)) for (key,val) in extra.items()) if extra else FROZEN
+        return value
+    if type(value) is dict:
+        return FrozenDict((key,freeze(val)) for (key,val) in value.items())
+    if type(value) is list:
+        return FrozenList(freeze(val) for val in value)
+    return value
+
+#Table of the distinct service schemas seen, keyed by a hash of their contents.
+#Schemas are frozen when they are added; a schema that is no longer used by any host is dropped.
+#Safe to share between threads.
+class SchemaTable:
+    def __init__(self):
+        self.schemas = weakref.WeakValueDictionary()
+        #Hashes of shared schemas, by id, as (weak reference to the schema,hash)
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    #Hash of a schema's contents
+    @staticmethod
+    def schemaHash(schema):
+        parts = []
+        SchemaTable.flatten(schema,parts)
+        return hashlib.sha256(repr(parts).encode('utf-8','replace')).hexdigest()
+
+    #Append a canonical listing of a schema's contents to parts. Schema records store every
+    #field in a slot, so this reads them directly rather than going through the mapping interface.
+    @staticmethod
+    def flatten(value,parts):
+        if isinstance(value,Record):
+            parts.append(value.__class__.__name__)
+            for key in value.FIELDS:
+                if hasattr(value,key):
+                    parts.append(key)
+                    SchemaTable.flatten(getattr(value,key),parts)
+            extra = getattr(value,'extraFields',None)
+            if extra:
+                SchemaTable.flatten(extra,parts)
+            parts.append(None)
+        elif isinstance(value,dict):
+            parts.append(dict)
+            for (key,val) in value.items():
+                parts.append(key)
+                SchemaTable.flatten(val,parts)
+            parts.append(None)
+        elif isinstance(value,list):
+            parts.append(list)
+            for val in value:
+                SchemaTable.flatten(val,parts)
+            parts.append(None)
+        else:
+            parts.append(value)
+
+    #Get a schema's hash. Shared schemas are read-only, so their hash is only worked out once.
+    def keyOf(self,schema):
+        known = self.keys.get(id(schema))
+        if known is not None and known[0]() is schema:
+            return known[1]
+        key = self.schemaHash(schema)
+        if schema.isFrozen():
+            with self.lock:
+                self.keys[id(schema)] = (weakref.ref(schema),key)
+        return key
+
+    #Get the shared copy of a schema, adding it to the table if it hasn't been seen before. key is the
+    #schema's hash, if it is already known.
+    def share(self,schema,key=None):
+        schema = ServiceSchema.fromDict(schema)
+        if key is None:
+            key = self.schemaHash(schema)
+        with self.lock:
+            shared = self.schemas.get(key)
+            if shared is None:
+                shared = self.schemas[key] = freeze(schema)
+                self.keys[id(shared)] = (weakref.ref(shared),key)
+            return shared
+
+    #Share the schemas of all of a host's services
+    def shareHost(self,hostInfo):
+        for device in hostInfo.get('deviceList',{}).values():
+            for service in device.get('services',{}).values():
+                if getattr(service,'schema',None) is not None:
+                    service.schema = self.share(service.schema)
+
+    def __len__(self):
+        return len(self.schemas)
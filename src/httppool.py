@@ -0,0 +1,234 @@
+import http.client
+import random
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+#Raised when a request completes with an HTTP error status
+class HTTPStatusError(Exception):
+    def __init__(self,status,reason,headers,body):
+        Exception.__init__(self,'HTTP Error %d: %s' % (status,reason))
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+#Pool of persistent HTTP/1.1 connections, keyed by (scheme,host,port).
+#Connections are reused across requests to the same server, closed after sitting idle
+#for IDLE_TIMEOUT seconds, and the total number of open sockets never exceeds MAX_CONNECTIONS.
+#timeout limits each read from the server; connectTimeout (default: timeout) limits connecting.
+#Requests that fail because the server refused or dropped the connection are retried up to RETRIES
+#times, with exponential backoff. If a HostHealth is given, every request is checked against it first
+#and its outcome recorded there, so hosts that keep failing are refused without being contacted.
+#Safe to share between threads.
+class HTTPConnectionPool:
+    MAX_CONNECTIONS = 64
+    IDLE_TIMEOUT = 30
+    MAX_REDIRECTS = 3
+    #Errors that mean a reused keep-alive connection was closed by the server
+    STALE_ERRORS = (http.client.RemoteDisconnected,http.client.BadStatusLine,ConnectionResetError,BrokenPipeError,ConnectionAbortedError)
+    #Errors that mean a request got no answer from the server
+    NETWORK_ERRORS = (OSError,http.client.HTTPException)
+    #Errors worth retrying. Timeouts aren't among them: a host that didn't answer in time is unlikely to on a second try.
+    RETRY_ERRORS = (ConnectionRefusedError,ConnectionResetError,ConnectionAbortedError,BrokenPipeError,http.client.RemoteDisconnected,http.client.BadStatusLine)
+    RETRIES = 0
+    #Delay before the first retry, in seconds; doubled for each further retry, up to MAX_BACKOFF
+    BACKOFF = 0.25
+    MAX_BACKOFF = 5
+
+    def __init__(self,timeout=10,maxConnections=None,idleTimeout=None,connectTimeout=None,health=None,retries=None):
+        self.timeout = timeout
+        self.health = health
+        if retries is not None:
+            self.RETRIES = retries
+        self.connectTimeout = timeout
+        if connectTimeout is not None:
+            self.connectTimeout = connectTimeout
+        if maxConnections is not None:
+            self.MAX_CONNECTIONS = maxConnections
+        if idleTimeout is not None:
+            self.IDLE_TIMEOUT = idleTimeout
+        self.idle = {}
+        self.open = 0
+        self.lock = threading.Condition()
+
+    #Send a request and read the whole response; returns (status,headers,body).
+    #Redirects are followed; error statuses raise HTTPStatusError.
+    #If reader is given, it is called with the http.client response to read the body, and the body
+    #returned is whatever it returns; otherwise the body is returned as bytes.
+    def request(self,method,url,body=None,headers=None,reader=None):
+        for i in range(self.MAX_REDIRECTS + 1):
+            (status,reason,respHeaders,respBody) = self.urlopen(method,url,body,headers,reader)
+            if status in (301,302,303,307,308) and respHeaders.get('Location'):
+                url = urljoin(url,respHeaders.get('Location'))
+                if status == 303:
+                    (method,body) = ('GET',None)
+                continue
+            break
+
+        if status >= 400:
+            raise HTTPStatusError(status,reason,respHeaders,respBody)
+        return (status,respHeaders,respBody)
+
+    #Send a single request, retrying it if the connection fails; returns (status,reason,headers,body).
+    #Raises HostUnavailableError if the host's circuit breaker is open.
+    def urlopen(self,method,url,body=None,headers=None,reader=None):
+        if headers is None:
+            headers = {}
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower() or 'http'
+        port = parts.port
+        if port is None:
+            port = 443 if scheme == 'https' else 80
+        key = (scheme,parts.hostname,port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        if self.health:
+            self.health.check(key)
+        retry = 0
+        while True:
+            try:
+                result = self.send(key,method,path,body,headers,reader)
+            except self.NETWORK_ERRORS as e:
+                #A POST may have changed the device's state, so it is only retried if it was never delivered
+                if retry < self.RETRIES and isinstance(e,self.RETRY_ERRORS) and (method == 'GET' or isinstance(e,ConnectionRefusedError)):
+                    time.sleep(self.backoff(retry))
+                    retry += 1
+                    continue
+                if self.health:
+                    self.health.failure(key,e)
+                raise
+            except BaseException:
+                if self.health:
+                    self.health.cancel(key)
+                raise
+            if self.health:
+                self.health.success(key)
+            return result
+
+    #Delay before the given retry (0 for the first) of a failed request: exponential, with jitter
+    def backoff(self,retry):
+        delay = min(self.MAX_BACKOFF,self.BACKOFF * (2 ** retry))
+        return delay / 2 + random.uniform(0,delay / 2)
+
+    #Send a request over a pooled connection; returns (status,reason,headers,body)
+    def send(self,key,method,path,body,headers,reader):
+        #A reused connection may have been closed by the server while idle; retry once on a fresh one
+        for attempt in range(2):
+            (conn,reused) = self.acquire(key)
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                    conn.sock.settimeout(self.timeout)
+                conn.request(method,path,body,headers)
+                response = conn.getresponse()
+                if reader:
+                    respBody = reader(response)
+                else:
+                    respBody = response.read()
+            except self.STALE_ERRORS:
+                self.discard(conn)
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                self.discard(conn)
+                raise
+
+            if response.will_close:
+                self.discard(conn)
+            else:
+                self.release(key,conn)
+            return (response.status,response.reason,response.msg,respBody)
+
+    #Get an idle connection for key, or open a new one; returns (connection,reused)
+    def acquire(self,key):
+        with self.lock:
+            while True:
+                self.evictIdle()
+                conns = self.idle.get(key)
+                if conns:
+                    (conn,lastUsed) = conns.pop()
+                    if not conns:
+                        del self.idle[key]
+                    return (conn,True)
+
+                if self.open >= self.MAX_CONNECTIONS:
+                    #Make room by closing the least recently used idle connection to some other server
+                    if not self.closeOldestIdle():
+                        self.lock.wait()
+                        continue
+
+                self.open += 1
+                break
+
+        (scheme,host,port) = key
+        try:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(host,port,timeout=self.connectTimeout)
+            else:
+                conn = http.client.HTTPConnection(host,port,timeout=self.connectTimeout)
+        except BaseException:
+            with self.lock:
+                self.open -= 1
+                self.lock.notify()
+            raise
+        return (conn,False)
+
+    #Return a connection to the pool for reuse
+    def release(self,key,conn):
+        with self.lock:
+            self.idle.setdefault(key,[]).append((conn,time.monotonic()))
+            self.lock.notify()
+
+    #Close a connection that can't be reused
+    def discard(self,conn):
+        conn.close()
+        with self.lock:
+            self.open -= 1
+            self.lock.notify()
+
+    #Close connections that have been idle for longer than IDLE_TIMEOUT; caller must hold the lock
+    def evictIdle(self):
+        cutoff = time.monotonic() - self.IDLE_TIMEOUT
+        for key in list(self.idle.keys()):
+            conns = self.idle[key]
+            fresh = [(conn,lastUsed) for (conn,lastUsed) in conns if lastUsed >= cutoff]
+            for (conn,lastUsed) in conns:
+                if lastUsed < cutoff:
+                    conn.close()
+                    self.open -= 1
+            if fresh:
+                self.idle[key] = fresh
+            else:
+                del self.idle[key]
+
+    #Close the least recently used idle connection; caller must hold the lock. Returns False if none are idle.
+    def closeOldestIdle(self):
+        oldest = None
+        for key,conns in self.idle.items():
+            for i in range(len(conns)):
+                if oldest is None or conns[i][1] < oldest[2]:
+                    oldest = (key,i,conns[i][1])
+        if oldest is None:
+            return False
+
+        (key,i,lastUsed) = oldest
+        (conn,lastUsed) = self.idle[key].pop(i)
+        if not self.idle[key]:
+            del self.idle[key]
+        conn.close()
+        self.open -= 1
+        return True
+
+    #Close all idle connections
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for (conn,lastUsed) in conns:
+                    conn.close()
+                    self.open -= 1
+            self.idle = {}
+            self.lock.notify_all()
@@ -0,0 +1,277 @@
+import json
+import os
+import threading
+
+from hostmodel import Host, Device, Service, ServiceSchema, SchemaTable, intern, toDict, freeze
+
+#On-disk host inventory, written by 'save data' and read by 'load'.
+#The file starts with a header line naming the format and its version, followed by one record per
+#host, appended as hosts are discovered and enumerated. A host record is a line 'H <index> <summary
+#length> <body length>', then the host's summary (every field but deviceList) as JSON, then its
+#deviceList as JSON (empty if the host hasn't been enumerated), then a newline. A later record for the
+#same index replaces the earlier ones; saving to a new file writes only the latest, compacting it.
+#Service schemas (actions and state variables) are written once per file, in records 'S <schema hash>
+#<length>' followed by the schema as JSON and a newline, and services refer to them by hash (see
+#SchemaTable), as devices of the same model share one schema.
+#Opening a file only reads the record headers and host summaries, seeking over everything else, so that
+#the host list is available at once; each host's deviceList is read and parsed the first time it is
+#used (see LazyHost), and each schema the first time a host using it is. A partly written record at the
+#end of the file, e.g. after a crash, is ignored, and is overwritten by the next record appended.
+#Safe to share between threads.
+class InventoryStore:
+    MAGIC = b'MIRANDA-INVENTORY'
+    VERSION = 1
+    #Key that refers a service to its schema record
+    SCHEMA_KEY = '@schema'
+
+    def __init__(self,path,schemas=None):
+        self.path = path
+        #SchemaTable that the services of hosts read from the file are shared through
+        self.schemas = schemas
+        self.fp = None
+        #Offset just past the last complete record
+        self.end = 0
+        self.records = 0
+        #(offset,length) of each schema record, by hash
+        self.schemaOffsets = {}
+        #Schemas read from the file, by hash
+        self.loadedSchemas = {}
+        self.lock = threading.Lock()
+
+    #Check whether a file is an inventory file, rather than e.g. a pickle written by older versions
+    @classmethod
+    def isInventory(cls,path):
+        with open(path,'rb') as fp:
+            return fp.read(len(cls.MAGIC)) == cls.MAGIC
+
+    #Create a new inventory file holding the given hosts; fails if the file exists
+    def create(self,hosts):
+        self.fp = open(self.path,'x+b')
+        header = b'%s %d\n' % (self.MAGIC,self.VERSION)
+        self.fp.write(header)
+        self.end = len(header)
+        for index,hostInfo in hosts.items():
+            self.append(index,hostInfo)
+        self.fp.flush()
+
+    #Open an existing inventory file; returns its hosts, as a dict of host index to LazyHost
+    def open(self):
+        self.fp = open(self.path,'r+b')
+        header = self.fp.readline().split()
+        if len(header) != 2 or header[0] != self.MAGIC:
+            raise ValueError('%s is not a Miranda inventory file' % self.path)
+        if int(header[1]) > self.VERSION:
+            raise ValueError('%s was written by a newer version of Miranda (format %d)' % (self.path,int(header[1])))
+
+        hosts = {}
+        self.end = self.fp.tell()
+        while True:
+            line = self.fp.readline()
+            try:
+                fields = line.split()
+                if len(fields) == 3 and fields[0] == b'S':
+                    length = int(fields[2])
+                    offset = self.fp.tell()
+                    self.fp.seek(length,os.SEEK_CUR)
+                    if self.fp.read(1) != b'\n':
+                        break
+                    self.schemaOffsets[fields[1].decode('ascii')] = (offset,length)
+                    self.end = self.fp.tell()
+                    continue
+                (tag,index,summaryLength,bodyLength) = fields
+                if tag != b'H':
+                    break
+                (index,summaryLength,bodyLength) = (int(index),int(summaryLength),int(bodyLength))
+                summary = self.fp.read(summaryLength)
+                offset = self.fp.tell()
+                self.fp.seek(bodyLength,os.SEEK_CUR)
+                if len(summary) < summaryLength or self.fp.read(1) != b'\n':
+                    break
+                hostInfo = LazyHost(json.loads(summary.decode('utf-8')))
+            except ValueError:
+                break
+            if bodyLength:
+                hostInfo.pending = (self,offset,bodyLength)
+            hosts[index] = hostInfo
+            self.records += 1
+            self.end = self.fp.tell()
+        return hosts
+
+    #Append a record for a host. The deviceList of a LazyHost that hasn't been read yet is copied from
+    #its file without being parsed, and the host is pointed at the copy.
+    def append(self,index,hostInfo):
+        summary = {}
+        for key in hostInfo:
+            if key != 'deviceList':
+                summary[key] = toDict(hostInfo[key])
+        summary = json.dumps(summary,default=str).encode('utf-8')
+        pending = getattr(hostInfo,'pending',None)
+        if pending is not None:
+            (store,offset,length) = pending
+            body = store.read(offset,length)
+            if store is not self:
+                self.copySchemas(store)
+        elif hostInfo.hasField('deviceList'):
+            body = json.dumps(self.encodeDeviceList(hostInfo['deviceList']),default=str).encode('utf-8')
+        else:
+            body = b''
+
+        with self.lock:
+            self.checkOpen()
+            self.fp.seek(self.end)
+            self.fp.write(b'H %d %d %d\n' % (index,len(summary),len(body)))
+            self.fp.write(summary)
+            offset = self.fp.tell()
+            self.fp.write(body)
+            self.fp.write(b'\n')
+            self.end = self.fp.tell()
+            #Drop anything left over from a record that was only partly written
+            self.fp.truncate()
+            self.fp.flush()
+            self.records += 1
+        if pending is not None:
+            hostInfo.pending = (self,offset,len(body))
+
+    #Convert a deviceList to plain dicts and lists, with each service's schema written separately
+    def encodeDeviceList(self,deviceList):
+        devices = {}
+        for deviceName,device in deviceList.items():
+            data = {}
+            for key in device:
+                if key != 'services':
+                    data[key] = toDict(device[key])
+            if device.hasField('services'):
+                services = data['services'] = {}
+                for serviceName,service in device['services'].items():
+                    entry = {}
+                    for key in service:
+                        if key not in ServiceSchema.FIELDS:
+                            entry[key] = toDict(service[key])
+                    schema = getattr(service,'schema',None)
+                    if schema is not None:
+                        entry[self.SCHEMA_KEY] = self.writeSchema(schema)
+                    services[serviceName] = entry
+            devices[deviceName] = data
+        return devices
+
+    #Write a schema record, unless the file already has one for the schema; returns the schema's hash
+    def writeSchema(self,schema):
+        if self.schemas is not None:
+            key = self.schemas.keyOf(schema)
+        else:
+            key = SchemaTable.schemaHash(schema)
+        if key not in self.schemaOffsets:
+            self.writeSchemaRecord(key,json.dumps(toDict(schema),default=str).encode('utf-8'))
+        return key
+
+    def writeSchemaRecord(self,key,data):
+        with self.lock:
+            if key in self.schemaOffsets:
+                return
+            self.checkOpen()
+            self.fp.seek(self.end)
+            self.fp.write(b'S %s %d\n' % (key.encode('ascii'),len(data)))
+            offset = self.fp.tell()
+            self.fp.write(data)
+            self.fp.write(b'\n')
+            self.end = self.fp.tell()
+            self.fp.truncate()
+            self.schemaOffsets[key] = (offset,len(data))
+
+    #Copy the schema records of another inventory file that this one doesn't have, for host records
+    #copied from it
+    def copySchemas(self,store):
+        for key,(offset,length) in list(store.schemaOffsets.items()):
+            if key not in self.schemaOffsets:
+                self.writeSchemaRecord(key,store.read(offset,length))
+
+    #Get a schema by hash, reading it from the file the first time it is asked for
+    def getSchema(self,key):
+        schema = self.loadedSchemas.get(key)
+        if schema is None:
+            (offset,length) = self.schemaOffsets[key]
+            schema = ServiceSchema.fromDict(json.loads(self.read(offset,length).decode('utf-8')))
+            if self.schemas is not None:
+                schema = self.schemas.share(schema,key)
+            else:
+                schema = freeze(schema)
+            schema = self.loadedSchemas.setdefault(key,schema)
+        return schema
+
+    #Read the raw bytes of a record body
+    def read(self,offset,length):
+        with self.lock:
+            self.checkOpen()
+            self.fp.seek(offset)
+            return self.fp.read(length)
+
+    #Read and parse a host's deviceList
+    def readDeviceList(self,offset,length):
+        deviceList = {}
+        for deviceName,data in json.loads(self.read(offset,length).decode('utf-8')).items():
+            services = data.pop('services',None)
+            device = Device.fromDict(data)
+            if services is not None:
+                device['services'] = {}
+                for serviceName,entry in services.items():
+                    key = entry.pop(self.SCHEMA_KEY,None)
+                    service = Service.fromDict(entry)
+                    if key is not None:
+                        service.schema = self.getSchema(key)
+                    device['services'][intern(serviceName)] = service
+            deviceList[intern(deviceName)] = device
+        return deviceList
+
+    def checkOpen(self):
+        if self.fp is None:
+            raise ValueError('inventory file %s has been closed' % self.path)
+
+    def close(self):
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
+
+#A host read from an inventory file, whose deviceList is only read from the file when it is first used.
+#Everything else about the host (name, LOCATION, USN, ...) is available straight away.
+class LazyHost(Host):
+    __slots__ = ('pending',)
+
+    def __init__(self,*args,**kwargs):
+        #(store,offset,length) of the deviceList in the inventory file, until it has been read
+        self.pending = None
+        Host.__init__(self,*args,**kwargs)
+
+    def isLoaded(self):
+        return self.pending is None
+
+    #Called when a field isn't set; reads deviceList from the file the first time it is asked for
+    def __getattr__(self,name):
+        if name == 'deviceList' and self.load():
+            return self.deviceList
+        raise AttributeError(name)
+
+    #Read the deviceList from the file, if it hasn't been yet. Returns True if the host now has one.
+    def load(self):
+        pending = self.pending
+        if pending is not None:
+            (store,offset,length) = pending
+            deviceList = store.readDeviceList(offset,length)
+            if self.pending is pending:
+                self.deviceList = deviceList
+                self.pending = None
+        try:
+            Host.__dict__['deviceList'].__get__(self)
+        except AttributeError:
+            return False
+        return True
+
+    #Whether the host has a field, without reading deviceList from the file to find out
+    def hasField(self,key):
+        if key == 'deviceList' and self.pending is not None:
+            return True
+        return Host.hasField(self,key)
+
+    def __deepcopy__(self,memo):
+        self.load()
+        return Host.__deepcopy__(self,memo)
@@ -0,0 +1,264 @@
+import json
+import queue
+import sqlite3
+import threading
+
+from hostmodel import SchemaTable, toDict
+
+#Tables of the inventory database. Hosts are keyed by their host index, and their devices and services
+#are deleted with them. Service schemas (actions, their arguments and state variables) are stored once
+#per distinct schema, like in inventory files, and services refer to them by id. The views join the
+#tables into the rows most queries want. The names searched on compare without regard to case, which
+#lets LIKE searches on them use their indexes.
+SCHEMA = '''
+PRAGMA foreign_keys = ON;
+CREATE TABLE IF NOT EXISTS hosts (
+    idx INTEGER PRIMARY KEY,
+    name TEXT COLLATE NOCASE,
+    proto TEXT,
+    xmlFile TEXT,
+    serverType TEXT,
+    upnpServer TEXT,
+    usn TEXT,
+    iface TEXT,
+    dataComplete INTEGER
+);
+CREATE INDEX IF NOT EXISTS hostsByName ON hosts(name);
+CREATE TABLE IF NOT EXISTS schemas (
+    id INTEGER PRIMARY KEY,
+    hash TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY,
+    host INTEGER NOT NULL REFERENCES hosts(idx) ON DELETE CASCADE,
+    name TEXT COLLATE NOCASE,
+    fullName TEXT,
+    friendlyName TEXT,
+    manufacturer TEXT COLLATE NOCASE,
+    manufacturerURL TEXT,
+    modelName TEXT COLLATE NOCASE,
+    modelNumber TEXT,
+    modelDescription TEXT,
+    modelURL TEXT,
+    presentationURL TEXT,
+    UDN TEXT,
+    UPC TEXT
+);
+CREATE INDEX IF NOT EXISTS devicesByHost ON devices(host);
+CREATE INDEX IF NOT EXISTS devicesByName ON devices(name);
+CREATE INDEX IF NOT EXISTS devicesByManufacturer ON devices(manufacturer);
+CREATE INDEX IF NOT EXISTS devicesByModel ON devices(modelName);
+CREATE TABLE IF NOT EXISTS services (
+    id INTEGER PRIMARY KEY,
+    device INTEGER NOT NULL REFERENCES devices(id) ON DELETE CASCADE,
+    name TEXT COLLATE NOCASE,
+    fullName TEXT COLLATE NOCASE,
+    serviceId TEXT,
+    controlURL TEXT,
+    eventSubURL TEXT,
+    SCPDURL TEXT,
+    schema INTEGER REFERENCES schemas(id)
+);
+CREATE INDEX IF NOT EXISTS servicesByDevice ON services(device);
+CREATE INDEX IF NOT EXISTS servicesByName ON services(name);
+CREATE INDEX IF NOT EXISTS servicesByType ON services(fullName);
+CREATE INDEX IF NOT EXISTS servicesBySchema ON services(schema);
+CREATE TABLE IF NOT EXISTS actions (
+    id INTEGER PRIMARY KEY,
+    schema INTEGER NOT NULL REFERENCES schemas(id) ON DELETE CASCADE,
+    name TEXT COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS actionsBySchema ON actions(schema);
+CREATE INDEX IF NOT EXISTS actionsByName ON actions(name);
+CREATE TABLE IF NOT EXISTS arguments (
+    action INTEGER NOT NULL REFERENCES actions(id) ON DELETE CASCADE,
+    name TEXT,
+    direction TEXT,
+    relatedStateVariable TEXT
+);
+CREATE INDEX IF NOT EXISTS argumentsByAction ON arguments(action);
+CREATE TABLE IF NOT EXISTS variables (
+    schema INTEGER NOT NULL REFERENCES schemas(id) ON DELETE CASCADE,
+    name TEXT COLLATE NOCASE,
+    dataType TEXT,
+    sendEvents TEXT,
+    allowedValueList TEXT,
+    allowedValueRange TEXT
+);
+CREATE INDEX IF NOT EXISTS variablesBySchema ON variables(schema);
+CREATE INDEX IF NOT EXISTS variablesByName ON variables(name);
+CREATE VIEW IF NOT EXISTS hostServices AS
+    SELECT hosts.idx AS host, hosts.name AS hostName, devices.name AS device, devices.manufacturer AS manufacturer,
+        devices.modelName AS modelName, services.name AS service, services.fullName AS serviceType, services.schema AS schema
+    FROM hosts JOIN devices ON devices.host = hosts.idx JOIN services ON services.device = devices.id;
+CREATE VIEW IF NOT EXISTS hostActions AS
+    SELECT hostServices.host AS host, hostName, device, service, actions.name AS action, actions.id AS actionId
+    FROM hostServices JOIN actions ON actions.schema = hostServices.schema;
+CREATE VIEW IF NOT EXISTS hostVariables AS
+    SELECT hostServices.host AS host, hostName, device, service, variables.name AS variable, dataType, sendEvents
+    FROM hostServices JOIN variables ON variables.schema = hostServices.schema;
+'''
+
+HOST_COLUMNS = ('name','proto','xmlFile','serverType','upnpServer','usn','iface','dataComplete')
+DEVICE_COLUMNS = ('fullName','friendlyName','manufacturer','manufacturerURL','modelName','modelNumber','modelDescription','modelURL','presentationURL','UDN','UPC')
+SERVICE_COLUMNS = ('fullName','serviceId','controlURL','eventSubURL','SCPDURL')
+
+#SQLite database mirroring the host inventory, so that it can be searched with SQL (see SCHEMA).
+#Hosts are handed to record() as they are found and enumerated, and written by a background thread:
+#everything recorded while the previous batch was being written goes into the next one, in a single
+#transaction, so recording costs the discovery and enumeration threads no more than a queue put.
+#Queries wait for the hosts recorded before them to be written. Safe to share between threads.
+class InventoryDB:
+    #Most hosts written in one transaction
+    BATCH_SIZE = 1000
+
+    def __init__(self,path,schemas=None):
+        self.path = path
+        #SchemaTable whose remembered hashes are used to find the stored copy of a schema
+        self.schemas = schemas
+        self.conn = sqlite3.connect(path,check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        #Schema ids by hash
+        self.schemaIds = dict((key,schemaId) for (schemaId,key) in self.conn.execute('SELECT id,hash FROM schemas'))
+        self.written = 0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+
+    #Queue a host to be written, replacing any earlier copy of it
+    def record(self,index,hostInfo):
+        self.checkOpen()
+        self.queue.put((index,hostInfo))
+
+    #Replace every host in the database with the given ones
+    def replaceAll(self,hosts):
+        self.checkOpen()
+        self.queue.put((None,None))
+        for index,hostInfo in hosts.items():
+            self.queue.put((index,hostInfo))
+
+    #Wait until every host recorded so far has been written
+    def flush(self):
+        self.checkOpen()
+        self.queue.join()
+
+    #Nothing would ever take hosts off the queue once the writer thread has stopped
+    def checkOpen(self):
+        if self.thread is None:
+            raise ValueError('inventory database %s has been closed' % self.path)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = batch[-1] is None
+            if closing:
+                batch.pop()
+            try:
+                self.writeHosts(batch)
+            except Exception as e:
+                print('Failed to write %d hosts to %s: %s' % (len(batch),self.path,e))
+            finally:
+                for item in batch:
+                    self.queue.task_done()
+            if closing:
+                self.queue.task_done()
+                return
+
+    #Write a batch of (index,hostInfo) in one transaction; an index of None deletes every host.
+    #Only the last copy of each host in the batch is written.
+    def writeHosts(self,batch):
+        latest = {}
+        for (index,hostInfo) in batch:
+            if index is None:
+                latest = {None : None}
+            else:
+                latest[index] = hostInfo
+        with self.lock:
+            try:
+                with self.conn:
+                    for index,hostInfo in latest.items():
+                        if index is None:
+                            self.conn.execute('DELETE FROM hosts')
+                        else:
+                            self.writeHost(index,hostInfo)
+                            self.written += 1
+            except:
+                #The schemas written by the failed transaction were rolled back with it
+                self.schemaIds = dict((key,schemaId) for (schemaId,key) in self.conn.execute('SELECT id,hash FROM schemas'))
+                raise
+
+    def writeHost(self,index,hostInfo):
+        self.conn.execute('DELETE FROM hosts WHERE idx = ?',(index,))
+        self.conn.execute('INSERT INTO hosts (idx,%s) VALUES (?%s)' % (','.join(HOST_COLUMNS),',?' * len(HOST_COLUMNS)),
+            [index] + [self.column(hostInfo.get(key)) for key in HOST_COLUMNS])
+        if not hostInfo.hasField('deviceList'):
+            return
+        for deviceName,device in hostInfo['deviceList'].items():
+            deviceId = self.conn.execute('INSERT INTO devices (host,name,%s) VALUES (?,?%s)' % (','.join(DEVICE_COLUMNS),',?' * len(DEVICE_COLUMNS)),
+                [index,deviceName] + [self.column(device.get(key)) for key in DEVICE_COLUMNS]).lastrowid
+            rows = []
+            for serviceName,service in device.get('services',{}).items():
+                schemaId = None
+                schema = getattr(service,'schema',None)
+                if schema is not None:
+                    schemaId = self.writeSchema(schema)
+                rows.append([deviceId,serviceName] + [self.column(service.get(key)) for key in SERVICE_COLUMNS] + [schemaId])
+            self.conn.executemany('INSERT INTO services (device,name,%s,schema) VALUES (?,?%s,?)' % (','.join(SERVICE_COLUMNS),',?' * len(SERVICE_COLUMNS)),rows)
+
+    #Write a schema's actions and state variables, unless the database already has them; returns the schema's id
+    def writeSchema(self,schema):
+        if self.schemas is not None:
+            key = self.schemas.keyOf(schema)
+        else:
+            key = SchemaTable.schemaHash(schema)
+        schemaId = self.schemaIds.get(key)
+        if schemaId is not None:
+            return schemaId
+
+        schemaId = self.conn.execute('INSERT INTO schemas (hash) VALUES (?)',(key,)).lastrowid
+        for actionName,action in schema['actions'].items():
+            actionId = self.conn.execute('INSERT INTO actions (schema,name) VALUES (?,?)',(schemaId,actionName)).lastrowid
+            self.conn.executemany('INSERT INTO arguments (action,name,direction,relatedStateVariable) VALUES (?,?,?,?)',
+                [(actionId,argName,argVals.get('direction'),argVals.get('relatedStateVariable')) for argName,argVals in action['arguments'].items()])
+        self.conn.executemany('INSERT INTO variables (schema,name,dataType,sendEvents,allowedValueList,allowedValueRange) VALUES (?,?,?,?,?,?)',
+            [(schemaId,varName,stateVar.get('dataType'),stateVar.get('sendEvents'),self.column(stateVar.get('allowedValueList')),
+                self.column(stateVar.get('allowedValueRange'))) for varName,stateVar in schema['serviceStateVariables'].items()])
+        self.schemaIds[key] = schemaId
+        return schemaId
+
+    #Convert a field to a column value; lists and other structures are stored as JSON
+    @staticmethod
+    def column(value):
+        if value is None or isinstance(value,(str,int,float)):
+            return value
+        return json.dumps(toDict(value),default=str)
+
+    #Run a read-only query once the hosts recorded before it have been written. Returns (column names,rows).
+    def query(self,sql,params=()):
+        self.flush()
+        with self.lock:
+            self.conn.execute('PRAGMA query_only = ON')
+            try:
+                cursor = self.conn.execute(sql,params)
+                columns = [description[0] for description in cursor.description or ()]
+                rows = cursor.fetchall()
+                cursor.close()
+                return (columns,rows)
+            finally:
+                self.conn.execute('PRAGMA query_only = OFF')
+
+    #Stop the writer thread once everything recorded has been written, and close the database
+    def close(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        with self.lock:
+            self.conn.close()
@@ -10,22 +10,49 @@ import os
 import platform
 import readline
 import time
-import pickle
-import base64
 import getopt
+import ipaddress
+import json
+import contextlib
 
 from upnp import upnp
+from httppool import HTTPStatusError
+from resultcolumns import ResultColumns
 
 
 ################## Action Functions ######################
 #These functions handle user commands from the shell
 
+#Build an M-SEARCH request for the given search target, addressed to host:port
+def buildMsearchRequest(hp,st,host,port):
+    request =     "M-SEARCH * HTTP/1.1\r\n"\
+            "HOST:%s:%d\r\n"\
+            "ST:%s\r\n" % (host,port,st)
+    for header,value in hp.msearchHeaders.items():
+            request += header + ':' + value + "\r\n"
+    request += "\r\n"
+    return request
+
 #Actively search for UPNP devices
 def msearch(argc,argv,hp):
     defaultST = "upnp:rootdevice"
     st = "schemas-upnp-org"
     myip = ''
     lport = hp.port
+    sweep = False
+
+    #Unicast sweep mode; strip the sweep arguments and parse the rest as usual
+    if argc >= 2 and argv[1] == 'sweep':
+        if argc < 3:
+            showHelp(argv[0])
+            return
+        try:
+            sweep = ipaddress.ip_network(argv[2],strict=False)
+        except ValueError as e:
+            print('Invalid address range:',e)
+            return
+        argv = argv[:1] + argv[3:]
+        argc = len(argv)
 
     if argc >= 3:
         if argc == 4:
@@ -40,63 +67,108 @@ def msearch(argc,argv,hp):
         st = defaultST
 
     #Build the request
-    request =     "M-SEARCH * HTTP/1.1\r\n"\
-            "HOST:%s:%d\r\n"\
-            "ST:%s\r\n" % (hp.ip,hp.port,st)
-    for header,value in hp.msearchHeaders.items():
-            request += header + ':' + value + "\r\n"
-    request += "\r\n"
+    request = buildMsearchRequest(hp,st,hp.ip,hp.port)
 
     print("Entering discovery mode for '%s', Ctl+C to stop..." % st)
     print('')
 
+    if sweep:
+        #Unicast replies go back to the probe's source port, so use an ephemeral port rather than sharing
+        #the SSDP port with the multicast listener (SO_REUSEPORT would split the replies between the two)
+        msearchSweep(hp,st,sweep,myip,0)
+        return
+
+    #Search from every configured interface at once
+    if hp.IFACES:
+        interfaces = hp.getDiscoveryInterfaces()
+        if not interfaces:
+            print('No usable interfaces to search on')
+            return
+        sockets = []
+        tags = {}
+        for iface,ifaceIP in interfaces.items():
+            sender = hp.createInterfaceSender(iface,ifaceIP)
+            if sender != False:
+                sockets.append(sender)
+                tags[sender] = iface
+        print("Searching on %s" % ', '.join(tags.values()))
+        print('')
+        runDiscovery(hp,sockets,[(request,sock) for sock in sockets],tags)
+        print('\nDiscover mode halted...')
+        return
+
     #Have to create a new socket since replies will be sent directly to our IP, not the multicast IP
     server = hp.createNewListener(myip,lport)
     if server == False:
         print('Failed to bind port %d' % lport)
         return
 
-    hp.send(request,server)
-    count = 0
-    start = time.time()
+    runDiscovery(hp,[server],[(request,server)],{})
+    print('\nDiscover mode halted...')
 
-    while True:
-        try:
-            if hp.MAX_HOSTS > 0 and count >= hp.MAX_HOSTS:
-                break
+#Send a unicast M-SEARCH to every address in a network, collecting replies on a single listener
+def msearchSweep(hp,st,network,myip,lport):
+    server = hp.createNewListener(myip,lport)
+    if server == False:
+        print('Failed to bind port %d' % lport)
+        return
 
-            if hp.TIMEOUT > 0 and (time.time() - start) > hp.TIMEOUT:
-                raise Exception("Timeout exceeded")
+    #Give the last devices probed the full MX window to reply
+    try:
+        linger = int(hp.msearchHeaders.get('MX','0')) + 1
+    except ValueError:
+        linger = 1
 
-            if hp.parseSSDPInfo(hp.recv(1024,server),False,False):
-                count += 1
+    probes = ((buildMsearchRequest(hp,st,str(ip),hp.DEFAULT_PORT),server,(str(ip),hp.DEFAULT_PORT)) for ip in network.hosts())
+    print("Sweeping %d addresses in %s at %s probes/sec" % (network.num_addresses,network,hp.SWEEP_RATE or 'unlimited'))
+    print('')
 
-        except Exception as e:
-            print('\nDiscover mode halted...')
-            break
+    try:
+        hp.engine.run([server],probes,hp.TIMEOUT,hp.MAX_HOSTS,{},hp.SWEEP_RATE,linger)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    print('\nSent %d probes, found %d hosts' % (hp.engine.sent,hp.engine.count))
+    print('\nDiscover mode halted...')
 
 #Passively listen for UPNP NOTIFY packets
 def pcap(argc,argv,hp):
     print('Entering passive mode, Ctl+C to stop...')
     print('')
 
-    count = 0
-    start = time.time()
-
-    while True:
+    #Listen on every configured interface at once
+    if hp.IFACES:
+        interfaces = hp.getDiscoveryInterfaces()
+        if not interfaces:
+            print('No usable interfaces to listen on')
+            return
+        sockets = []
+        tags = {}
+        for iface,ifaceIP in interfaces.items():
+            listener = hp.createInterfaceListener(iface,ifaceIP)
+            if listener != False:
+                sockets.append(listener)
+                tags[listener] = iface
+        print("Listening on %s" % ', '.join(tags.values()))
+        print('')
+        runDiscovery(hp,sockets,[],tags)
+    else:
         try:
-            if hp.MAX_HOSTS > 0 and count >= hp.MAX_HOSTS:
-                break
-
-            if hp.TIMEOUT > 0 and (time.time() - start) > hp.TIMEOUT:
-                raise Exception ("Timeout exceeded")
+            hp.engine.run([hp.listener()],[],hp.TIMEOUT,hp.MAX_HOSTS)
+        except KeyboardInterrupt:
+            pass
+    print("\nPassive mode halted...")
 
-            if hp.parseSSDPInfo(hp.recv(1024,False),False,False):
-                count += 1
-
-        except Exception as e:
-            print("\nPassive mode halted...",e)
-            break
+#Run the discovery engine on a set of temporary sockets, closing them when done
+def runDiscovery(hp,sockets,packets,tags):
+    try:
+        hp.engine.run(sockets,packets,hp.TIMEOUT,hp.MAX_HOSTS,tags)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for sock in sockets:
+            sock.close()
 
 #Manipulate M-SEARCH header values
 def head(argc,argv,hp):
@@ -154,6 +226,9 @@ def set(argc,argv,hp):
             return
         elif action == 'iface':
             if argc == 3:
+                if not hp.canBindToDevice():
+                    print('Binding to a network interface is not supported on this platform (Linux only)')
+                    return
                 hp.IFACE = argv[2]
                 print('Interface set to %s, re-binding sockets...' % hp.IFACE)
                 if hp.initSockets(hp.ip,hp.port,hp.IFACE):
@@ -162,6 +237,17 @@ def set(argc,argv,hp):
                     print('Failed to bind new interface - are you sure you have root privilages??')
                     hp.IFACE = None
                 return
+        elif action == 'ifaces':
+            if argc == 3:
+                if argv[2] == 'none':
+                    hp.IFACES = []
+                    print('Multi-interface discovery disabled')
+                elif not hp.canBindToDevice():
+                    print('Multi-interface discovery is not supported on this platform (Linux only)')
+                else:
+                    hp.IFACES = argv[2].split(',')
+                    print('Discovery interfaces set to: %s' % ', '.join(hp.IFACES))
+                return
         elif action == 'socket':
             if argc == 3:
                 try:
@@ -169,7 +255,7 @@ def set(argc,argv,hp):
                     port = int(port)
                     hp.ip = ip
                     hp.port = port
-                    hp.cleanup()
+                    hp.closeSockets()
                     if hp.initSockets(ip,port,hp.IFACE) == False:
                         print("Setting new socket %s:%d failed!" % (ip,port))
                     else:
@@ -184,6 +270,110 @@ def set(argc,argv,hp):
                 except Exception as e:
                     print('Caught exception setting new timeout value:',e)
                 return
+        elif action == 'rate':
+            if argc == 3:
+                try:
+                    hp.SWEEP_RATE = int(argv[2])
+                except Exception as e:
+                    print('Caught exception setting new sweep rate:', e)
+                return
+        elif action == 'workers':
+            if argc >= 3:
+                try:
+                    hp.HOST_WORKERS = hp.events.workers = hp.poller.workers = int(argv[2])
+                    if argc == 4:
+                        hp.SCPD_WORKERS = int(argv[3])
+                    print('Enumerating %d hosts at a time, %d service descriptions per host' % (hp.HOST_WORKERS,hp.SCPD_WORKERS))
+                except Exception as e:
+                    print('Caught exception setting new worker limits:', e)
+                return
+        elif action == 'retries':
+            if argc == 3:
+                try:
+                    hp.HTTP_RETRIES = hp.httpPool.RETRIES = max(0,int(argv[2]))
+                    print('Retrying refused or dropped HTTP requests up to %d times' % hp.HTTP_RETRIES)
+                except Exception as e:
+                    print('Caught exception setting new retry count:', e)
+                return
+        elif action == 'breaker':
+            if argc in (3,4):
+                try:
+                    hp.HOST_FAILURE_LIMIT = hp.health.FAILURE_LIMIT = max(1,int(argv[2]))
+                    if argc == 4:
+                        hp.HOST_COOLDOWN = hp.health.COOLDOWN = max(1,int(argv[3]))
+                    print('Hosts are skipped for %d seconds after %d failed requests in a row' % (hp.HOST_COOLDOWN,hp.HOST_FAILURE_LIMIT))
+                except Exception as e:
+                    print('Caught exception setting new circuit breaker limits:', e)
+                return
+        elif action == 'pipeline':
+            if argc == 3:
+                try:
+                    hp.PORTMAP_PIPELINE = max(1,int(argv[2]))
+                    print('Keeping up to %d port-mapping requests in flight per gateway' % hp.PORTMAP_PIPELINE)
+                except Exception as e:
+                    print('Caught exception setting new pipeline depth:', e)
+                return
+        elif action == 'events':
+            if argc in (3,4):
+                try:
+                    port = int(argv[2])
+                    if port != hp.events.port and hp.events.thread is not None:
+                        print("The event server is already listening on port %d; run 'event unsubscribe all' and restart miranda to change it" % hp.events.port)
+                        return
+                    hp.EVENT_PORT = hp.events.port = port
+                    if argc == 4:
+                        hp.EVENT_TIMEOUT = hp.events.TIMEOUT = max(1,int(argv[3]))
+                    print('Receiving events on port %d, subscribing for %d seconds at a time' % (hp.EVENT_PORT,hp.EVENT_TIMEOUT))
+                except Exception as e:
+                    print('Caught exception setting new event server settings:', e)
+                return
+        elif action == 'poll':
+            if argc == 3:
+                try:
+                    interval = float(argv[2])
+                    if interval <= 0:
+                        raise ValueError('the interval must be positive')
+                    hp.POLL_INTERVAL = interval
+                    print('Polling each host every %s seconds, from the next poll start' % hp.POLL_INTERVAL)
+                except Exception as e:
+                    print('Caught exception setting new poll interval:', e)
+                return
+        elif action == 'freshness':
+            if argc == 3:
+                try:
+                    hp.STATE_MAX_AGE = hp.state.MAX_AGE = max(0,int(argv[2]))
+                    print("'host state refresh' reads state variables older than %d seconds" % hp.STATE_MAX_AGE)
+                except Exception as e:
+                    print('Caught exception setting new state freshness:', e)
+                return
+        elif action == 'db':
+            if argc == 3:
+                try:
+                    if argv[2] == 'off':
+                        hp.setDatabase(None)
+                        print('Inventory database closed')
+                    else:
+                        hp.setDatabase(argv[2])
+                        print('Mirroring the host inventory into %s' % argv[2])
+                except Exception as e:
+                    print('Caught exception opening the inventory database:', e)
+                return
+        elif action == 'cache':
+            if argc == 3:
+                if argv[2] == 'off':
+                    hp.setCache(None)
+                    print('Service description cache disabled')
+                elif argv[2] == 'on':
+                    hp.setCache(upnp.SCPD_CACHE_DEFAULT_DIR)
+                    print('Caching service descriptions in %s' % hp.SCPD_CACHE_DIR)
+                elif argv[2] == 'clear':
+                    if hp.scpdCache:
+                        hp.scpdCache.clear()
+                    print('Service description cache cleared')
+                else:
+                    hp.setCache(argv[2])
+                    print('Caching service descriptions in %s' % argv[2])
+                return
         elif action == 'max':
             if argc == 3:
                 try:
@@ -195,8 +385,22 @@ def set(argc,argv,hp):
             print('Multicast IP:          ',hp.ip)
             print('Multicast port:        ',hp.port)
             print('Network interface:     ',hp.IFACE)
+            print('Discovery interfaces:  ',', '.join(hp.IFACES) or None)
             print('Receive timeout:       ',hp.TIMEOUT)
             print('Host discovery limit:  ',hp.MAX_HOSTS)
+            print('Sweep rate (probes/s): ',hp.SWEEP_RATE)
+            print('Host workers:          ',hp.HOST_WORKERS)
+            print('SCPD workers per host: ',hp.SCPD_WORKERS)
+            print('Port-mapping pipeline: ',hp.PORTMAP_PIPELINE)
+            print('HTTP retries:          ',hp.HTTP_RETRIES)
+            print('Host failure limit:    ',hp.HOST_FAILURE_LIMIT)
+            print('Host cooldown (s):     ',hp.HOST_COOLDOWN)
+            print('Event port:            ',hp.events.port)
+            print('Event timeout (s):     ',hp.EVENT_TIMEOUT)
+            print('State max age (s):     ',hp.STATE_MAX_AGE)
+            print('Poll interval (s):     ',hp.POLL_INTERVAL)
+            print('SCPD cache directory:  ',hp.SCPD_CACHE_DIR)
+            print('Inventory database:    ',hp.DB_FILE)
             print('Number of known hosts: ',len(hp.ENUM_HOSTS))
             print('UPNP version:          ',hp.UPNP_VERSION)
             print('Debug mode:            ',hp.DEBUG)
@@ -222,7 +426,10 @@ def host(argc,argv,hp):
                 print("No known hosts - try running the 'msearch' or 'pcap' commands")
                 return
             for index,hostInfo in hp.ENUM_HOSTS.items():
-                print("    [%d] %s" % (index,hostInfo['name']))
+                if hostInfo.get('iface'):
+                    print("    [%d] %s (%s)" % (index,hostInfo['name'],hostInfo['iface']))
+                else:
+                    print("    [%d] %s" % (index,hostInfo['name']))
             return
         elif action == 'details':
             if argc == 3:
@@ -292,6 +499,30 @@ def host(argc,argv,hp):
 
         elif action == 'get':
             if argc == 3:
+                #Bulk enumeration of many hosts
+                if argv[2] == 'all' or not argv[2].isdigit():
+                    indexes = parseHostRange(argv[2],hp)
+                    if indexes is None:
+                        print(indexError)
+                        return
+                    indexes = [i for i in indexes if hp.ENUM_HOSTS[i]['dataComplete'] == False]
+                    if not indexes:
+                        print('Data for these hosts has already been enumerated!')
+                        return
+
+                    print("Requesting device and service info for %d hosts (%d at a time)..." % (len(indexes),hp.HOST_WORKERS))
+                    print('')
+                    try:
+                        failed = hp.enumerateHosts(indexes)
+                    except KeyboardInterrupt:
+                        print("")
+                        return
+                    print('')
+                    print('Host data enumeration complete for %d of %d hosts!' % (len(indexes) - len(failed),len(indexes)))
+                    if failed:
+                        print('Failed hosts:',', '.join([str(i) for i in failed]))
+                    return
+
                 try:
                     index = int(argv[2])
                     hostInfo = hp.ENUM_HOSTS[index]
@@ -310,14 +541,10 @@ def host(argc,argv,hp):
                         if hostInfo != False:
                             print("Requesting device and service info for %s (this could take a few seconds)..." % hostInfo['name'])
                             print('')
-                            if hostInfo['dataComplete'] == False:
-                                (xmlHeaders,xmlData) = hp.getXML(hostInfo['xmlFile'])
-                                if xmlData == False:
-                                    print('Failed to request host XML file:',hostInfo['xmlFile'])
-                                    return
-                                if hp.getHostInfo(xmlData,xmlHeaders,index) == False:
-                                    print("Failed to get device/service info for %s..." % hostInfo['name'])
-                                    return
+                            ok = hp.enumerateHost(index)
+                            hp.saveCache()
+                            if ok == False:
+                                return
                             print('Host data enumeration complete!')
                             hp.updateCmdCompleter(hp.ENUM_HOSTS)
                             return
@@ -330,7 +557,7 @@ def host(argc,argv,hp):
             index = False
             inArgCounter = 0
 
-            if argc != 6:
+            if argc < 6:
                 showHelp(argv[0])
                 return
             else:
@@ -345,17 +572,20 @@ def host(argc,argv,hp):
                 actionName = argv[5]
                 actionArgs = False
                 sendArgs = {}
+
+                #Argument values may be given inline; any that aren't are prompted for
+                try:
+                    inlineArgs = parseInlineArguments(argv[6:])
+                except ValueError as e:
+                    print(e)
+                    return
                 retTags = []
                 controlURL = False
                 fullServiceName = False
 
                 #Get the service control URL and full service name
                 try:
-                    controlURL = hostInfo['proto'] + hostInfo['name']
-                    controlURL2 = hostInfo['deviceList'][deviceName]['services'][serviceName]['controlURL']
-                    if not controlURL.endswith('/') and not controlURL2.startswith('/'):
-                        controlURL += '/'
-                    controlURL += controlURL2
+                    controlURL = hp.getControlURL(index,deviceName,serviceName)
                 except Exception as e:
                     print('Caught exception:',e)
                     print("Are you sure you've run 'host get %d' and specified the correct service name?" % index)
@@ -374,68 +604,321 @@ def host(argc,argv,hp):
                     actionStateVar = argVals['relatedStateVariable']
                     stateVar = hostInfo['deviceList'][deviceName]['services'][serviceName]['serviceStateVariables'][actionStateVar]
 
-                    if argVals['direction'].lower() == 'in':
-                        print("Required argument:")
-                        print("    Argument Name: ",argName)
-                        print("    Data Type:     ",stateVar['dataType'])
-                        if 'allowedValueList' in stateVar:
-                            print("    Allowed Values:",stateVar['allowedValueList'])
-                        if 'allowedValueRange' in stateVar:
-                            print("    Value Min:     ",stateVar['allowedValueRange'][0])
-                            print("    Value Max:     ",stateVar['allowedValueRange'][1])
-                        if 'defaultValue' in stateVar:
-                            print("    Default Value: ",stateVar['defaultValue'])
-                        prompt = "    Set %s value to: " % argName
+                    if argVals['direction'].lower() == 'in' and argName in inlineArgs:
+                        sendArgs[argName] = (userValue(stateVar,inlineArgs[argName]),stateVar['dataType'])
+                    elif argVals['direction'].lower() == 'in':
                         try:
-                            #Get user input for the argument value
-                            (argc,argv) = getUserInput(hp,prompt)
-                            if argv == None:
-                                print('Stopping send request...')
-                                return
-                            uInput = ''
-
-                            if argc > 0:
-                                inArgCounter += 1
-
-                            for val in argv:
-                                uInput += val + ' '
-
-                            uInput = uInput.strip()
-                            if stateVar['dataType'] == 'bin.base64' and uInput:
-                                uInput = base64.encodestring(uInput)
-
-                            sendArgs[argName] = (uInput.strip(),stateVar['dataType'])
+                            uInput = promptArgument(hp,argName,stateVar)
                         except KeyboardInterrupt:
                             print("")
                             return
+                        if uInput is None:
+                            print('Stopping send request...')
+                            return
+                        if uInput:
+                            inArgCounter += 1
+                        sendArgs[argName] = (uInput,stateVar['dataType'])
                         print('')
                     else:
                         retTags.append((argName,stateVar['dataType']))
 
                 #Remove the above inputs from the command history
-                while inArgCounter:
-                    try:
-                        readline.remove_history_item(readline.get_current_history_length()-1)
-                    except:
-                        pass
-
-                    inArgCounter -= 1
+                removeHistory(inArgCounter)
 
                 #print 'Requesting',controlURL
-                soapResponse = hp.sendSOAP(hostInfo['name'],fullServiceName,controlURL,actionName,sendArgs)
+                soapResponse = hp.callSOAP(hostInfo['name'],fullServiceName,controlURL,actionName,sendArgs)
                 if soapResponse != False:
-                    #It's easier to just parse this ourselves...
+                    #Output values are shown as Python values of their data types, e.g. bin.base64 data decoded to bytes
                     for (tag,dataType) in retTags:
-                        tagValue = hp.extractSingleTag(soapResponse,tag)
-                        if dataType == 'bin.base64' and tagValue != None:
-                            tagValue = base64.decodestring(tagValue)
-                        print(tag,':',tagValue)
+                        print(tag,':',soapResponse.getTypedValue(tag,dataType))
+            return
+
+        elif action == 'send-all':
+            #Send the same SOAP request to every host that offers the action
+            if argc < 5:
+                showHelp(argv[0])
+                return
+            (deviceName,serviceName,actionName) = argv[2:5]
+            inArgCounter = 0
+
+            #In-argument values may be given inline; the rest are asked for once, for all hosts
+            try:
+                arguments = parseInlineArguments(argv[5:])
+            except ValueError as e:
+                print(e)
+                return
+
+            indexes = hp.findActionHosts(deviceName,serviceName,actionName)
+            if not indexes:
+                print("No enumerated host offers %s %s %s. Have you run 'host get all'?" % (deviceName,serviceName,actionName))
+                return
+
+            service = hp.ENUM_HOSTS[indexes[0]]['deviceList'][deviceName]['services'][serviceName]
+            outArgs = []
+            for argName,argVals in service['actions'][actionName]['arguments'].items():
+                stateVar = service['serviceStateVariables'][argVals['relatedStateVariable']]
+                if argVals['direction'].lower() != 'in':
+                    outArgs.append(argName)
+                elif argName in arguments:
+                    arguments[argName] = userValue(stateVar,arguments[argName])
+                else:
+                    try:
+                        uInput = promptArgument(hp,argName,stateVar)
+                    except KeyboardInterrupt:
+                        print("")
+                        return
+                    if uInput is None:
+                        print('Stopping send request...')
+                        return
+                    if uInput:
+                        inArgCounter += 1
+                    arguments[argName] = uInput
+                    print('')
+
+            removeHistory(inArgCounter)
+
+            print("Sending %s to %d hosts (%d at a time)..." % (actionName,len(indexes),hp.HOST_WORKERS))
+            print('')
+            try:
+                results = hp.sendAll(deviceName,serviceName,actionName,arguments,indexes,typed=True)
+            except KeyboardInterrupt:
+                print("")
+                return
+
+            #Show the results as a table with a row per host and a column per output argument
+            rows = [['#','Host'] + outArgs]
+            failed = 0
+            for (index,outputs,error) in results:
+                row = [str(index),hp.ENUM_HOSTS[index]['name']]
+                if outputs is None:
+                    failed += 1
+                    row.append('ERROR: %s' % error)
+                else:
+                    row += [str(outputs[argName]) for argName in outArgs]
+                rows.append(row)
+            showTable(rows)
+            print('')
+            print('%s succeeded on %d of %d hosts' % (actionName,len(results) - failed,len(results)))
+
+            #Summarize numeric outputs across the hosts
+            columns = ResultColumns(hp.getOutputTypes(indexes[0],deviceName,serviceName,actionName))
+            columns.extend(results)
+            for argName in outArgs:
+                stats = columns.summary(argName)
+                if stats and stats[0] > 1:
+                    print('%s: min %s, max %s, mean %.2f over %d hosts' % (argName,stats[1],stats[2],stats[3],stats[0]))
             return
 
+        elif action == 'portmap':
+            #Dump the port-mapping tables of Internet gateways, optionally to a file of JSON lines
+            if argc not in (3,4):
+                showHelp(argv[0])
+                return
+            indexes = parseHostRange(argv[2],hp)
+            if indexes is None:
+                print(indexError)
+                return
+            targets = hp.findPortMappingServices(indexes)
+            if not targets:
+                print("No enumerated host offers GetGenericPortMappingEntry. Have you run 'host get'?")
+                return
+
+            outFile = None
+            if argc == 4:
+                try:
+                    outFile = open(argv[3],'w')
+                except Exception as e:
+                    print('Failed to open %s for writing: %s' % (argv[3],e))
+                    return
+
+            #Entries are shown as they arrive, so the columns have fixed widths
+            rowFormat = '%-4s %-21s %5s %-5s %-6s %-21s %-7s %-6s %s'
+            print('Dumping port mappings from %d services (%d at a time)...' % (len(targets),hp.HOST_WORKERS))
+            print('')
+            print(rowFormat % ('#','Host','Entry','Proto','Port','Internal client','Enabled','Lease','Description'))
+
+            def showEntry(target,entryIndex,outputs):
+                (index,deviceName,serviceName) = target
+                print(rowFormat % (index,hp.ENUM_HOSTS[index]['name'],entryIndex,outputs.get('NewProtocol'),outputs.get('NewExternalPort'),
+                    '%s:%s' % (outputs.get('NewInternalClient'),outputs.get('NewInternalPort')),outputs.get('NewEnabled'),
+                    outputs.get('NewLeaseDuration'),outputs.get('NewPortMappingDescription')))
+                if outFile:
+                    entry = {'index' : index, 'host' : hp.ENUM_HOSTS[index]['name'], 'device' : deviceName, 'service' : serviceName, 'entry' : entryIndex}
+                    entry.update(outputs)
+                    outFile.write(json.dumps(entry) + '\n')
+                    outFile.flush()
+
+            try:
+                results = hp.dumpPortMappings(targets,showEntry)
+            except KeyboardInterrupt:
+                print("")
+                return
+            finally:
+                if outFile:
+                    outFile.close()
+
+            print('')
+            entries = 0
+            for target in targets:
+                (count,error) = results[target]
+                entries += count
+                if error:
+                    (index,deviceName,serviceName) = target
+                    print('%s %s: %s after %d entries' % (hp.ENUM_HOSTS[index]['name'],serviceName,error,count))
+            print('Dumped %d port mappings from %d services' % (entries,len(targets)))
+            return
+
+        elif action == 'state':
+            #Show state variable values from the cache, first reading those that are missing or stale if asked to
+            args = argv[2:]
+            refresh = False
+            if args and args[0] == 'refresh':
+                refresh = True
+                args = args[1:]
+            if len(args) < 1 or len(args) > 4:
+                showHelp(argv[0])
+                return
+            indexes = parseHostRange(args[0],hp)
+            if indexes is None:
+                print(indexError)
+                return
+            (deviceName,serviceName,varName) = (args[1:] + [None,None,None])[:3]
+            targets = hp.findStateServices(indexes,deviceName,serviceName)
+            if not targets:
+                print("No enumerated service has state variables. Have you run 'host get'?")
+                return
+
+            if refresh:
+                print('Reading missing and stale state variables of %d services (%d requests at a time)...' % (len(targets),hp.HOST_WORKERS))
+                try:
+                    (read,failed) = hp.state.refresh(targets)
+                except KeyboardInterrupt:
+                    print("")
+                    return
+                print('Read %d variables, %d failed' % (read,failed))
+                print('')
+
+            rowFormat = '%-4s %-21s %-24s %-32s %-7s %-24s %s'
+            rows = []
+            now = time.time()
+            for (index,devName,svcName) in targets:
+                values = hp.state.getService(index,devName,svcName)
+                errors = hp.state.getErrors(index,devName,svcName)
+                for name in sorted(list(values.keys()) + [name for name in errors if name not in values]):
+                    if varName is not None and name != varName:
+                        continue
+                    if name in values:
+                        (value,timestamp,source) = values[name]
+                        rows.append(rowFormat % (index,hp.ENUM_HOSTS[index]['name'],svcName,name,'%ds' % (now - timestamp),source,value))
+                    else:
+                        rows.append(rowFormat % (index,hp.ENUM_HOSTS[index]['name'],svcName,name,'','ERROR',errors[name]))
+            if not rows:
+                print("No state variable values are known - try 'host state refresh %s', or 'event subscribe %s'" % (args[0],args[0]))
+                return
+            print(rowFormat % ('#','Host','Service','Variable','Age','Source','Value'))
+            for row in rows:
+                print(row)
+            return
 
     showHelp(argv[0])
     return
 
+#Parse action argument values given on the command line, either as name=value pairs or as a single
+#JSON object. Returns a dict of argument names to string values; raises ValueError if malformed.
+def parseInlineArguments(args):
+    arguments = {}
+    if not args:
+        return arguments
+
+    if args[0].startswith('{'):
+        try:
+            values = json.loads(' '.join(args))
+        except ValueError as e:
+            raise ValueError('Invalid JSON arguments: %s' % e)
+        if not isinstance(values,dict):
+            raise ValueError('JSON arguments must be an object of argument names and values')
+        for argName,value in values.items():
+            #UPnP booleans are sent as 1/0
+            if value is True or value is False:
+                value = int(value)
+            elif value is None:
+                value = ''
+            arguments[argName] = str(value)
+        return arguments
+
+    for arg in args:
+        if '=' not in arg:
+            raise ValueError("Invalid argument '%s'; arguments are given as <name>=<value> or as a JSON object" % arg)
+        (argName,value) = arg.split('=',1)
+        arguments[argName] = value
+    return arguments
+
+#Prompt for the value of an action's in-argument, showing its data type and allowed values.
+#Returns the value entered, or None if the user gave up.
+def promptArgument(hp,argName,stateVar):
+    print("Required argument:")
+    print("    Argument Name: ",argName)
+    print("    Data Type:     ",stateVar['dataType'])
+    if 'allowedValueList' in stateVar:
+        print("    Allowed Values:",stateVar['allowedValueList'])
+    if 'allowedValueRange' in stateVar:
+        print("    Value Min:     ",stateVar['allowedValueRange'][0])
+        print("    Value Max:     ",stateVar['allowedValueRange'][1])
+    if 'defaultValue' in stateVar:
+        print("    Default Value: ",stateVar['defaultValue'])
+    prompt = "    Set %s value to: " % argName
+
+    #Get user input for the argument value
+    (argc,argv) = getUserInput(hp,prompt)
+    if argv == None:
+        return None
+    return userValue(stateVar,' '.join(argv).strip())
+
+#Text entered for a bin.base64 argument is the raw data, which is base64-encoded when the request is sent
+def userValue(stateVar,value):
+    if stateVar['dataType'] == 'bin.base64' and value:
+        return value.encode()
+    return value
+
+#Remove the last count entries from the command history (e.g., argument values typed at a prompt)
+def removeHistory(count):
+    while count:
+        try:
+            readline.remove_history_item(readline.get_current_history_length()-1)
+        except:
+            pass
+        count -= 1
+
+#Parse a host index range such as 'all', '0-9' or '1,3,5-7' into a sorted list of host indexes
+#Returns None if the range is malformed or refers to unknown hosts
+def parseHostRange(spec,hp):
+    if spec == 'all':
+        return sorted(hp.ENUM_HOSTS.keys())
+
+    indexes = parseNumberRange(spec)
+    if indexes is None:
+        return None
+    for index in indexes:
+        if index not in hp.ENUM_HOSTS:
+            return None
+    return indexes
+
+#Parse a range of numbers such as '3' or '1,3,5-7' into a sorted list; returns None if it is malformed
+def parseNumberRange(spec):
+    #Note that the built-in set() is shadowed by the 'set' command in this module
+    numbers = {}
+    try:
+        for part in spec.split(','):
+            if '-' in part:
+                (first,last) = part.split('-',1)
+                for number in range(int(first),int(last)+1):
+                    numbers[number] = None
+            else:
+                numbers[int(part)] = None
+    except ValueError:
+        return None
+    return sorted(numbers)
+
 #Save data
 def save(argc,argv,hp):
     suffix = '%s_%s.mir'
@@ -481,10 +964,8 @@ def save(argc,argv,hp):
         return
     if saveType == 'struct':
         try:
-            fp = open(fileName,'w')
-            pickle.dump(hp.ENUM_HOSTS,fp)
-            fp.close()
-            print("Host data saved to '%s'" % fileName)
+            hp.saveInventory(fileName)
+            print("Host data saved to '%s'; hosts found or enumerated from now on will be added to it" % fileName)
         except Exception as e:
             print('Caught exception saving host data:',e)
     elif saveType == 'info':
@@ -507,11 +988,10 @@ def load(argc,argv,hp):
         loadFile = argv[1]
 
         try:
-            fp = open(loadFile,'r')
-            hp.ENUM_HOSTS = {}
-            hp.ENUM_HOSTS = pickle.load(fp)
-            fp.close()
+            backup = hp.loadInventory(loadFile)
             hp.updateCmdCompleter(hp.ENUM_HOSTS)
+            if backup:
+                print("Converted '%s' from the old format; the original was renamed to '%s'" % (loadFile,backup))
             print('Host data restored:')
             print('')
             host(2,['host','list'],hp)
@@ -545,6 +1025,282 @@ def log(argc,argv,hp):
         return
     showHelp(argv[0])
 
+#Subscribe to and show events from UPNP services
+def event(argc,argv,hp):
+    if argc >= 2:
+        action = argv[1]
+        if action == 'subscribe':
+            if argc not in (3,4,5):
+                showHelp(argv[0])
+                return
+            indexes = parseHostRange(argv[2],hp)
+            if indexes is None:
+                print("Host index out of range. Try the 'host list' command to get a list of known hosts")
+                return
+            deviceName = serviceName = None
+            if argc >= 4:
+                deviceName = argv[3]
+            if argc == 5:
+                serviceName = argv[4]
+            targets = hp.findEventServices(indexes,deviceName,serviceName)
+            if not targets:
+                print("No enumerated service publishes events. Have you run 'host get'?")
+                return
+
+            print('Subscribing to %d services (%d at a time)...' % (len(targets),hp.HOST_WORKERS))
+            try:
+                results = hp.events.subscribe(targets)
+            except OSError as e:
+                print('Failed to start the event server on port %d: %s' % (hp.EVENT_PORT,e))
+                return
+            failed = 0
+            for (subscription,error) in results:
+                if error is not None:
+                    failed += 1
+                    print('    %s %s %s: %s' % (hp.ENUM_HOSTS[subscription['index']]['name'],subscription['deviceName'],subscription['serviceName'],error))
+            print('Subscribed to %d of %d services; listening for events on port %d' % (len(results) - failed,len(results),hp.events.port))
+            return
+
+        elif action == 'unsubscribe':
+            if argc == 3:
+                subscriptions = hp.events.list()
+                if argv[2] == 'all':
+                    tokens = [subscription['token'] for subscription in subscriptions]
+                elif argv[2] == 'failed':
+                    tokens = [subscription['token'] for subscription in subscriptions if subscription['state'] == 'failed']
+                else:
+                    tokens = parseNumberRange(argv[2])
+                    if tokens is None:
+                        showHelp(argv[0])
+                        return
+                print('Cancelled %d subscriptions' % hp.events.unsubscribe(tokens))
+                return
+
+        elif action == 'list':
+            subscriptions = hp.events.list()
+            if not subscriptions:
+                print("No subscriptions - try 'event subscribe all'")
+                return
+            rowFormat = '%-5s %-21s %-28s %-15s %7s %7s  %s'
+            print(rowFormat % ('#','Host','Service','State','Events','Expires','SID / last error'))
+            now = time.time()
+            for subscription in subscriptions:
+                expires = ''
+                if subscription['expires'] > now:
+                    expires = '%ds' % (subscription['expires'] - now)
+                print(rowFormat % (subscription['token'],hp.ENUM_HOSTS[subscription['index']]['name'],subscription['serviceName'],subscription['state'],
+                    subscription['events'],expires,subscription['lastError'] or subscription['sid'] or ''))
+            print('')
+            print('%d subscriptions; %d events received on port %d, %d rejected' % (len(subscriptions),hp.events.notifies,hp.events.port,hp.events.rejected))
+            return
+
+        elif action == 'log':
+            if argc in (2,3):
+                count = 20
+                if argc == 3:
+                    try:
+                        count = int(argv[2])
+                    except ValueError:
+                        showHelp(argv[0])
+                        return
+                for received in hp.events.recent(count):
+                    showEvent(hp,received)
+                return
+
+        elif action == 'watch':
+            #Show events as they arrive, until the user hits Ctl+C
+            print('Watching for events; press Ctl+C to stop...')
+            print('')
+            (events,shown) = hp.events.since(None)
+            try:
+                while True:
+                    time.sleep(0.25)
+                    (events,shown) = hp.events.since(shown)
+                    for received in events:
+                        showEvent(hp,received)
+            except KeyboardInterrupt:
+                print("")
+            return
+
+    showHelp(argv[0])
+    return
+
+#Print an event received from a subscribed service
+def showEvent(hp,received):
+    print('[%s] %s %s %s (SEQ %d)' % (time.strftime('%H:%M:%S',time.localtime(received['time'])),hp.ENUM_HOSTS[received['index']]['name'],
+        received['deviceName'],received['serviceName'],received['seq']))
+    for name,value in received['variables'].items():
+        print('    %s: %s' % (name,value))
+
+#Poll the state variables that aren't evented, and show the ones that change
+def poll(argc,argv,hp):
+    if argc >= 2:
+        action = argv[1]
+        if action == 'start':
+            if argc not in (3,4,5):
+                showHelp(argv[0])
+                return
+            indexes = parseHostRange(argv[2],hp)
+            if indexes is None:
+                print("Host index out of range. Try the 'host list' command to get a list of known hosts")
+                return
+            (deviceName,serviceName) = (argv[3:] + [None,None])[:2]
+            targets = hp.findStateServices(indexes,deviceName,serviceName)
+            hp.poller.INTERVAL = hp.POLL_INTERVAL
+            variables = hp.poller.start(targets)
+            if not variables:
+                print("No enumerated service has state variables that can be polled. Have you run 'host get'?")
+                return
+            print('Polling %d variables on %d hosts every %s seconds' % (variables,len(hp.poller.hosts),hp.POLL_INTERVAL))
+            return
+
+        elif action == 'stop':
+            if argc == 2:
+                hp.poller.stop()
+                print('Polling stopped')
+                return
+
+        elif action == 'status':
+            if argc == 2:
+                stats = hp.poller.stats()
+                if stats['started'] is None:
+                    print("Nothing is being polled - try 'poll start all'")
+                    return
+                state = 'stopped'
+                if stats['running']:
+                    state = 'running'
+                print('Polling:               ',state)
+                print('Interval (s):          ',stats['interval'])
+                print('Hosts:                 ',stats['hosts'])
+                print('Variables:             ',stats['variables'])
+                print('Running for (s):       ',int(time.time() - stats['started']))
+                print('Host polls:            ',stats['rounds'])
+                print('Polls skipped:         ',stats['skipped'])
+                print('Requests sent:         ',stats['requests'])
+                print('Variables read:        ',stats['reads'])
+                print('Variables not read:    ',stats['failures'])
+                print('Changes seen:          ',stats['changes'])
+                return
+
+        elif action == 'log':
+            if argc in (2,3):
+                count = 20
+                if argc == 3:
+                    try:
+                        count = int(argv[2])
+                    except ValueError:
+                        showHelp(argv[0])
+                        return
+                for change in hp.poller.recent(count):
+                    showChange(hp,change)
+                return
+
+        elif action == 'watch':
+            #Show changes as they are seen, until the user hits Ctl+C
+            print('Watching for changes; press Ctl+C to stop...')
+            print('')
+            (changes,shown) = hp.poller.since(None)
+            try:
+                while True:
+                    time.sleep(0.25)
+                    (changes,shown) = hp.poller.since(shown)
+                    for change in changes:
+                        showChange(hp,change)
+            except KeyboardInterrupt:
+                print("")
+            return
+
+    showHelp(argv[0])
+    return
+
+#Print a state variable change seen by polling
+def showChange(hp,change):
+    print('[%s] %s %s %s: %s -> %s' % (time.strftime('%H:%M:%S',time.localtime(change['time'])),hp.ENUM_HOSTS[change['index']]['name'],
+        change['serviceName'],change['variable'],change['old'],change['value']))
+
+#Print rows of strings as columns; the first row is the heading
+def showTable(rows):
+    widths = {}
+    for row in rows:
+        for i in range(len(row) - 1):
+            widths[i] = max(widths.get(i,0),len(row[i]))
+    for row in rows:
+        print('  '.join([row[i].ljust(widths[i]) for i in range(len(row) - 1)] + [row[-1]]))
+
+#Search the host inventory database
+def query(argc,argv,hp):
+    #Canned queries: (SQL,number of times the search term is used)
+    queries = {
+        'service' : ('SELECT host,hostName,device,service,serviceType FROM hostServices WHERE service LIKE ? OR serviceType LIKE ? ORDER BY host,device,service',2),
+        'manufacturer' : ('SELECT hosts.idx AS host,hosts.name AS hostName,devices.name AS device,friendlyName,manufacturer,modelName FROM devices JOIN hosts ON hosts.idx = devices.host WHERE manufacturer LIKE ? ORDER BY host,device',1),
+        'model' : ('SELECT hosts.idx AS host,hosts.name AS hostName,devices.name AS device,friendlyName,manufacturer,modelName,modelNumber FROM devices JOIN hosts ON hosts.idx = devices.host WHERE modelName LIKE ? ORDER BY host,device',1),
+        'action' : ('SELECT host,hostName,device,service,action FROM hostActions WHERE action LIKE ? ORDER BY host,device,service',1),
+        'variable' : ('SELECT host,hostName,device,service,variable,dataType,sendEvents FROM hostVariables WHERE variable LIKE ? ORDER BY host,device,service',1)
+    }
+
+    if argc < 2:
+        showHelp(argv[0])
+        return
+    action = argv[1]
+    if action in queries and argc == 3:
+        (sql,uses) = queries[action]
+        params = (argv[2],) * uses
+    elif action == 'sql' and argc > 2:
+        sql = ' '.join(argv[2:])
+        params = ()
+    elif action == 'tables' and argc == 2:
+        sql = "SELECT type,name FROM sqlite_master WHERE type IN ('table','view') ORDER BY type,name"
+        params = ()
+    else:
+        showHelp(argv[0])
+        return
+
+    if hp.db is None:
+        print("No inventory database - set one with 'set db <file>'")
+        return
+    try:
+        (columns,rows) = hp.db.query(sql,params)
+    except Exception as e:
+        print('Query failed:',e)
+        return
+    if not rows:
+        print('No matches')
+        return
+    table = [columns]
+    for row in rows:
+        table.append(['' if value is None else str(value) for value in row])
+    showTable(table)
+    print('')
+    print('%d rows' % len(rows))
+
+#Show the health of the hosts contacted over HTTP
+def stats(argc,argv,hp):
+    if argc == 2 and argv[1] == 'reset':
+        hp.health.reset()
+        print('Host statistics cleared')
+        return
+    if argc > 2 or (argc == 2 and argv[1] != 'failing'):
+        showHelp(argv[0])
+        return
+
+    hosts = hp.health.stats()
+    if argc == 2:
+        hosts = [(name,counters) for (name,counters) in hosts if counters['state'] != 'ok']
+    if not hosts:
+        print('No hosts to show')
+        return
+
+    rowFormat = '%-21s %8s %8s %8s  %-12s %s'
+    print(rowFormat % ('Host','Requests','Failures','Refused','State','Last error'))
+    for (name,counters) in hosts:
+        state = counters['state']
+        if state == 'open':
+            state = 'open (%ds)' % counters['retryIn']
+        print(rowFormat % (name,counters['requests'],counters['failures'],counters['refused'],state,counters['lastError'] or ''))
+    print('')
+    print('%d hosts, %d not responding' % (len(hosts),len([host for host in hosts if host[1]['state'] in ('open','probing')])))
+    print('HTTP connections open: %d' % hp.httpPool.open)
+
 #Show help
 def help(argc,argv,hp):
     showHelp(False)
@@ -627,7 +1383,8 @@ def showHelp(command):
                         'Notes:\n'\
                             "    o Data files are saved as 'struct_[prefix].mir'; info files are saved as 'info_[prefix].mir.'\n"\
                             "    o If no prefix is specified, the host index number will be used for the prefix.\n"\
-                            "    o The data saved by the 'save info' command is the same as the output of the 'host details' command.",
+                            "    o The data saved by the 'save info' command is the same as the output of the 'host details' command.\n"\
+                            "    o After 'save data', hosts that are found or enumerated are appended to the data file as well, until another file\n      is saved or loaded. Saving to a new file also drops the outdated entries that this leaves behind.",
                     'quickView' :
                         'Save current host data to file'
                 },
@@ -636,18 +1393,30 @@ def showHelp(command):
                         'Description:\n'\
                             '    Allows you  to view and edit application settings.\n\n'\
                         'Usage:\n'\
-                            '    %s <show | uniq | debug | verbose | version <version #> | iface <interface> | socket <ip:port> | timeout <seconds> | max <count> >\n'\
+                            '    %s <show | uniq | debug | verbose | version <version #> | iface <interface> | ifaces <iface,iface... | all | none> | socket <ip:port> | timeout <seconds> | max <count> | rate <probes/sec> | workers <hosts> [per host] | pipeline <requests> | retries <count> | breaker <failures> [seconds] | events <port> [seconds] | freshness <seconds> | poll <seconds> | db <file | off> | cache <on | off | clear | directory> >\n'\
                             "    'show' displays the current program settings\n"\
                             "    'uniq' toggles the show-only-uniq-hosts setting when discovering UPNP devices\n"\
                             "    'debug' toggles debug mode\n"\
                             "    'verbose' toggles verbose mode\n"\
                             "    'version' changes the UPNP version used\n"\
                             "    'iface' changes the network interface in use\n"\
+                            "    'ifaces' sets the interfaces that msearch and pcap run on concurrently; results are tagged with the interface they arrived on\n"\
                             "    'socket' re-sets the multicast IP address and port number used for UPNP discovery\n"\
                             "    'timeout' sets the receive timeout period for the msearch and pcap commands (default: infinite)\n"\
-                            "    'max' sets the maximum number of hosts to locate during msearch and pcap discovery modes\n\n"\
+                            "    'max' sets the maximum number of hosts to locate during msearch and pcap discovery modes\n"\
+                            "    'rate' sets how many unicast M-SEARCH probes per second 'msearch sweep' sends (0 for unlimited)\n"\
+                            "    'workers' sets how many hosts bulk 'host get' and 'host send-all' contact at once, and optionally how many service descriptions are fetched at once per host\n"\
+                            "    'retries' sets how many times an HTTP or SOAP request is retried if the host refuses or drops the connection\n"\
+                            "    'breaker' sets after how many failed requests in a row a host is skipped, and optionally for how many seconds at first\n"\
+                            "    'pipeline' sets how many port-mapping entries 'host portmap' requests from each gateway at once, at most\n"\
+                            "    'events' sets the port that event notifications are received on (0 for any free port), and optionally how many seconds event subscriptions are requested for\n"\
+                            "    'poll' sets how often 'poll start' polls each host, in seconds\n"\
+                            "    'freshness' sets how old a state variable value may be before 'host state refresh' reads it again\n"\
+                            "    'db' mirrors the host inventory into an SQLite database for the 'query' command, or stops doing so\n"\
+                            "    'cache' caches parsed service descriptions between hosts and sessions, in ~/.miranda/scpd_cache ('on') or the given\n      directory, disables the cache (the default), or empties it\n\n"\
                         'Example:\n'\
                             '    > set socket 239.255.255.250:1900\n'\
+                            '    > set ifaces eth0,eth1\n'\
                             '    > set uniq\n\n'\
                         'Notes:\n'\
                             "    If given no options, 'set' will display help options",
@@ -674,24 +1443,41 @@ def showHelp(command):
                         'Description:\n'\
                             "    Allows you to query host information and iteract with a host's actions/services.\n\n"\
                         'Usage:\n'\
-                            '    %s <list | get | info | summary | details | send> [host index #]\n'\
+                            '    %s <list | get | info | summary | details | send | send-all | portmap | state> [host index #]\n'\
                             "    'list' displays an index of all known UPNP hosts along with their respective index numbers\n"\
-                            "    'get' gets detailed information about the specified host\n"\
+                            "    'get' gets detailed information about the specified host, a range of hosts, or all hosts\n"\
                             "    'details' gets and displays detailed information about the specified host\n"\
                             "    'summary' displays a short summary describing the specified host\n"\
                             "    'info' allows you to enumerate all elements of the hosts object\n"\
-                            "    'send' allows you to send SOAP requests to devices and services *\n\n"\
+                            "    'send' allows you to send SOAP requests to devices and services *\n"\
+                            "    'send-all' sends the same SOAP request to every enumerated host that offers the action, and tabulates the results\n"\
+                            "    'portmap' lists the port mappings of Internet gateways, optionally saving them to a file with one JSON object per line\n"\
+                            "    'state' shows the last known values of state variables, optionally reading missing and stale ones first\n\n"\
                         'Example:\n'\
                             '    > host list\n'\
                             '    > host get 0\n'\
+                            '    > host get 0-9,12\n'\
+                            '    > host get all\n'\
                             '    > host summary 0\n'\
                             '    > host info 0 deviceList\n'\
-                            '    > host send 0 <device name> <service name> <action name>\n\n'\
+                            '    > host send 0 <device name> <service name> <action name>\n'\
+                            '    > host send 0 WANConnectionDevice WANIPConnection GetSpecificPortMappingEntry NewRemoteHost= NewExternalPort=8080 NewProtocol=TCP\n'\
+                            '    > host send 0 WANConnectionDevice WANIPConnection GetSpecificPortMappingEntry {"NewRemoteHost": "", "NewExternalPort": 8080, "NewProtocol": "TCP"}\n'\
+                            '    > host send-all <device name> <service name> <action name> [<argument name>=<value> ...]\n'\
+                            '    > host send-all WANConnectionDevice WANIPConnection GetExternalIPAddress\n'\
+                            '    > host portmap all portmaps.json\n'\
+                            '    > host state [refresh] <host index | range | all> [device name] [service name] [variable name]\n'\
+                            '    > host state refresh 0 WANConnectionDevice WANIPConnection\n\n'\
                         'Notes:\n'\
                             "    o All host commands support full tab completion of enumerated arguments\n"\
                             "    o All host commands EXCEPT for the 'host send', 'host info' and 'host list' commands take only one argument: the host index number.\n"\
+                            "    o 'host get' also accepts 'all' or a range of host index numbers, and enumerates those hosts in parallel (see 'set workers').\n"\
                             "    o The host index number can be obtained by running 'host list', which takes no futher arguments.\n"\
                             "    o The 'host send' command requires that you also specify the host's device name, service name, and action name that you wish to send,\n      in that order (see the last example in the Example section of this output). This information can be obtained by viewing the\n      'host details' listing, or by querying the host information via the 'host info' command.\n"\
+                            "    o 'host send' and 'host send-all' accept argument values after the action name, as <name>=<value> pairs or as a JSON object;\n      any arguments not given are prompted for.\n"\
+                            "    o 'host send-all' asks once for any argument values not given on the command line, and sends them to every host.\n      Hosts are contacted in parallel (see 'set workers').\n"\
+                            "    o 'host portmap' takes a host index, a range of host indexes or 'all', and reads every enumerated service that offers\n      GetGenericPortMappingEntry. Several entries are requested from each gateway at once (see 'set pipeline').\n"\
+                            "    o 'host state' answers from a cache that event subscriptions (see 'event') keep current for evented variables.\n      'host state refresh' first reads the variables that have no value, or one older than 'set freshness' allows, through\n      getter actions, or QueryStateVariable for variables that no action returns.\n"\
                             "    o The 'host info' command allows you to selectively enumerate the host information data structure. All data elements and their\n      corresponding values are displayed; a value of '{}' indicates that the element is a sub-structure that can be further enumerated\n      (see the 'host info' example in the Example section of this output).",
                     'quickView' :
                         'View and send host list and host information'
@@ -710,13 +1496,17 @@ def showHelp(command):
                         'Description:\n'\
                             '    Actively searches for UPNP hosts using M-SEARCH queries\n\n'\
                         'Usage:\n'\
-                            "    %s [device | service] [<device name> | <service name>]\n"\
+                            "    %s [sweep <cidr>] [device | service] [<device name> | <service name>]\n"\
                             "    If no arguments are specified, 'msearch' searches for upnp:rootdevices\n"\
-                            "    Specific device/services types can be searched for using the 'device' or 'service' arguments\n\n"\
+                            "    Specific device/services types can be searched for using the 'device' or 'service' arguments\n"\
+                            "    'sweep' sends a unicast M-SEARCH to port 1900 of every address in the given range instead of a multicast query\n\n"\
                         'Example:\n'\
                             '    > msearch\n'\
                             '    > msearch service WANIPConnection\n'\
-                            '    > msearch device InternetGatewayDevice',
+                            '    > msearch device InternetGatewayDevice\n'\
+                            '    > msearch sweep 10.20.0.0/16 device InternetGatewayDevice\n\n'\
+                        'Notes:\n'\
+                            "    o The sweep send rate is controlled with 'set rate'; discovery ends MX seconds after the last probe is sent.",
                     'quickView' :
                         'Actively locate UPNP hosts'
                 },
@@ -725,7 +1515,11 @@ def showHelp(command):
                         'Description:\n'\
                             "    Loads host data from a struct file previously saved with the 'save data' command\n\n"\
                         'Usage:\n'\
-                            '    %s <file name>',
+                            '    %s <file name>\n\n'\
+                        'Notes:\n'\
+                            "    o The host list is available at once; each host's device and service data is read from the file when it is first used.\n"\
+                            "    o Hosts that are found or enumerated after loading are appended to the file.\n"\
+                            "    o Files saved by older versions of Miranda are converted to the current format when they are loaded; the original\n      file is kept, with '.bak' added to its name.",
                     'quickView' :
                         'Restore previous host data from file'
                 },
@@ -737,6 +1531,88 @@ def showHelp(command):
                             '    %s <log file name>',
                     'quickView' :
                         'Logs user-supplied commands to a log file'
+                },
+            'stats' : {
+                    'longListing' :
+                        'Description:\n'\
+                            '    Shows the requests made to each host over HTTP and how many of them failed\n\n'\
+                        'Usage:\n'\
+                            '    %s [failing | reset]\n'\
+                            "    'failing' only shows hosts whose last request failed\n"\
+                            "    'reset' clears the statistics, and lets hosts that were being skipped be contacted again\n\n"\
+                        'Notes:\n'\
+                            "    o After a number of failed requests in a row (see 'set breaker'), a host is skipped for a while: requests to it fail\n      at once, and are counted as refused. The first request after that decides whether it is skipped again, for longer.\n"\
+                            "    o Requests refused or dropped by the host are retried a few times, with increasing delays (see 'set retries').",
+                    'quickView' :
+                        'Show request and failure counts for each host'
+                },
+            'poll' : {
+                    'longListing' :
+                        'Description:\n'\
+                            '    Polls the state variables that UPNP services do not send events for, and shows the ones that change\n\n'\
+                        'Usage:\n'\
+                            '    %s <start | stop | status | log | watch>\n'\
+                            "    'start' <host index | range | all> [device name] [service name] polls the variables of the hosts (or of just the\n      given device and service), replacing any polled before\n"\
+                            "    'stop' stops polling\n"\
+                            "    'status' shows the number of polls, requests and changes so far\n"\
+                            "    'log' [count] shows the most recent changes (default 20)\n"\
+                            "    'watch' shows changes as they are seen, until Ctl+C is pressed\n\n"\
+                        'Example:\n'\
+                            '    > set poll 10\n'\
+                            '    > poll start all\n'\
+                            '    > poll watch\n\n'\
+                        'Notes:\n'\
+                            "    o Each host is polled every 'set poll' seconds, and the hosts are spread evenly over that interval.\n"\
+                            "    o The variables are read through getter actions, or QueryStateVariable for variables that no action returns.\n      A host's requests are sent one after another over one connection. The values read are kept for 'host state'.\n"\
+                            '    o Only values that differ from the previous reading are shown as changes.',
+                    'quickView' :
+                        'Poll state variables for changes'
+                },
+            'event' : {
+                    'longListing' :
+                        'Description:\n'\
+                            '    Subscribes to the events of UPNP services, and shows the state variable changes they report\n\n'\
+                        'Usage:\n'\
+                            '    %s <subscribe | unsubscribe | list | log | watch>\n'\
+                            "    'subscribe' <host index | range | all> [device name] [service name] subscribes to every service of the hosts\n      (or just the given device and service) that publishes events\n"\
+                            "    'unsubscribe' <all | failed | subscription numbers> cancels subscriptions, e.g. 'unsubscribe 0,3-5'\n"\
+                            "    'list' shows each subscription, its state and the number of events received\n"\
+                            "    'log' [count] shows the most recent events (default 20)\n"\
+                            "    'watch' shows events as they arrive, until Ctl+C is pressed\n\n"\
+                        'Example:\n'\
+                            '    > event subscribe 0-9\n'\
+                            '    > event subscribe 0 InternetGatewayDevice WANIPConnection\n'\
+                            '    > event watch\n\n'\
+                        'Notes:\n'\
+                            "    o Events are received by an HTTP server listening on the port set with 'set events' (any free port by default)\n"\
+                            '    o Subscriptions are renewed in the background before they expire; services that forget a subscription are\n      subscribed to again',
+                    'quickView' :
+                        'Subscribe to service events'
+                },
+            'query' : {
+                    'longListing' :
+                        'Description:\n'\
+                            "    Searches the host inventory database set with 'set db'\n\n"\
+                        'Usage:\n'\
+                            '    %s <service | manufacturer | model | action | variable | sql | tables>\n'\
+                            "    'service' <name> lists the hosts with a service, by name or service type\n"\
+                            "    'manufacturer' <name> lists the devices made by a manufacturer\n"\
+                            "    'model' <name> lists the devices of a model\n"\
+                            "    'action' <name> lists the services that offer an action\n"\
+                            "    'variable' <name> lists the services that have a state variable\n"\
+                            "    'sql' <statement> runs a read-only SQL statement\n"\
+                            "    'tables' lists the tables and views that 'sql' statements can use\n\n"\
+                        'Example:\n'\
+                            '    > set db inventory.db\n'\
+                            '    > query service WANIPConnection\n'\
+                            '    > query manufacturer %%linksys%%\n'\
+                            '    > query sql SELECT manufacturer,count(*) FROM devices GROUP BY manufacturer\n\n'\
+                        'Notes:\n'\
+                            "    o Names are matched without regard to case, and may contain SQL LIKE wildcards: '%%' for any text, '_' for one character.\n"\
+                            "    o The database has a table each for hosts, devices, services, actions, arguments and state variables ('variables').\n      Devices of the same model share their services' actions and variables, which refer to them by schema id. The views\n      hostServices, hostActions and hostVariables join them to the host, device and service they belong to.\n"\
+                            "    o Hosts are written to the database in the background as they are found and enumerated; a query first waits for\n      the hosts found before it to be written. Loading a host file replaces the hosts in the database.",
+                    'quickView' :
+                        'Search the host inventory database'
                 }
     }
 
@@ -760,7 +1636,13 @@ Command line usage: %s [OPTIONS]
     -d            Enable debug mode
     -v            Enable verbose mode
     -h             Show help
-''' % sys.argv[0])
+
+Headless usage: %s call [OPTIONS] <description URL | host index> <device> <service> <action> [<name>=<value> ... | <JSON object>]
+
+    Invokes a single action and exits. The result is printed to stdout as one JSON object, with the 'outputs' of the
+    action, or an 'error' (and a UPnP 'errorCode' if the device gave one); other messages go to stderr. The exit status
+    is 0 on success, 1 if the action failed and 2 for usage errors.
+''' % (sys.argv[0],sys.argv[0]))
     sys.exit(1)
 
 #Check command line options
@@ -794,6 +1676,9 @@ def parseCliOpts(argc,argv,hp):
             elif opt == '-h':
                 usage()
             elif opt == '-i':
+                if not hp.canBindToDevice():
+                    print('Binding to a network interface is not supported on this platform (Linux only)')
+                    sys.exit(1)
                 networkInterfaces = []
                 requestedInterface = arg
                 interfaceName = None
@@ -879,6 +1764,99 @@ def getFileInput(hp):
 
     return (argc,argv)
 
+#Headless entry point: invoke a single action and exit, without the interactive shell.
+#The host is given by the URL of its device description, or by its index in a struct file loaded with -s.
+#The result is printed to stdout as a single JSON object; everything else Miranda prints goes to stderr.
+#Returns the exit status: 0 on success, 1 if the action failed, 2 for usage errors.
+def callAction(argv):
+    try:
+        opts,args = getopt.getopt(argv[2:],'s:dh')
+    except getopt.GetoptError as e:
+        print(json.dumps({'error' : str(e)}))
+        return 2
+    if len(args) < 4 or ('-h','') in opts:
+        print(json.dumps({'error' : 'usage: %s call [-s <struct file>] [-d] <description URL | host index> <device> <service> <action> [<name>=<value> ... | <JSON object>]' % argv[0]}))
+        return 2
+    (target,deviceName,serviceName,actionName) = args[:4]
+    result = {'device' : deviceName,'service' : serviceName,'action' : actionName}
+
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            arguments = parseInlineArguments(args[4:])
+        except ValueError as e:
+            result['error'] = str(e)
+            status = 2
+        else:
+            #A single unicast SOAP request doesn't need the SSDP discovery sockets
+            try:
+                hp = upnp(False,False,None,None,discoverySockets=False)
+            except SystemExit:
+                #upnp prints why to stderr and exits
+                hp = None
+                result['error'] = 'Failed to initialize'
+                status = 1
+            except Exception as e:
+                hp = None
+                result['error'] = 'Failed to initialize: %s' % (str(e) or e.__class__.__name__)
+                status = 1
+            if hp is not None:
+                for (opt,arg) in opts:
+                    if opt == '-s':
+                        load(2,['load',arg],hp)
+                    elif opt == '-d':
+                        hp.DEBUG = True
+                (status,index) = callTarget(hp,target,result)
+                if status == 0:
+                    status = callHost(hp,index,deviceName,serviceName,actionName,arguments,result)
+                hp.cleanup()
+
+    print(json.dumps(result))
+    return status
+
+#Find (and if needed enumerate) the host for a headless call; returns (status,index)
+def callTarget(hp,target,result):
+    if '://' in target:
+        index = hp.addHostByLocation(target)
+    else:
+        try:
+            index = int(target)
+            hp.ENUM_HOSTS[index]
+        except (ValueError,KeyError):
+            result['error'] = "Unknown host '%s'; give a description URL, or a host index with -s <struct file>" % target
+            return (2,None)
+
+    hostInfo = hp.ENUM_HOSTS[index]
+    result['host'] = hostInfo['name']
+    if hostInfo['dataComplete'] == False and hp.enumerateHost(index) == False:
+        result['error'] = 'Failed to get device and service info from %s' % hostInfo['xmlFile']
+        return (1,None)
+    return (0,index)
+
+#Invoke the action for a headless call, recording its outputs or the error in result; returns the exit status
+def callHost(hp,index,deviceName,serviceName,actionName,arguments,result):
+    if not hp.findActionHosts(deviceName,serviceName,actionName,[index]):
+        result['error'] = 'Host does not offer %s %s %s' % (deviceName,serviceName,actionName)
+        return 2
+    service = hp.ENUM_HOSTS[index]['deviceList'][deviceName]['services'][serviceName]
+    for argName,argVals in service['actions'][actionName]['arguments'].items():
+        if argName in arguments:
+            arguments[argName] = userValue(service['serviceStateVariables'][argVals['relatedStateVariable']],arguments[argName])
+    try:
+        result['outputs'] = hp.invokeAction(index,deviceName,serviceName,actionName,arguments)
+    except HTTPStatusError as e:
+        result['error'] = '%d %s' % (e.status,e.reason)
+        errorCode = e.body.getFaultValue('errorCode')
+        if errorCode:
+            result['errorCode'] = errorCode
+        errorMsg = e.body.getFaultValue('errorDescription')
+        if errorMsg:
+            result['error'] += ': ' + errorMsg
+        return 1
+    except Exception as e:
+        result['error'] = str(e) or e.__class__.__name__
+        return 1
+    return 0
+
 #Main
 def main(argc,argv):
     #Table of valid commands - all primary commands must have an associated function
@@ -905,11 +1883,22 @@ def main(argc,argv):
             'socket' : None,
             'show' : None,
             'iface' : None,
+            'ifaces' : None,
             'debug' : None,
             'version' : None,
             'verbose' : None,
             'timeout' : None,
             'max' : None,
+            'rate' : None,
+            'workers' : None,
+            'pipeline' : None,
+            'retries' : None,
+            'breaker' : None,
+            'events' : None,
+            'freshness' : None,
+            'poll' : None,
+            'db' : None,
+            'cache' : None,
             'help' : None
             },
         'head' : {
@@ -924,6 +1913,9 @@ def main(argc,argv):
             'get'  : None,
             'details' : None,
             'send' : None,
+            'send-all' : None,
+            'portmap' : None,
+            'state' : None,
             'summary' : None,
             'help' : None
             },
@@ -931,6 +1923,7 @@ def main(argc,argv):
             'help' : None
             },
         'msearch' : {
+            'sweep' : None,
             'device' : None,
             'service' : None,
             'help' : None
@@ -938,6 +1931,37 @@ def main(argc,argv):
         'log'  : {
             'help' : None
             },
+        'stats' : {
+            'failing' : None,
+            'reset' : None,
+            'help' : None
+            },
+        'poll' : {
+            'start' : None,
+            'stop' : None,
+            'status' : None,
+            'log' : None,
+            'watch' : None,
+            'help' : None
+            },
+        'query' : {
+            'service' : None,
+            'manufacturer' : None,
+            'model' : None,
+            'action' : None,
+            'variable' : None,
+            'sql' : None,
+            'tables' : None,
+            'help' : None
+            },
+        'event' : {
+            'subscribe' : None,
+            'unsubscribe' : None,
+            'list' : None,
+            'log' : None,
+            'watch' : None,
+            'help' : None
+            },
         'debug': {
             'command' : None,
             'help'    : None
@@ -1003,6 +2027,8 @@ def main(argc,argv):
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'call':
+        sys.exit(callAction(sys.argv))
     try:
         print('')
         print('Miranda v1.3')
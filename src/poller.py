@@ -0,0 +1,199 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from timerwheel import TimerWheel
+
+#Polls the state variables that aren't evented on a fixed interval, and reports the ones that change.
+#The requests that read a service's variables are planned once, by StateCache.plan (the fewest getter
+#actions, then QueryStateVariable), and every value read goes into the state cache.
+#The requests for one host are sent together, one after another over the host's kept-alive connection,
+#and the hosts are spread evenly over the interval on a timer wheel, so the load is steady rather than
+#a burst every interval. A host whose previous poll is still running when it comes due again is skipped
+#for that round. Only values that differ from the previous reading are reported: to 'listeners', and
+#into a bounded history.
+class Poller:
+    INTERVAL = 30
+    #Resolution of the schedule, in seconds
+    TICK = 0.1
+    #Number of recent changes kept for 'poll log'
+    HISTORY = 1000
+
+    def __init__(self,hp,interval=None,workers=16):
+        if interval is not None:
+            self.INTERVAL = interval
+        self.hp = hp
+        self.workers = workers
+        #Planned requests by host index, and the number of variables they read
+        self.hosts = {}
+        self.variables = 0
+        self.history = collections.deque(maxlen=self.HISTORY)
+        #Called with each change, from the polling threads
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.busy = {}
+        self.thread = None
+        self.executor = None
+        self.stopping = threading.Event()
+        self.wheel = None
+        self.resetStats()
+
+    def resetStats(self):
+        self.started = None
+        self.rounds = 0
+        self.requests = 0
+        self.reads = 0
+        self.failures = 0
+        self.skipped = 0
+        self.changes = 0
+
+    #Start polling the non-evented variables of the given services, given as (index,deviceName,serviceName)
+    #tuples, replacing any services polled before. Returns the number of variables polled.
+    def start(self,targets):
+        self.stop()
+        hosts = {}
+        variables = 0
+        for key in targets:
+            varNames = self.hp.state.polledVariables(key)
+            jobs = self.hp.state.plan(key,varNames)
+            if jobs:
+                hosts.setdefault(key[0],[]).extend(jobs)
+                variables += sum(len(outputs) for (jobKey,actionName,outputs) in jobs)
+        if not hosts:
+            return 0
+
+        self.hosts = hosts
+        self.variables = variables
+        self.resetStats()
+        self.started = time.time()
+        self.busy = {}
+        self.stopping.clear()
+        self.wheel = TimerWheel(self.TICK,max(1,int(self.INTERVAL / self.TICK)) + 1)
+        #Spread the hosts' first polls evenly over the interval
+        indexes = sorted(hosts.keys())
+        for i in range(len(indexes)):
+            self.wheel.schedule(self.INTERVAL * i / len(indexes),indexes[i])
+        self.executor = ThreadPoolExecutor(max_workers=max(1,min(self.workers,len(hosts))))
+        self.thread = threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+        return variables
+
+    #Stop polling, waiting for polls in progress to finish
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.executor.shutdown(wait=True)
+        self.executor = None
+
+    #Stop polling and forget the hosts polled and the changes seen; used when the host list is replaced,
+    #as the host indexes they refer to would then name other hosts. Returns whether polling was running.
+    def clear(self):
+        running = self.isRunning()
+        self.stop()
+        with self.lock:
+            self.hosts = {}
+            self.variables = 0
+            self.history.clear()
+            self.resetStats()
+        return running
+
+    def isRunning(self):
+        return self.thread is not None
+
+    def run(self):
+        while not self.stopping.wait(self.wheel.untilNextTick()):
+            for index in self.wheel.advance():
+                #Come round again one interval later, whether or not this poll can be sent
+                self.wheel.schedule(self.INTERVAL,index)
+                with self.lock:
+                    if index in self.busy:
+                        self.skipped += 1
+                        continue
+                    self.busy[index] = True
+                self.executor.submit(self.pollHost,index)
+
+    #Send every request planned for a host, one after another
+    def pollHost(self,index):
+        try:
+            for job in self.hosts[index]:
+                if self.stopping.is_set():
+                    break
+                (values,errors,changes) = self.hp.state.runJob(job)
+                with self.lock:
+                    self.requests += 1
+                    self.reads += len(values)
+                    self.failures += len(errors)
+                if changes:
+                    self.report(job[0],changes)
+        finally:
+            with self.lock:
+                self.rounds += 1
+                del self.busy[index]
+
+    def report(self,key,changes):
+        (index,deviceName,serviceName) = key
+        now = time.time()
+        reported = []
+        for (varName,old,value) in changes:
+            reported.append({
+                'time' : now,
+                'index' : index,
+                'deviceName' : deviceName,
+                'serviceName' : serviceName,
+                'variable' : varName,
+                'old' : old,
+                'value' : value
+            })
+        with self.lock:
+            self.history.extend(reported)
+            self.changes += len(reported)
+        for change in reported:
+            for listener in self.listeners:
+                try:
+                    listener(change)
+                except Exception as e:
+                    if self.hp.DEBUG:
+                        print('Caught exception in poll listener:',e)
+
+    #Get a snapshot of the polling counters: the numbers of hosts and variables polled, of host 'rounds'
+    #completed, of 'requests' sent, of variables read ('reads') and not read ('failures'), of polls
+    #'skipped' because the host's previous poll was still running, and of 'changes' seen
+    def stats(self):
+        with self.lock:
+            return {
+                'running' : self.isRunning(),
+                'interval' : self.INTERVAL,
+                'hosts' : len(self.hosts),
+                'variables' : self.variables,
+                'started' : self.started,
+                'rounds' : self.rounds,
+                'requests' : self.requests,
+                'reads' : self.reads,
+                'failures' : self.failures,
+                'skipped' : self.skipped,
+                'changes' : self.changes
+            }
+
+    #Get the changes seen since the given total number of changes had been seen (None for none),
+    #oldest first, along with the new total
+    def since(self,total):
+        with self.lock:
+            if total is None:
+                return ([],self.changes)
+            count = min(self.changes - total,len(self.history))
+            changes = []
+            if count > 0:
+                changes = list(self.history)[-count:]
+            return (changes,self.changes)
+
+    #Get up to count of the most recent changes, oldest first
+    def recent(self,count=None):
+        with self.lock:
+            changes = list(self.history)
+        if count is not None:
+            changes = changes[-count:]
+        return changes
@@ -0,0 +1,95 @@
+import array
+
+try:
+    import numpy
+except ImportError:
+    #Numeric columns are returned as array.array instead of NumPy arrays
+    numpy = None
+
+#Output arguments of many calls to one action (e.g. from sendAll or a polling loop), stored by column.
+#Rows are added as dicts of typed output values (see invokeAction); each column can then be had as a
+#NumPy array of the argument's UPnP dataType, or without NumPy as an array.array for numeric types and
+#a list for the rest. A numeric column holding values that didn't decode (None, or raw text left by
+#decodeValue) is returned as an object array, or a list, instead.
+class ResultColumns:
+    NUMPY_TYPES = {
+        'ui1' : 'uint8', 'ui2' : 'uint16', 'ui4' : 'uint32', 'ui8' : 'uint64',
+        'i1' : 'int8', 'i2' : 'int16', 'i4' : 'int32', 'i8' : 'int64', 'int' : 'int64',
+        'r4' : 'float32', 'r8' : 'float64', 'number' : 'float64', 'float' : 'float64', 'fixed.14.4' : 'float64',
+        'boolean' : 'bool'
+    }
+    #array.array type codes; booleans are stored as 0/1
+    ARRAY_TYPES = {
+        'ui1' : 'B', 'ui2' : 'H', 'ui4' : 'L', 'ui8' : 'Q',
+        'i1' : 'b', 'i2' : 'h', 'i4' : 'l', 'i8' : 'q', 'int' : 'q',
+        'r4' : 'f', 'r8' : 'd', 'number' : 'd', 'float' : 'd', 'fixed.14.4' : 'd',
+        'boolean' : 'B'
+    }
+    PYTHON_TYPES = {'boolean' : bool, 'r4' : float, 'r8' : float, 'number' : float, 'float' : float, 'fixed.14.4' : float}
+
+    #outputTypes is a list of (argument name,dataType) pairs, as returned by getOutputTypes
+    def __init__(self,outputTypes):
+        self.outputTypes = list(outputTypes)
+        self.indexes = []
+        self.values = dict((argName,[]) for (argName,dataType) in self.outputTypes)
+
+    #Add the outputs of one call, made to the host with the given index
+    def append(self,index,outputs):
+        self.indexes.append(index)
+        for argName,values in self.values.items():
+            values.append(outputs.get(argName))
+
+    #Add the successful results of sendAll
+    def extend(self,results):
+        for (index,outputs,error) in results:
+            if outputs is not None:
+                self.append(index,outputs)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    #Get the values of one output argument
+    def column(self,argName):
+        dataType = dict(self.outputTypes)[argName]
+        values = self.values[argName]
+        if dataType in self.ARRAY_TYPES and self.isNumeric(values,dataType):
+            try:
+                if numpy is not None:
+                    return numpy.array(values,dtype=self.NUMPY_TYPES[dataType])
+                return array.array(self.ARRAY_TYPES[dataType],values)
+            except (OverflowError,ValueError,TypeError):
+                #A value out of range for its declared type
+                pass
+
+        if numpy is not None:
+            column = numpy.empty(len(values),dtype=object)
+            column[:] = values
+            return column
+        return list(values)
+
+    #Get every column, keyed by output argument name
+    def columns(self):
+        return dict((argName,self.column(argName)) for (argName,dataType) in self.outputTypes)
+
+    #Check that every value in a numeric column decoded to the right Python type
+    def isNumeric(self,values,dataType):
+        valueType = self.PYTHON_TYPES.get(dataType,int)
+        for value in values:
+            if value.__class__ is not valueType:
+                return False
+        return True
+
+    #Summary statistics for a numeric column: (count,minimum,maximum,mean), or None if the column
+    #isn't numeric or is empty
+    def summary(self,argName):
+        dataType = dict(self.outputTypes)[argName]
+        if not self.indexes or dataType not in self.ARRAY_TYPES or dataType == 'boolean':
+            return None
+        column = self.column(argName)
+        if numpy is not None:
+            if column.dtype == object:
+                return None
+            return (len(column),column.min().item(),column.max().item(),float(column.mean()))
+        if not isinstance(column,array.array):
+            return None
+        return (len(column),min(column),max(column),sum(column) / float(len(column)))
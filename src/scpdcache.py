@@ -0,0 +1,191 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+#Content-addressed cache of parsed service descriptions (SCPDs).
+#Service description URLs map to the SHA-256 hash of the document last served there, along with
+#the HTTP validators (ETag/Last-Modified) needed to revalidate it; content hashes map to the parsed
+#service structure. Identical SCPDs served by many devices of the same model therefore share one
+#entry. Parsed structures are kept in a bounded in-memory LRU and in a size-bounded LRU on disk.
+#A URL alone never vouches for its content, as the same private address can belong to another device
+#on another network: every SCPD is requested again, conditionally, and a cached structure is only used
+#when the device answers 304 Not Modified or serves a document with the same hash.
+class SCPDCache:
+    #Total size of the parsed structures stored on disk
+    MAX_DISK_BYTES = 64 * 1024 * 1024
+    #Number of parsed structures kept in memory
+    MAX_MEMORY_ENTRIES = 512
+    #Number of URLs remembered
+    MAX_URLS = 100000
+    INDEX_FILE = 'index.pickle'
+    OBJECT_DIR = 'objects'
+    #Bump when the format of the cached structures changes, to ignore old cache contents
+    VERSION = 4
+
+    def __init__(self,path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.memory = OrderedDict()
+        self.urls = OrderedDict()
+        self.objects = OrderedDict()
+        self.diskBytes = 0
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    #Hash used to address a document's content
+    @staticmethod
+    def contentHash(data):
+        return hashlib.sha256(data).hexdigest()
+
+    #Read the cache index from disk; a missing or unreadable index starts an empty cache
+    def load(self):
+        try:
+            os.makedirs(os.path.join(self.path,self.OBJECT_DIR),exist_ok=True)
+            fp = open(os.path.join(self.path,self.INDEX_FILE),'rb')
+        except Exception:
+            return
+        try:
+            index = pickle.load(fp)
+            if index.get('version') == self.VERSION:
+                self.urls = index['urls']
+                self.objects = index['objects']
+                self.diskBytes = sum(self.objects.values())
+        except Exception as e:
+            print('WARNING: Ignoring unreadable SCPD cache index:',e)
+        finally:
+            fp.close()
+
+    #Write the cache index to disk if it has changed
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            index = {
+                'version' : self.VERSION,
+                'urls' : self.urls,
+                'objects' : self.objects
+            }
+            indexFile = os.path.join(self.path,self.INDEX_FILE)
+            try:
+                fp = open(indexFile + '.tmp','wb')
+                pickle.dump(index,fp,pickle.HIGHEST_PROTOCOL)
+                fp.close()
+                os.replace(indexFile + '.tmp',indexFile)
+                self.dirty = False
+            except Exception as e:
+                print('WARNING: Failed to save SCPD cache index:',e)
+
+    #Look up what is known about a URL. Returns (contentHash,validatorHeaders), where validatorHeaders
+    #are the conditional request headers to revalidate it with, or (None,{}).
+    def lookupURL(self,url):
+        with self.lock:
+            entry = self.urls.get(url)
+            if entry is None:
+                return (None,{})
+            self.urls.move_to_end(url)
+
+            (contentHash,etag,lastModified,fetched) = entry
+            headers = {}
+            if etag:
+                headers['If-None-Match'] = etag
+            if lastModified:
+                headers['If-Modified-Since'] = lastModified
+            return (contentHash,headers)
+
+    #Record the content hash and validators of a URL that was just retrieved or revalidated
+    def storeURL(self,url,contentHash,etag=None,lastModified=None):
+        with self.lock:
+            self.urls[url] = (contentHash,etag,lastModified,time.time())
+            self.urls.move_to_end(url)
+            while len(self.urls) > self.MAX_URLS:
+                self.urls.popitem(last=False)
+            self.dirty = True
+
+    #Get the parsed structure for a content hash, or None
+    def get(self,contentHash):
+        with self.lock:
+            if contentHash in self.memory:
+                self.memory.move_to_end(contentHash)
+                if contentHash in self.objects:
+                    self.objects.move_to_end(contentHash)
+                self.hits += 1
+                return self.memory[contentHash]
+
+            if contentHash not in self.objects:
+                self.misses += 1
+                return None
+
+            try:
+                fp = open(self.objectFile(contentHash),'rb')
+                value = pickle.load(fp)
+                fp.close()
+            except Exception:
+                self.dropObject(contentHash)
+                self.misses += 1
+                return None
+
+            self.objects.move_to_end(contentHash)
+            self.remember(contentHash,value)
+            self.hits += 1
+            return value
+
+    #Store the parsed structure for a content hash in memory and on disk
+    def put(self,contentHash,value):
+        with self.lock:
+            self.remember(contentHash,value)
+            if contentHash in self.objects:
+                return
+
+            data = pickle.dumps(value,pickle.HIGHEST_PROTOCOL)
+            try:
+                fp = open(self.objectFile(contentHash),'wb')
+                fp.write(data)
+                fp.close()
+            except Exception as e:
+                print('WARNING: Failed to write SCPD cache entry:',e)
+                return
+
+            self.objects[contentHash] = len(data)
+            self.diskBytes += len(data)
+            self.dirty = True
+
+            #Evict the least recently used structures until the cache fits
+            while self.diskBytes > self.MAX_DISK_BYTES and len(self.objects) > 1:
+                (oldHash,size) = next(iter(self.objects.items()))
+                self.dropObject(oldHash)
+
+    #Remove everything from the cache
+    def clear(self):
+        with self.lock:
+            for contentHash in list(self.objects.keys()):
+                self.dropObject(contentHash)
+            self.memory.clear()
+            self.urls.clear()
+            self.dirty = True
+            self.save()
+
+    #Add a structure to the in-memory LRU
+    def remember(self,contentHash,value):
+        self.memory[contentHash] = value
+        self.memory.move_to_end(contentHash)
+        while len(self.memory) > self.MAX_MEMORY_ENTRIES:
+            self.memory.popitem(last=False)
+
+    #Remove a structure from disk
+    def dropObject(self,contentHash):
+        size = self.objects.pop(contentHash,0)
+        self.diskBytes -= size
+        self.memory.pop(contentHash,None)
+        self.dirty = True
+        try:
+            os.remove(self.objectFile(contentHash))
+        except OSError:
+            pass
+
+    def objectFile(self,contentHash):
+        return os.path.join(self.path,self.OBJECT_DIR,contentHash + '.pickle')
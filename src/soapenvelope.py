@@ -0,0 +1,74 @@
+import base64
+import datetime
+from xml.sax.saxutils import escape, quoteattr
+
+#SOAP request for one action, compiled once and filled in for each call.
+#The envelope is split into the text around each argument value, and the HTTP headers are rendered up
+#front, so a call only has to encode its values and join them with the pieces in between.
+class SOAPEnvelope:
+    ENVELOPE_START = '<?xml version="1.0"?>\n'\
+        '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">\n'\
+        '<SOAP-ENV:Body>\n'\
+        '    <m:%s xmlns:m=%s>\n'
+    ENVELOPE_END = '\n'\
+        '    </m:%s>\n'\
+        '</SOAP-ENV:Body>\n'\
+        '</SOAP-ENV:Envelope>'
+
+    #argNames are the names of the arguments, in the order their values are sent
+    def __init__(self,serviceType,actionName,argNames):
+        self.argNames = tuple(argNames)
+        self.headers = {
+            'Content-Type' : 'text/xml; charset="utf-8"',
+            'SOAPAction' : '"%s#%s"' % (serviceType,actionName)
+        }
+
+        #Every other piece is a slot for an argument value
+        pieces = []
+        text = self.ENVELOPE_START % (actionName,quoteattr(serviceType))
+        for argName in self.argNames:
+            pieces += [text + '<%s>' % argName,None]
+            text = '</%s>' % argName
+        pieces.append(text + self.ENVELOPE_END % actionName)
+        self.pieces = pieces
+
+    #Build the request body from (value,dataType) pairs, in the same order as argNames
+    def render(self,values):
+        strings = [value for (value,dataType) in values]
+        #Usually every value is a string with nothing to escape, and can go straight into its slot
+        try:
+            text = ''.join(strings)
+        except TypeError:
+            text = '<'
+        if '<' in text or '&' in text or '>' in text:
+            strings = [encodeValue(value,dataType) for (value,dataType) in values]
+
+        body = self.pieces[:]
+        body[1::2] = strings
+        return ''.join(body).encode('utf-8')
+
+#Encode an argument value for a SOAP request as escaped XML text.
+#Strings are taken to be in their wire form already and are only escaped. Other Python values are
+#converted according to the UPnP dataType: booleans to 1/0, bytes to base64 or hex for bin.base64 and
+#bin.hex, dates and times to ISO 8601, and numbers to their decimal form.
+def encodeValue(value,dataType):
+    if value.__class__ is str:
+        #Most values have nothing to escape
+        if '&' in value or '<' in value or '>' in value:
+            return escape(value)
+        return value
+    if value is None:
+        return ''
+    if value is True or value is False:
+        return '1' if value else '0'
+    if isinstance(value,(bytes,bytearray)):
+        if dataType == 'bin.base64':
+            return base64.b64encode(value).decode('ascii')
+        if dataType == 'bin.hex':
+            return value.hex()
+        return escape(bytes(value).decode('utf-8','replace'))
+    if isinstance(value,(datetime.date,datetime.time)):
+        if dataType == 'date' and isinstance(value,datetime.datetime):
+            value = value.date()
+        return value.isoformat()
+    return escape(str(value))
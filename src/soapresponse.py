@@ -0,0 +1,154 @@
+import base64
+import binascii
+import datetime
+import xml.etree.ElementTree as ET
+
+from descparser import localName
+
+#Incremental reader for SOAP responses.
+#The response body is read in chunks as the HTTP layer deframes it (Content-Length or chunked),
+#appended to a bytearray, and fed to a streaming XML parser at the same time, so the work done is
+#linear in the size of the response. The output arguments of an action response, or the details of
+#a SOAP fault, are picked out as the envelope is parsed; everything else is discarded as soon as it
+#has been seen.
+class SOAPResponse:
+    CHUNK_SIZE = 64 * 1024
+    #Element depths within the envelope: Envelope, Body, the action response (or Fault), its arguments
+    BODY_DEPTH = 2
+    RESPONSE_DEPTH = 3
+    ARGUMENT_DEPTH = 4
+    FAULT_TAGS = ('faultcode','faultstring','errorCode','errorDescription')
+
+    def __init__(self):
+        self.body = bytearray()
+        self.responseName = None
+        self.values = {}
+        self.fault = None
+        self.parseError = None
+        self.depth = 0
+        self.parser = ET.XMLPullParser(('start','end'))
+
+    #Read and parse the body of an http.client response
+    @classmethod
+    def read(cls,response):
+        soapResponse = cls()
+        while True:
+            chunk = response.read(cls.CHUNK_SIZE)
+            if not chunk:
+                break
+            soapResponse.feed(chunk)
+        soapResponse.close()
+        return soapResponse
+
+    #Parse the next piece of the body
+    def feed(self,data):
+        self.body += data
+        if self.parseError is None:
+            try:
+                self.parser.feed(data)
+                self.handle(self.parser.read_events())
+            except ET.ParseError as e:
+                self.parseError = e
+
+    #Finish parsing once the whole body has been fed
+    def close(self):
+        if self.parseError is None:
+            try:
+                self.parser.close()
+                self.handle(self.parser.read_events())
+            except ET.ParseError as e:
+                self.parseError = e
+        self.parser = None
+
+    def handle(self,events):
+        for (event,elem) in events:
+            if event == 'start':
+                self.depth += 1
+                if self.depth == self.RESPONSE_DEPTH and self.responseName is None:
+                    self.responseName = localName(elem.tag)
+                    if self.responseName == 'Fault':
+                        self.fault = {}
+                continue
+
+            if self.fault is not None and self.depth > self.RESPONSE_DEPTH:
+                #Fault details (e.g. the UPnPError inside <detail>) can be nested at any depth
+                tag = localName(elem.tag)
+                if tag in self.FAULT_TAGS and tag not in self.fault:
+                    self.fault[tag] = (elem.text or '').strip()
+            elif self.depth == self.ARGUMENT_DEPTH and self.fault is None:
+                self.values[localName(elem.tag)] = (elem.text or '').strip()
+
+            #Elements below the Body are no longer needed once they've been seen
+            if self.depth > self.BODY_DEPTH:
+                elem.clear()
+            self.depth -= 1
+
+    #Value of an output argument, or None if the response didn't include it
+    def getValue(self,name):
+        if name in self.values or self.parseError is None:
+            return self.values.get(name)
+        return self.findTag(name)
+
+    #Value of an output argument converted to a Python value by its UPnP dataType (see decodeValue)
+    def getTypedValue(self,name,dataType):
+        return decodeValue(self.getValue(name),dataType)
+
+    #Detail of a SOAP fault (one of FAULT_TAGS), or None
+    def getFaultValue(self,name):
+        if self.fault is not None and name in self.fault:
+            return self.fault[name]
+        if self.parseError is None:
+            return None
+        return self.findTag(name)
+
+    #Find the contents of a tag in the raw body; used when the response isn't well-formed XML
+    def findTag(self,name):
+        startTag = ('<%s' % name).encode('utf-8')
+        endTag = ('</%s>' % name).encode('utf-8')
+        start = self.body.find(startTag)
+        if start == -1:
+            return None
+        start = self.body.find(b'>',start)
+        end = self.body.find(endTag,start)
+        if start == -1 or end == -1:
+            return None
+        return self.body[start + 1:end].decode('utf-8','replace').strip()
+
+    #The response body as text
+    def text(self):
+        return self.body.decode('utf-8','replace')
+
+#Python types of the UPnP data types, other than the string types
+INTEGER_TYPES = ('ui1','ui2','ui4','ui8','i1','i2','i4','i8','int')
+FLOAT_TYPES = ('r4','r8','number','float','fixed.14.4')
+BOOLEAN_VALUES = {'1' : True, 'true' : True, 'yes' : True, '0' : False, 'false' : False, 'no' : False}
+
+#Convert the text of an argument to a Python value by its UPnP dataType: int, float, bool, bytes
+#(bin.base64 and bin.hex), datetime.date/datetime/time, or str for the string types.
+#An empty value of a non-string type is None. Text that isn't valid for its type is returned as it is,
+#since devices don't always follow their own descriptions.
+def decodeValue(text,dataType):
+    if text is None or dataType in ('string','char','uri','uuid'):
+        return text
+    if text == '' and dataType != 'bin.base64' and dataType != 'bin.hex':
+        return None
+    try:
+        if dataType in INTEGER_TYPES:
+            return int(text)
+        if dataType in FLOAT_TYPES:
+            return float(text)
+        if dataType == 'boolean':
+            return BOOLEAN_VALUES[text.lower()]
+        if dataType == 'bin.base64':
+            return base64.b64decode(text)
+        if dataType == 'bin.hex':
+            return bytes.fromhex(text)
+        if dataType == 'date':
+            return datetime.date.fromisoformat(text)
+        if dataType in ('dateTime','dateTime.tz'):
+            return datetime.datetime.fromisoformat(text)
+        if dataType in ('time','time.tz'):
+            return datetime.time.fromisoformat(text)
+    except (ValueError,KeyError,binascii.Error):
+        pass
+    return text
@@ -0,0 +1,236 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from httppool import HTTPStatusError
+from soapresponse import decodeValue
+
+#Current values of the state variables of enumerated services, keyed by (index,deviceName,serviceName)
+#like the host tree they describe. Each value is kept with the time it was learned and where it came
+#from: 'event', the name of the getter action that returned it, or 'query'.
+#Evented variables (sendEvents 'yes') are kept up to date by the NOTIFYs of event subscriptions. Other
+#variables, and the evented ones of services that aren't subscribed to, are read on demand by refresh():
+#through getter actions (actions without in-arguments, whose outputs are related to the variables), and
+#for variables that no getter returns, through the deprecated QueryStateVariable action.
+#Reads only look at the cache and never touch the network. Safe to share between threads.
+class StateCache:
+    #Values read by refresh() are read again once they are older than this, in seconds
+    MAX_AGE = 60
+    QUERY_SERVICE_TYPE = 'urn:schemas-upnp-org:control-1-0'
+    #Variables that only give action arguments their type, and hold no state
+    ARG_TYPE_PREFIX = 'A_ARG_TYPE_'
+
+    def __init__(self,hp,maxAge=None):
+        if maxAge is not None:
+            self.MAX_AGE = maxAge
+        self.hp = hp
+        #{(index,deviceName,serviceName) : {variable name : (value,timestamp,source)}}
+        self.services = {}
+        #{(index,deviceName,serviceName) : {variable name : error}} for the last failed read of a variable
+        self.errors = {}
+        #Services that don't support QueryStateVariable, and aren't asked again
+        self.noQuery = {}
+        self.lock = threading.Lock()
+
+    #Event listener (see EventServer.listeners): store the variables of a NOTIFY
+    def onEvent(self,event):
+        key = (event['index'],event['deviceName'],event['serviceName'])
+        stateVars = self.getStateVariables(key)
+        #The service is no longer known, e.g. the host list has been replaced since the event was sent
+        if not stateVars:
+            return
+        values = {}
+        for varName,text in event['variables'].items():
+            dataType = 'string'
+            if varName in stateVars:
+                dataType = stateVars[varName]['dataType']
+            values[varName] = (decodeValue(text,dataType),event['time'],'event')
+        self.store(key,values,{})
+
+    #Store values and errors for a service's variables. Returns the changes, as a list of (variable name,
+    #old value,new value) for the variables that had a different value before.
+    def store(self,key,values,errors):
+        changes = []
+        with self.lock:
+            cached = self.services.setdefault(key,{})
+            for varName,entry in values.items():
+                old = cached.get(varName)
+                if old is not None and old[0] != entry[0]:
+                    changes.append((varName,old[0],entry[0]))
+            cached.update(values)
+            serviceErrors = self.errors.setdefault(key,{})
+            for varName in values:
+                serviceErrors.pop(varName,None)
+            serviceErrors.update(errors)
+        return changes
+
+    #Get the cached (value,timestamp,source) of a variable, or None if it isn't known
+    def get(self,index,deviceName,serviceName,varName):
+        with self.lock:
+            return self.services.get((index,deviceName,serviceName),{}).get(varName)
+
+    #Get the cached values of a service's variables, as a dict of variable name to (value,timestamp,source)
+    def getService(self,index,deviceName,serviceName):
+        with self.lock:
+            return dict(self.services.get((index,deviceName,serviceName),{}))
+
+    #Get the errors from the last failed reads of a service's variables, as a dict of variable name to error
+    def getErrors(self,index,deviceName,serviceName):
+        with self.lock:
+            return dict(self.errors.get((index,deviceName,serviceName),{}))
+
+    #Forget the cached values of the given hosts, or of every host
+    def clear(self,indexes=None):
+        with self.lock:
+            if indexes is None:
+                self.services = {}
+                self.errors = {}
+                self.noQuery = {}
+                return
+            for table in (self.services,self.errors,self.noQuery):
+                for key in [key for key in table if key[0] in indexes]:
+                    del table[key]
+
+    #Get the names of a service's variables that aren't evented, and so can only be learned by polling
+    def polledVariables(self,key):
+        polled = []
+        for varName,stateVar in self.getStateVariables(key).items():
+            if not varName.startswith(self.ARG_TYPE_PREFIX) and stateVar['sendEvents'] != 'yes':
+                polled.append(varName)
+        return polled
+
+    #Get the names of a service's variables that refresh() should read: those with no cached value, or
+    #one older than maxAge, unless the variable is evented and the service's subscription is live
+    def staleVariables(self,key,maxAge,subscribed):
+        stale = []
+        now = time.time()
+        live = key in subscribed
+        with self.lock:
+            cached = self.services.get(key,{})
+            for varName,stateVar in self.getStateVariables(key).items():
+                if varName.startswith(self.ARG_TYPE_PREFIX):
+                    continue
+                entry = cached.get(varName)
+                if entry is None:
+                    stale.append(varName)
+                elif live and entry[2] == 'event' and stateVar['sendEvents'] == 'yes':
+                    continue
+                elif now - entry[1] > maxAge:
+                    stale.append(varName)
+        return stale
+
+    #Read the missing and stale variables of the given services, given as (index,deviceName,serviceName)
+    #tuples, HOST_WORKERS requests at a time. Returns (read,failed): the numbers of variables read and of
+    #those that couldn't be.
+    def refresh(self,targets,maxAge=None):
+        if maxAge is None:
+            maxAge = self.MAX_AGE
+        subscribed = self.hp.events.activeServices()
+        jobs = []
+        for key in targets:
+            jobs += self.plan(key,self.staleVariables(key,maxAge,subscribed))
+        if not jobs:
+            return (0,0)
+
+        read = failed = 0
+        interrupted = False
+        pool = ThreadPoolExecutor(max_workers=max(1,min(self.hp.HOST_WORKERS,len(jobs))))
+        try:
+            futures = [pool.submit(self.runJob,job) for job in jobs]
+            for future in as_completed(futures):
+                (values,errors,changes) = future.result()
+                read += len(values)
+                failed += len(errors)
+        except KeyboardInterrupt:
+            interrupted = True
+            raise
+        finally:
+            pool.shutdown(wait=not interrupted,cancel_futures=interrupted)
+        return (read,failed)
+
+    #Work out the requests that read a service's variables: the fewest getter actions that return
+    #them, then a QueryStateVariable request for each variable left over.
+    #Returns a list of (key,actionName,{output argument name : variable name}) jobs, where actionName
+    #is None for QueryStateVariable and the dict maps 'return' to the variable queried.
+    def plan(self,key,varNames):
+        if not varNames:
+            return []
+        service = self.getServiceData(key)
+        wanted = dict((varName,None) for varName in varNames)
+        getters = []
+        for actionName,action in service['actions'].items():
+            outputs = {}
+            for argName,argVals in action['arguments'].items():
+                if argVals['direction'].lower() == 'in':
+                    outputs = None
+                    break
+                outputs[argName] = argVals['relatedStateVariable']
+            if outputs:
+                getters.append((actionName,outputs))
+
+        jobs = []
+        while wanted and getters:
+            #Pick the getter that returns the most of the variables still wanted
+            best = max(getters,key=lambda getter: len([varName for varName in getter[1].values() if varName in wanted]))
+            covered = [varName for varName in best[1].values() if varName in wanted]
+            if not covered:
+                break
+            getters.remove(best)
+            jobs.append((key,best[0],best[1]))
+            for varName in covered:
+                del wanted[varName]
+
+        if key not in self.noQuery:
+            for varName in wanted:
+                jobs.append((key,None,{'return' : varName}))
+        else:
+            self.store(key,{},dict((varName,'no getter action, and QueryStateVariable is not supported') for varName in wanted))
+        return jobs
+
+    #Send one request planned by plan() and store what it returns; returns (values,errors,changes) as
+    #given to and returned by store()
+    def runJob(self,job):
+        (key,actionName,outputs) = job
+        (index,deviceName,serviceName) = key
+        stateVars = self.getStateVariables(key)
+        values = {}
+        errors = {}
+        try:
+            if actionName is None:
+                varName = outputs['return']
+                hostInfo = self.hp.ENUM_HOSTS[index]
+                controlURL = self.hp.getControlURL(index,deviceName,serviceName)
+                soapResponse = self.hp.requestSOAP(hostInfo['name'],self.QUERY_SERVICE_TYPE,controlURL,'QueryStateVariable',{'varName' : (varName,'string')})
+                results = {'return' : soapResponse.getValue('return')}
+                source = 'query'
+            else:
+                results = self.hp.invokeAction(index,deviceName,serviceName,actionName,{})
+                source = actionName
+            now = time.time()
+            for argName,varName in outputs.items():
+                values[varName] = (decodeValue(results.get(argName),stateVars[varName]['dataType']),now,source)
+        except HTTPStatusError as e:
+            error = '%d %s' % (e.status,e.reason)
+            errorCode = e.body.getFaultValue('errorCode')
+            errorMsg = e.body.getFaultValue('errorDescription')
+            if errorMsg:
+                error += ': ' + errorMsg
+            #401 Invalid Action: the device doesn't implement QueryStateVariable at all
+            if actionName is None and (errorCode == '401' or e.status != 500):
+                with self.lock:
+                    self.noQuery[key] = True
+            errors = dict((varName,error) for varName in outputs.values())
+        except Exception as e:
+            errors = dict((varName,str(e) or e.__class__.__name__) for varName in outputs.values())
+        return (values,errors,self.store(key,values,errors))
+
+    def getServiceData(self,key):
+        (index,deviceName,serviceName) = key
+        return self.hp.ENUM_HOSTS[index]['deviceList'][deviceName]['services'][serviceName]
+
+    #Get a service's state variable definitions, or an empty dict if the service is no longer known
+    def getStateVariables(self,key):
+        try:
+            return self.getServiceData(key)['serviceStateVariables']
+        except KeyError:
+            return {}
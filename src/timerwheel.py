@@ -0,0 +1,65 @@
+import math
+import threading
+import time
+
+#Hashed timer wheel for scheduling large numbers of timers (e.g. event subscription renewals) without
+#one timer or heap entry per item being re-sorted on every change.
+#Time is divided into ticks of TICK seconds, and a timer due at tick t goes into slot t % SLOTS;
+#advance() only has to look at the slots for the ticks that have passed since it last ran. Timers
+#more than a full turn of the wheel away simply stay in their slot until their tick comes round.
+#Timers can't be cancelled; the owner should ignore items it no longer cares about when they fire.
+#Safe to share between threads.
+class TimerWheel:
+    TICK = 1.0
+    SLOTS = 512
+
+    def __init__(self,tick=None,slots=None,clock=time.monotonic):
+        if tick is not None:
+            self.TICK = tick
+        if slots is not None:
+            self.SLOTS = slots
+        self.clock = clock
+        self.start = clock()
+        #The last tick that advance() has handled
+        self.current = 0
+        self.count = 0
+        self.wheel = [[] for i in range(self.SLOTS)]
+        self.lock = threading.Lock()
+
+    #Schedule item to be returned by advance() after delay seconds (rounded up to the next tick)
+    def schedule(self,delay,item):
+        with self.lock:
+            due = max(self.current + 1,int(math.ceil((self.clock() + delay - self.start) / self.TICK)))
+            self.wheel[due % self.SLOTS].append((due,item))
+            self.count += 1
+
+    #Return the items whose time has come, in the order they fell due
+    def advance(self):
+        expired = []
+        with self.lock:
+            now = int((self.clock() - self.start) / self.TICK)
+            #After a long pause every slot is visited once; later rounds find nothing new
+            last = min(now,self.current + self.SLOTS)
+            for tick in range(self.current + 1,last + 1):
+                slot = self.wheel[tick % self.SLOTS]
+                if not slot:
+                    continue
+                remaining = []
+                for (due,item) in slot:
+                    if due <= now:
+                        expired.append((due,item))
+                    else:
+                        remaining.append((due,item))
+                self.wheel[tick % self.SLOTS] = remaining
+            self.current = max(self.current,now)
+            self.count -= len(expired)
+        expired.sort(key=lambda entry: entry[0])
+        return [item for (due,item) in expired]
+
+    #Seconds until the next tick
+    def untilNextTick(self):
+        with self.lock:
+            return max(0.0,self.start + (self.current + 1) * self.TICK - self.clock())
+
+    def __len__(self):
+        return self.count
@@ -1,14 +1,45 @@
-import re
+import os
+import pickle
 import select
 import struct
 import sys
-import urllib
-from _socket import inet_aton, INADDR_ANY, IPPROTO_IP, IP_MULTICAST_TTL, IPPROTO_UDP, SOL_SOCKET, SO_REUSEADDR, \
-    SO_REUSEPORT, IP_ADD_MEMBERSHIP
-from socket import socket, AF_INET, SOCK_DGRAM, SOCK_STREAM
-from xml.dom import minidom as minidom
-
-from CmdCompleter import CmdCompleter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+from _socket import inet_aton, inet_ntoa, INADDR_ANY, IPPROTO_IP, IP_MULTICAST_TTL, IP_MULTICAST_IF, IPPROTO_UDP, \
+    SOL_SOCKET, SO_REUSEADDR, SO_REUSEPORT, IP_ADD_MEMBERSHIP
+from socket import socket, AF_INET, SOCK_DGRAM
+
+try:
+    from _socket import SO_BINDTODEVICE
+except ImportError:
+    #Linux only; sockets can't be bound to an interface ('set iface' and 'set ifaces')
+    SO_BINDTODEVICE = None
+try:
+    from socket import if_nameindex
+except ImportError:
+    if_nameindex = None
+
+try:
+    import fcntl
+except ImportError:
+    #Not available on Windows; multi-interface discovery is disabled
+    fcntl = None
+
+from CmdCompleter import CmdCompleter, LazyTree
+from discovery import DiscoveryEngine
+from httppool import HTTPConnectionPool, HTTPStatusError
+from hosthealth import HostHealth, HostUnavailableError
+from gena import EventServer
+from statecache import StateCache
+from poller import Poller
+from soapresponse import SOAPResponse
+from soapenvelope import SOAPEnvelope
+from scpdcache import SCPDCache
+from inventory import InventoryStore
+from inventorydb import InventoryDB
+from descparser import parseDescription, parseSCPD
+from hostmodel import Host, Device, Service, Action, Argument, StateVariable, SchemaTable, intern
 
 #UPNP class for getting, sending and parsing SSDP/SOAP XML data (among other things...)
 class upnp:
@@ -24,35 +55,106 @@ class upnp:
     UPNP_VERSION = '1.0'
     MAX_RECV = 8192
     MAX_HOSTS = 0
+    SWEEP_RATE = 1000
+    #Maximum number of service descriptions fetched in parallel for a single host
+    SCPD_WORKERS = 8
+    #Maximum number of hosts contacted in parallel by bulk 'host get' and 'host send-all'
+    HOST_WORKERS = 16
+    #Most GetGenericPortMappingEntry requests kept in flight to each gateway by 'host portmap' (fewer when
+    #many gateways are read at once), and the most entries read from one table, in case a gateway never
+    #reports the end of it
+    PORTMAP_PIPELINE = 8
+    PORTMAP_MAX_ENTRIES = 4096
+    #Timeouts for connecting to a host and for each read from it during HTTP and SOAP requests, in seconds
+    HTTP_CONNECT_TIMEOUT = 5
+    HTTP_TIMEOUT = 10
+    #Maximum number of HTTP connections kept open at once, and how long an unused one is kept alive
+    HTTP_MAX_CONNECTIONS = 64
+    HTTP_IDLE_TIMEOUT = 30
+    #Number of times an HTTP or SOAP request is retried if the host refuses or drops the connection
+    HTTP_RETRIES = 2
+    #Number of failed requests in a row after which a host is no longer contacted, and for how many
+    #seconds (doubling each time the host still fails afterwards)
+    HOST_FAILURE_LIMIT = 3
+    HOST_COOLDOWN = 30
+    #Port the event callback server listens on (0 for any free port), and the subscription duration requested, in seconds
+    EVENT_PORT = 0
+    EVENT_TIMEOUT = 1800
+    #Age in seconds after which cached state variable values that aren't kept current by events are read again
+    STATE_MAX_AGE = 60
+    #Seconds between polls of each host's non-evented state variables
+    POLL_INTERVAL = 30
+    #SQLite database that the host inventory is mirrored into for 'query'; None for none
+    DB_FILE = None
+    #Directory of the on-disk service description cache; None disables the cache
+    SCPD_CACHE_DIR = None
+    #Directory used by 'set cache on'
+    SCPD_CACHE_DEFAULT_DIR = os.path.join(os.path.expanduser('~'),'.miranda','scpd_cache')
     TIMEOUT = 0
     HTTP_HEADERS = []
     ENUM_HOSTS = {}
+    #Secondary indexes into ENUM_HOSTS; only modify ENUM_HOSTS through addHost/setHosts to keep these in sync
+    hostsByName = {}
+    hostsByUSN = {}
+    hostsByLocation = {}
     VERBOSE = False
     UNIQ = False
     DEBUG = False
     LOG_FILE = False
     BATCH_FILE = None
     IFACE = None
+    #Interfaces used for multi-interface discovery; empty to use the default sockets, ['all'] for every interface
+    IFACES = []
+    #Linux ioctl for reading an interface's IPv4 address
+    SIOCGIFADDR = 0x8915
     STARS = '****************************************************************'
+    #SSDP headers extracted by parseSSDPHeaders, keyed by their raw upper-case header names
+    SSDP_HEADERS = {
+        b'LOCATION' : 'LOCATION',
+        b'SERVER' : 'SERVER',
+        b'ST' : 'ST',
+        b'NT' : 'NT',
+        b'NTS' : 'NTS',
+        b'USN' : 'USN',
+        b'CACHE-CONTROL' : 'CACHE-CONTROL',
+        b'BOOTID.UPNP.ORG' : 'BOOTID'
+    }
     csock = False
     ssock = False
 
-    def __init__(self,ip,port,iface,appCommands):
+    #Without discoverySockets, the SSDP sockets aren't set up, e.g. for headless calls to known hosts
+    def __init__(self,ip,port,iface,appCommands,discoverySockets=True):
         if appCommands:
             self.completer = CmdCompleter(appCommands)
-        if self.initSockets(ip,port,iface) == False:
+        self.engine = DiscoveryEngine(self)
+        #Failures of every host contacted over HTTP, so that dead hosts fail fast
+        self.health = HostHealth(self.HOST_FAILURE_LIMIT,self.HOST_COOLDOWN)
+        self.httpPool = HTTPConnectionPool(self.HTTP_TIMEOUT,self.HTTP_MAX_CONNECTIONS,self.HTTP_IDLE_TIMEOUT,self.HTTP_CONNECT_TIMEOUT,self.health,self.HTTP_RETRIES)
+        #Service schemas shared between hosts of the same model
+        self.schemas = SchemaTable()
+        #Event subscriptions; the callback server is started by the first subscription
+        self.events = EventServer(self,self.EVENT_PORT,self.HOST_WORKERS)
+        self.events.TIMEOUT = self.EVENT_TIMEOUT
+        #Current state variable values, fed by events and read on demand
+        self.state = StateCache(self,self.STATE_MAX_AGE)
+        self.events.listeners.append(self.state.onEvent)
+        self.poller = Poller(self,self.POLL_INTERVAL,self.HOST_WORKERS)
+        #Inventory file that hosts are recorded in as they are found and enumerated (see saveInventory)
+        self.inventory = None
+        #Database that hosts are mirrored into as they are found and enumerated (see setDatabase)
+        self.db = None
+        #SOAP request templates, keyed by (serviceType,actionName,argument names)
+        self.envelopes = {}
+        self.setCache(self.SCPD_CACHE_DIR)
+        self.setHosts(self.ENUM_HOSTS)
+        if discoverySockets and self.initSockets(ip,port,iface) == False:
             print('UPNP class initialization failed!')
             print('Bye!')
             sys.exit(1)
-        else:
-            self.soapEnd = re.compile('<\/.*:envelope>')
 
     #Initialize default sockets
     def initSockets(self,ip,port,iface):
-        if self.csock:
-            self.csock.close()
-        if self.ssock:
-            self.ssock.close()
+        self.closeSockets()
 
         if iface != None:
             self.IFACE = iface
@@ -84,8 +186,8 @@ class upnp:
             #Only bind to this interface
             if self.IFACE != None:
                 print('\nBinding to interface',self.IFACE,'...\n')
-                self.ssock.setsockopt(SOL_SOCKET,urllib.SO_BINDTODEVICE,struct.pack("%ds" % (len(self.IFACE)+1,), self.IFACE))
-                self.csock.setsockopt(SOL_SOCKET,urllib.SO_BINDTODEVICE,struct.pack("%ds" % (len(self.IFACE)+1,), self.IFACE))
+                self.bindToDevice(self.ssock,self.IFACE)
+                self.bindToDevice(self.csock,self.IFACE)
 
             try:
                 self.ssock.bind(('',self.port))
@@ -100,12 +202,28 @@ class upnp:
             return False
         return True
 
-    #Clean up file/socket descriptors
+    #Close the SSDP discovery sockets, e.g. before they are set up again with new settings
+    def closeSockets(self):
+        if self.csock:
+            self.csock.close()
+            self.csock = False
+        if self.ssock:
+            self.ssock.close()
+            self.ssock = False
+
+    #Clean up file/socket descriptors, and stop everything running in the background, when exiting
     def cleanup(self):
         if self.LOG_FILE != False:
             self.LOG_FILE.close()
-        self.csock.close()
-        self.ssock.close()
+        self.poller.stop()
+        self.events.stop()
+        self.setInventory(None)
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        self.httpPool.close()
+        self.saveCache()
+        self.closeSockets()
 
     #Send network data
     def send(self,data_string,socket):
@@ -154,6 +272,82 @@ class upnp:
         except:
             return False
 
+    #Whether sockets can be restricted to one network interface, as 'set iface' and 'set ifaces' need
+    def canBindToDevice(self):
+        return SO_BINDTODEVICE is not None and fcntl is not None and if_nameindex is not None
+
+    #Restrict a socket to sending/receiving on the named interface (Linux only, requires root)
+    def bindToDevice(self,sock,iface):
+        sock.setsockopt(SOL_SOCKET,SO_BINDTODEVICE,iface.encode() + b'\0')
+
+    #Get a dict of interface names and their IPv4 addresses, excluding loopback and unconfigured interfaces
+    def getInterfaces(self):
+        interfaces = {}
+        if fcntl is None or if_nameindex is None:
+            return interfaces
+
+        sock = socket(AF_INET,SOCK_DGRAM)
+        try:
+            for (index,name) in if_nameindex():
+                try:
+                    ifreq = fcntl.ioctl(sock.fileno(),self.SIOCGIFADDR,struct.pack('256s',name[:15].encode()))
+                except OSError:
+                    continue
+                ip = inet_ntoa(ifreq[20:24])
+                if not ip.startswith('127.'):
+                    interfaces[name] = ip
+        finally:
+            sock.close()
+        return interfaces
+
+    #Resolve the IFACES setting into a dict of interface names and addresses
+    def getDiscoveryInterfaces(self):
+        available = self.getInterfaces()
+        if 'all' in self.IFACES:
+            return available
+
+        interfaces = {}
+        for iface in self.IFACES:
+            if iface in available:
+                interfaces[iface] = available[iface]
+            else:
+                print('WARNING: Interface %s has no IPv4 address, skipping' % iface)
+        return interfaces
+
+    #Create a socket that joins the multicast group on the given interface only, for passive discovery
+    def createInterfaceListener(self,iface,ifaceIP):
+        try:
+            newsock = socket(AF_INET,SOCK_DGRAM,IPPROTO_UDP)
+            newsock.setsockopt(SOL_SOCKET,SO_REUSEADDR,1)
+            # BSD systems also need to set SO_REUSEPORT
+            try:
+                newsock.setsockopt(SOL_SOCKET,SO_REUSEPORT,1)
+            except:
+                pass
+            #Without this, every listener receives the group traffic from all interfaces
+            try:
+                self.bindToDevice(newsock,iface)
+            except Exception as e:
+                print('WARNING: Failed to bind listener to %s (%s); interface tags may be inaccurate' % (iface,e))
+            newsock.bind(('',self.port))
+            newsock.setsockopt(IPPROTO_IP,IP_ADD_MEMBERSHIP,inet_aton(self.ip) + inet_aton(ifaceIP))
+            return newsock
+        except Exception as e:
+            print('Failed to create listener on interface %s: %s' % (iface,e))
+            return False
+
+    #Create a socket that sends multicast out of the given interface; unicast replies come back to it
+    def createInterfaceSender(self,iface,ifaceIP):
+        try:
+            newsock = socket(AF_INET,SOCK_DGRAM,IPPROTO_UDP)
+            newsock.setsockopt(IPPROTO_IP,IP_MULTICAST_TTL,2)
+            newsock.setsockopt(IPPROTO_IP,IP_MULTICAST_IF,inet_aton(ifaceIP))
+            newsock.bind((ifaceIP,0))
+            return newsock
+        except Exception as e:
+            print('Failed to create sender on interface %s: %s' % (iface,e))
+            return False
+
     #Return the class's primary server socket
     def listener(self):
         return self.ssock
@@ -232,19 +426,43 @@ class upnp:
             pass
         return None
 
+    #Parse the start line and headers of a raw SSDP packet (bytes or memoryview) in a single pass.
+    #Returns (messageType,headers), where messageType is 'notification', 'reply' or False, and headers
+    #maps the upper-cased names in SSDP_HEADERS to their string values (the first occurrence wins).
+    def parseSSDPHeaders(self,data):
+        headers = {}
+        lines = bytes(data).splitlines()
+        if not lines:
+            return (False,headers)
+
+        startLine = lines[0].lstrip().upper()
+        if startLine.startswith(b'NOTIFY'):
+            messageType = 'notification'
+        elif startLine.startswith(b'HTTP/1.1 200 OK'):
+            messageType = 'reply'
+        else:
+            return (False,headers)
+        headers['START-LINE'] = lines[0].strip().decode('utf-8','replace')
+
+        wanted = self.SSDP_HEADERS
+        for line in lines[1:]:
+            if not line:
+                break
+            (name,sep,value) = line.partition(b':')
+            if not sep:
+                continue
+            name = wanted.get(name.strip().upper())
+            if name is not None and name not in headers:
+                headers[name] = value.strip().decode('utf-8','replace')
+
+        return (messageType,headers)
+
     #Parses SSDP notify and reply packets, and populates the ENUM_HOSTS dict
-    def parseSSDPInfo(self,data_bytes,showUniq,verbose):
-        hostFound = False
+    #iface is the name of the interface the packet arrived on, if known
+    def parseSSDPInfo(self,data_bytes,showUniq,verbose,iface=None):
         foundLocation = False
-        messageType = False
-        xmlFile = False
         host = False
         page = False
-        upnpType = None
-        knownHeaders = {
-            'NOTIFY' : 'notification',
-            'HTTP/1.1 200 OK' : 'reply'
-        }
 
         #Use the class defaults if these aren't specified
         if showUniq == False:
@@ -253,25 +471,22 @@ class upnp:
             verbose = self.VERBOSE
 
         #Is the SSDP packet a notification, a reply, or neither?
-        data = data_bytes.decode("utf-8")
-        for text,messageType in knownHeaders.items():
-            if data.upper().startswith(text):
-                break
-            else:
-                messageType = False
+        (messageType,headers) = self.parseSSDPHeaders(data_bytes)
 
         #If this is a notification or a reply message...
         if messageType != False:
             #Get the host name and location of its main UPNP XML file
-            xmlFile = self.parseHeader(data,"LOCATION")
-            upnpType = self.parseHeader(data,"SERVER")
-            (host,page) = self.parseURL(xmlFile)
+            xmlFile = headers.get('LOCATION',False)
+            upnpType = headers.get('SERVER')
+            usn = headers.get('USN')
+            if xmlFile:
+                (host,page) = self.parseURL(xmlFile)
 
             #Sanity check to make sure we got all the info we need
             if xmlFile == False or host == False or page == False:
                 print('ERROR parsing recieved header:')
                 print(self.STARS)
-                print(data)
+                print(bytes(data_bytes).decode('utf-8','replace'))
                 print(self.STARS)
                 print('')
                 return False
@@ -282,30 +497,27 @@ class upnp:
             #Check if we've seen this host before; add to the list of hosts if:
             #    1. This is a new host
             #    2. We've already seen this host, but the uniq hosts setting is disabled
-            for hostID,hostInfo in self.ENUM_HOSTS.items():
-                if hostInfo['name'] == host:
-                    hostFound = True
-                    if self.UNIQ:
-                        return False
-
-            if (hostFound and not self.UNIQ) or not hostFound:
-                #Get the new host's index number and create an entry in ENUM_HOSTS
-                index = len(self.ENUM_HOSTS)
-                self.ENUM_HOSTS[index] = {
-                                'name' : host,
-                                'dataComplete' : False,
-                                'proto' : protocol,
-                                'xmlFile' : xmlFile,
-                                'serverType' : None,
-                                'upnpServer' : upnpType,
-                                'deviceList' : {}
-                            }
-                #Be sure to update the command completer so we can tab complete through this host's data structure
-                self.updateCmdCompleter(self.ENUM_HOSTS)
+            if host in self.hostsByName and self.UNIQ:
+                return False
+
+            self.addHost(Host({
+                            'name' : host,
+                            'dataComplete' : False,
+                            'proto' : protocol,
+                            'xmlFile' : xmlFile,
+                            'serverType' : None,
+                            'upnpServer' : upnpType,
+                            'usn' : usn,
+                            'iface' : iface,
+                            'deviceList' : {}
+                        }))
 
             #Print out some basic device info
             print(self.STARS)
-            print("SSDP %s message from %s" % (messageType,host))
+            if iface:
+                print("SSDP %s message from %s on %s" % (messageType,host,iface))
+            else:
+                print("SSDP %s message from %s" % (messageType,host))
 
             if xmlFile:
                 foundLocation = True
@@ -318,120 +530,390 @@ class upnp:
             print('')
 
             return True
+        return False
+
+    #Add a new host entry to ENUM_HOSTS and the host indexes; returns the new host's index number
+    def addHost(self,hostInfo):
+        hostInfo = Host.fromDict(hostInfo)
+        index = len(self.ENUM_HOSTS)
+        self.ENUM_HOSTS[index] = hostInfo
+        self.indexHost(index,hostInfo)
+        self.recordHost(index)
+
+        #Be sure to update the command completer so we can tab complete through this host's data structure
+        self.updateCmdCompleterHost(index,hostInfo)
+        return index
+
+    #Replace the contents of ENUM_HOSTS (e.g., when loading saved host data) and rebuild the host indexes.
+    #Hosts saved as plain dicts by older versions are converted to the host model.
+    def setHosts(self,hosts):
+        hosts = dict((index,Host.fromDict(hostInfo)) for (index,hostInfo) in hosts.items())
+        for hostInfo in hosts.values():
+            #Hosts read lazily from an inventory file share their schemas when they are read
+            if hostInfo.isLoaded():
+                self.schemas.shareHost(hostInfo)
+        #Polls, subscriptions and cached values are keyed by host index, which now refers to other hosts
+        if self.poller.clear():
+            print('Stopped polling the previous hosts')
+        cancelled = self.events.clear()
+        if cancelled:
+            print('Cancelled %d event subscriptions to the previous hosts' % cancelled)
+        self.ENUM_HOSTS = hosts
+        self.state.clear()
+        self.hostsByName = {}
+        self.hostsByUSN = {}
+        self.hostsByLocation = {}
+        for index,hostInfo in hosts.items():
+            self.indexHost(index,hostInfo)
+        if self.db is not None:
+            self.db.replaceAll(hosts)
+
+    #Add a host entry to the host indexes. The first host seen with a given key wins.
+    def indexHost(self,index,hostInfo):
+        self.hostsByName.setdefault(hostInfo['name'],index)
+        self.hostsByLocation.setdefault(hostInfo['xmlFile'],index)
+        usn = hostInfo.get('usn')
+        if usn:
+            self.hostsByUSN.setdefault(usn,index)
+
+    #Add a host given only the URL of its device description (e.g. one not found by discovery).
+    #Returns the index of the new host, or of the known host with that LOCATION.
+    def addHostByLocation(self,xmlFile):
+        index = self.findHost(location=xmlFile)
+        if index is not None:
+            return index
+        parts = urlsplit(xmlFile)
+        return self.addHost(Host({
+                            'name' : parts.netloc,
+                            'dataComplete' : False,
+                            'proto' : parts.scheme + '://',
+                            'xmlFile' : xmlFile,
+                            'serverType' : None,
+                            'upnpServer' : None,
+                            'usn' : None,
+                            'iface' : None,
+                            'deviceList' : {}
+                        }))
+
+    #Look up a host index by host:port name, USN or LOCATION URL; returns None if the host is unknown
+    def findHost(self,name=None,usn=None,location=None):
+        if name is not None and name in self.hostsByName:
+            return self.hostsByName[name]
+        if usn is not None and usn in self.hostsByUSN:
+            return self.hostsByUSN[usn]
+        if location is not None and location in self.hostsByLocation:
+            return self.hostsByLocation[location]
+        return None
 
     #Send GET request for a UPNP XML file
     def getXML(self,url):
+        (status,headers,output) = self.fetchXML(url,None)
+        return (headers,output)
+
+    #Send GET request for a UPNP XML file, with optional extra (e.g., conditional) request headers
+    #Returns (status,headers,data), or (False,False,False) on failure
+    def fetchXML(self,url,extraHeaders):
 
         headers = {
                             'USER-AGENT':'uPNP/'+self.UPNP_VERSION,
                             'CONTENT-TYPE':'text/xml; charset="utf-8"'
                 }
+        if extraHeaders:
+            headers.update(extraHeaders)
 
         try:
-            #Use urllib2 for the request, it's awesome
-            req = urllib.Request(url, None, headers)
-            response = urllib.urlopen(req)
-            output = response.read()
-            headers = response.info()
-            return (headers,output)
+            #Connections to the host are kept alive and reused for the device description and every SCPD
+            return self.httpPool.request('GET',url,None,headers)
         except Exception as e:
             print("Request for '%s' failed: %s" % (url,e))
-            return (False,False)
+            return (False,False,False)
 
-    #Send SOAP request
+    #Send SOAP request; returns the response body, or False on failure
     def sendSOAP(self,hostName,serviceType,controlURL,actionName,actionArguments):
-        argList = ''
-        soapResponse = ''
+        soapResponse = self.callSOAP(hostName,serviceType,controlURL,actionName,actionArguments)
+        if soapResponse == False:
+            return False
+        return soapResponse.text()
 
+    #Send SOAP request; returns a SOAPResponse holding the parsed output arguments, or False on failure
+    def callSOAP(self,hostName,serviceType,controlURL,actionName,actionArguments):
+        try:
+            return self.requestSOAP(hostName,serviceType,controlURL,actionName,actionArguments)
+        except HTTPStatusError as e:
+            print('SOAP request failed with error code: %d %s' % (e.status,e.reason))
+            errorMsg = e.body.getFaultValue('errorDescription')
+            if errorMsg:
+                print('SOAP error message:',errorMsg)
+            return False
+        except HostUnavailableError as e:
+            print('SOAP request not sent:',e)
+            return False
+        except Exception as e:
+            print('Caught socket exception:',e)
+            return False
+        except KeyboardInterrupt:
+            print("")
+            return False
+
+    #Send SOAP request and return the parsed SOAPResponse; failures raise HTTPStatusError or socket errors.
+    #actionArguments maps argument names to (value,dataType) pairs; values are encoded by encodeValue.
+    def requestSOAP(self,hostName,serviceType,controlURL,actionName,actionArguments):
+        #The request goes over a persistent connection to the host, shared with description fetches
         if '://' in controlURL:
-            urlArray = controlURL.split('/',3)
-            if len(urlArray) < 4:
-                controlURL = '/'
-            else:
-                controlURL = '/' + urlArray[3]
+            url = controlURL
+        else:
+            if not controlURL.startswith('/'):
+                controlURL = '/' + controlURL
+            url = 'http://' + hostName + controlURL
 
+        #Fill in the action's compiled request; Host and Content-Length are added by the connection
+        envelope = self.getEnvelope(serviceType,actionName,tuple(actionArguments))
+        soapBody = envelope.render(actionArguments.values())
+        headers = envelope.headers
 
-        soapRequest = 'POST %s HTTP/1.1\r\n' % controlURL
+        if self.DEBUG:
+            print(self.STARS)
+            print('POST %s' % url)
+            for head,value in headers.items():
+                print('%s: %s' % (head,value))
+            print('')
+            print(soapBody.decode('utf-8'))
+            print(self.STARS)
+            print('')
 
-        #Check if a port number was specified in the host name; default is port 80
-        if ':' in hostName:
-            hostNameArray = hostName.split(':')
-            host = hostNameArray[0]
+        #Send the request; the response is parsed as it is read, framed by its Content-Length or chunked encoding
+        (status,respHeaders,soapResponse) = self.httpPool.request('POST',url,soapBody,headers,SOAPResponse.read)
+        return soapResponse
+
+    #Get the compiled SOAP request for an action sent with the given tuple of argument names
+    def getEnvelope(self,serviceType,actionName,argNames):
+        key = (serviceType,actionName,argNames)
+        envelope = self.envelopes.get(key)
+        if envelope is None:
+            envelope = self.envelopes.setdefault(key,SOAPEnvelope(serviceType,actionName,argNames))
+        return envelope
+
+    #Get the full control URL of a host's service
+    def getControlURL(self,index,deviceName,serviceName):
+        return self.getHostURL(index,self.ENUM_HOSTS[index]['deviceList'][deviceName]['services'][serviceName]['controlURL'])
+
+    #Get the full event subscription URL of a host's service
+    def getEventSubURL(self,index,deviceName,serviceName):
+        return self.getHostURL(index,self.ENUM_HOSTS[index]['deviceList'][deviceName]['services'][serviceName]['eventSubURL'])
+
+    #Get the full URL of a path on a host
+    def getHostURL(self,index,serviceURL):
+        hostInfo = self.ENUM_HOSTS[index]
+        hostURL = hostInfo['proto'] + hostInfo['name']
+        if '://' in serviceURL:
+            return serviceURL
+        if not hostURL.endswith('/') and not serviceURL.startswith('/'):
+            hostURL += '/'
+        return hostURL + serviceURL
+
+    #Get the services that publish events, as (index,deviceName,serviceName) tuples, optionally only
+    #those of the given device and service names
+    def findEventServices(self,indexes=None,deviceName=None,serviceName=None):
+        targets = []
+        if indexes is None:
+            indexes = sorted(self.ENUM_HOSTS.keys())
+        for index in indexes:
+            for devName,deviceData in self.ENUM_HOSTS[index]['deviceList'].items():
+                if deviceName is not None and devName != deviceName:
+                    continue
+                for svcName,serviceData in deviceData['services'].items():
+                    if serviceName is not None and svcName != serviceName:
+                        continue
+                    if serviceData.get('eventSubURL'):
+                        targets.append((index,devName,svcName))
+        return targets
+
+    #Get the services that have state variables, as (index,deviceName,serviceName) tuples, optionally only
+    #those of the given device and service names
+    def findStateServices(self,indexes=None,deviceName=None,serviceName=None):
+        targets = []
+        if indexes is None:
+            indexes = sorted(self.ENUM_HOSTS.keys())
+        for index in indexes:
+            for devName,deviceData in self.ENUM_HOSTS[index]['deviceList'].items():
+                if deviceName is not None and devName != deviceName:
+                    continue
+                for svcName,serviceData in deviceData['services'].items():
+                    if serviceName is not None and svcName != serviceName:
+                        continue
+                    if serviceData.hasField('serviceStateVariables') and serviceData['serviceStateVariables']:
+                        targets.append((index,devName,svcName))
+        return targets
+
+    #Get the indexes of the enumerated hosts that offer an action, in index order
+    def findActionHosts(self,deviceName,serviceName,actionName,indexes=None):
+        found = []
+        if indexes is None:
+            indexes = sorted(self.ENUM_HOSTS.keys())
+        for index in indexes:
             try:
-                port = int(hostNameArray[1])
-            except:
-                print('Invalid port specified for host connection:',hostName[1])
-                return False
-        else:
-            host = hostName
-            port = 80
-
-        #Create a string containing all of the SOAP action's arguments and values
-        for arg,(val,dt) in actionArguments.items():
-            argList += '<%s>%s</%s>' % (arg,val,arg)
-
-        #Create the SOAP request
-        soapBody =     '<?xml version="1.0"?>\n'\
-                '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">\n'\
-                '<SOAP-ENV:Body>\n'\
-                '    <m:%s xmlns:m="%s">\n'\
-                '%s\n'\
-                '    </m:%s>\n'\
-                '</SOAP-ENV:Body>\n'\
-                '</SOAP-ENV:Envelope>' % (actionName,serviceType,argList,actionName)
-
-        #Specify the headers to send with the request
-        headers =     {
-                'Host':hostName,
-                'Content-Length':len(soapBody),
-                'Content-Type':'text/xml',
-                'SOAPAction':'"%s#%s"' % (serviceType,actionName)
-                }
-
-        #Generate the final payload
-        for head,value in headers.items():
-            soapRequest += '%s: %s\r\n' % (head,value)
-        soapRequest += '\r\n%s' % soapBody
-
-        #Send data and go into recieve loop
+                if actionName in self.ENUM_HOSTS[index]['deviceList'][deviceName]['services'][serviceName]['actions']:
+                    found.append(index)
+            except KeyError:
+                continue
+        return found
+
+    #Get the output arguments of a host's action as a list of (argument name,dataType) pairs
+    def getOutputTypes(self,index,deviceName,serviceName,actionName):
+        service = self.ENUM_HOSTS[index]['deviceList'][deviceName]['services'][serviceName]
+        outputTypes = []
+        for argName,argVals in service['actions'][actionName]['arguments'].items():
+            if argVals['direction'].lower() != 'in':
+                outputTypes.append((argName,service['serviceStateVariables'][argVals['relatedStateVariable']]['dataType']))
+        return outputTypes
+
+    #Invoke an action on one host with the given in-argument values, which are matched to the host's
+    #own argument definitions. Returns a dict of the output argument values, as text or, if typed is set,
+    #converted to Python values by their dataType (see decodeValue); failures raise.
+    def invokeAction(self,index,deviceName,serviceName,actionName,arguments,typed=False):
+        hostInfo = self.ENUM_HOSTS[index]
+        service = hostInfo['deviceList'][deviceName]['services'][serviceName]
+        sendArgs = {}
+        outArgs = []
+        for argName,argVals in service['actions'][actionName]['arguments'].items():
+            dataType = service['serviceStateVariables'][argVals['relatedStateVariable']]['dataType']
+            if argVals['direction'].lower() == 'in':
+                sendArgs[argName] = (arguments.get(argName,''),dataType)
+            else:
+                outArgs.append((argName,dataType))
+
+        controlURL = self.getControlURL(index,deviceName,serviceName)
+        soapResponse = self.requestSOAP(hostInfo['name'],service['fullName'],controlURL,actionName,sendArgs)
+        if typed:
+            return dict((argName,soapResponse.getTypedValue(argName,dataType)) for (argName,dataType) in outArgs)
+        return dict((argName,soapResponse.getValue(argName)) for (argName,dataType) in outArgs)
+
+    #Invoke an action on every enumerated host that offers it (or on the given hosts), HOST_WORKERS hosts
+    #at a time. arguments maps in-argument names to the values sent to every host.
+    #Returns a list of (index,outputs,error) tuples in host index order: outputs maps output argument names
+    #to values (converted by dataType if typed is set), or is None if the call failed, in which case error
+    #describes the failure. The successful results can be gathered into columns with ResultColumns.
+    def sendAll(self,deviceName,serviceName,actionName,arguments,indexes=None,typed=False):
+        results = {}
+        interrupted = False
+        indexes = self.findActionHosts(deviceName,serviceName,actionName,indexes)
+        if not indexes:
+            return []
+
+        pool = ThreadPoolExecutor(max_workers=max(1,min(self.HOST_WORKERS,len(indexes))))
         try:
-            sock = socket(AF_INET,SOCK_STREAM)
-            sock.connect((host,port))
+            futures = {}
+            for index in indexes:
+                futures[pool.submit(self.invokeAction,index,deviceName,serviceName,actionName,arguments,typed)] = index
 
-            if self.DEBUG:
-                print(self.STARS)
-                print(soapRequest)
-                print(self.STARS)
-                print('')
-
-                sock.send(soapRequest)
-                while True:
-                    data = sock.recv(self.MAX_RECV)
-                    if not data:
-                        break
-                    else:
-                        soapResponse += data
-                        if self.soapEnd.search(soapResponse.lower()) != None:
-                            break
-                            sock.close()
-
-            (header,body) = soapResponse.split('\r\n\r\n',1)
-            if not header.upper().startswith('HTTP/1.') and ' 200 ' in header.split('\r\n')[0]:
-                print('SOAP request failed with error code:',header.split('\r\n')[0].split(' ',1)[1])
-                errorMsg = self.extractSingleTag(body,'errorDescription')
-                if errorMsg:
-                    print('SOAP error message:',errorMsg)
-                return False
-            else:
-                return body
-        except Exception as e:
-            print('Caught socket exception:',e)
-            sock.close()
-            return False
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = (index,future.result(),None)
+                except HTTPStatusError as e:
+                    error = '%d %s' % (e.status,e.reason)
+                    errorMsg = e.body.getFaultValue('errorDescription')
+                    if errorMsg:
+                        error += ': ' + errorMsg
+                    results[index] = (index,None,error)
+                except Exception as e:
+                    results[index] = (index,None,str(e) or e.__class__.__name__)
         except KeyboardInterrupt:
-            print("")
-            sock.close()
-            return False
+            interrupted = True
+            raise
+        finally:
+            pool.shutdown(wait=not interrupted,cancel_futures=interrupted)
+
+        return [results[index] for index in sorted(results.keys())]
+
+    #Get the IGD services that can list their port mappings, as (index,deviceName,serviceName) tuples
+    def findPortMappingServices(self,indexes=None):
+        targets = []
+        if indexes is None:
+            indexes = sorted(self.ENUM_HOSTS.keys())
+        for index in indexes:
+            for deviceName,deviceData in self.ENUM_HOSTS[index]['deviceList'].items():
+                for serviceName,serviceData in deviceData['services'].items():
+                    if 'GetGenericPortMappingEntry' in serviceData['actions']:
+                        targets.append((index,deviceName,serviceName))
+        return targets
+
+    #Read the port-mapping tables of many gateway services, as found by findPortMappingServices.
+    #Entries are requested by index with GetGenericPortMappingEntry until the gateway answers with a
+    #SOAP fault (normally 713, SpecifiedArrayIndexInvalid), which marks the end of the table. Up to
+    #PORTMAP_PIPELINE indexes are in flight to each service at once, over kept-alive connections, and
+    #HOST_WORKERS services are read at a time; the depth is lowered so that the requests in flight never
+    #take more than half of the connection pool. Requests sent past the end of a table are discarded.
+    #onEntry(target,entryIndex,outputs) is called from this thread as entries arrive, in index order
+    #for each target. Returns a dict of target to (entryCount,error), where error is None if the whole
+    #table was read, or describes the failure that cut it short.
+    def dumpPortMappings(self,targets,onEntry):
+        results = {}
+        tables = {}
+        futures = {}
+        waiting = deque(targets)
+        interrupted = False
+        if not targets:
+            return results
+
+        active = max(1,min(self.HOST_WORKERS,len(targets)))
+        #Keep the requests in flight to half the connection pool, so that they neither close pooled connections
+        #to make room for each other nor starve other requests of connections
+        depth = max(1,min(self.PORTMAP_PIPELINE,self.httpPool.MAX_CONNECTIONS // (2 * active)))
+        pool = ThreadPoolExecutor(max_workers=active * depth)
+        try:
+            while waiting or futures:
+                #Start on more services as others finish
+                while waiting and len(tables) < active:
+                    target = waiting.popleft()
+                    tables[target] = {'next' : 0, 'end' : None, 'depth' : depth, 'inFlight' : 0, 'received' : {}, 'count' : 0, 'errors' : {}}
+                    self.requestPortMappings(pool,futures,target,tables[target])
+
+                (done,notDone) = wait(futures,return_when=FIRST_COMPLETED)
+                for future in done:
+                    (target,entryIndex) = futures.pop(future)
+                    table = tables[target]
+                    table['inFlight'] -= 1
+                    try:
+                        table['received'][entryIndex] = future.result()
+                    except Exception as e:
+                        #Any SOAP fault ends the table; other errors are failures
+                        if not isinstance(e,HTTPStatusError):
+                            table['errors'][entryIndex] = str(e) or e.__class__.__name__
+                        elif e.body.fault is None:
+                            table['errors'][entryIndex] = '%d %s' % (e.status,e.reason)
+                        if table['end'] is None or entryIndex < table['end']:
+                            table['end'] = entryIndex
+
+                    #Pass on the entries received so far that are next in order
+                    while table['count'] in table['received'] and (table['end'] is None or table['count'] < table['end']):
+                        onEntry(target,table['count'],table['received'].pop(table['count']))
+                        table['count'] += 1
+
+                    self.requestPortMappings(pool,futures,target,table)
+                    if table['inFlight'] == 0:
+                        error = table['errors'].get(table['count'])
+                        if table['end'] is None:
+                            error = 'stopped after %d entries' % table['count']
+                        results[target] = (table['count'],error)
+                        del tables[target]
+        except KeyboardInterrupt:
+            interrupted = True
+            raise
+        finally:
+            pool.shutdown(wait=not interrupted,cancel_futures=interrupted)
+
+        return results
+
+    #Keep the table's pipeline depth of requests in flight for a port-mapping table, until its end is known
+    def requestPortMappings(self,pool,futures,target,table):
+        (index,deviceName,serviceName) = target
+        while table['inFlight'] < table['depth'] and table['end'] is None and table['next'] < self.PORTMAP_MAX_ENTRIES:
+            arguments = {'NewPortMappingIndex' : str(table['next'])}
+            future = pool.submit(self.invokeAction,index,deviceName,serviceName,'GetGenericPortMappingEntry',arguments)
+            futures[future] = (target,table['next'])
+            table['next'] += 1
+            table['inFlight'] += 1
 
     #Display all info for a given host
     def showCompleteHostInfo(self,index,fp):
@@ -473,6 +955,131 @@ class upnp:
         except Exception as e:
             print('Caught exception while showing host info:',e)
 
+    #Retrieve and parse a host's device description and all of its service descriptions.
+    #Returns True if the host data is complete; failures are reported and return False.
+    def enumerateHost(self,index):
+        hostInfo = self.ENUM_HOSTS[index]
+        if hostInfo['dataComplete'] == True:
+            return True
+
+        (xmlHeaders,xmlData) = self.getXML(hostInfo['xmlFile'])
+        if xmlData == False:
+            print('Failed to request host XML file:',hostInfo['xmlFile'])
+            return False
+        if self.getHostInfo(xmlData,xmlHeaders,index) == False:
+            print("Failed to get device/service info for %s..." % hostInfo['name'])
+            return False
+        self.recordHost(index)
+        return True
+
+    #Save the host inventory to a new inventory file, which new and newly enumerated hosts are then
+    #recorded in as well. Hosts still being read lazily from another inventory file are copied over
+    #without being parsed.
+    def saveInventory(self,path):
+        store = InventoryStore(path,self.schemas)
+        try:
+            store.create(self.ENUM_HOSTS)
+        except:
+            store.close()
+            raise
+        self.setInventory(store)
+
+    #Load the hosts in a file written by saveInventory, reading each host's device and service data
+    #only when it is first used; later hosts are recorded in the same file.
+    #Files written by older versions, which pickled ENUM_HOSTS, are converted: the original is kept
+    #with '.bak' added to its name, and the name of the backup is returned (otherwise None).
+    def loadInventory(self,path):
+        if InventoryStore.isInventory(path):
+            store = InventoryStore(path,self.schemas)
+            try:
+                hosts = store.open()
+            except:
+                store.close()
+                raise
+            self.setHosts(hosts)
+            self.setInventory(store)
+            return None
+
+        with open(path,'rb') as fp:
+            #Python 2 versions pickled byte strings
+            hosts = pickle.load(fp,encoding='utf-8',errors='replace')
+        self.setHosts(hosts)
+        backup = path + '.bak'
+        os.replace(path,backup)
+        self.saveInventory(path)
+        return backup
+
+    def setInventory(self,store):
+        old = self.inventory
+        self.inventory = store
+        if old is not None and old is not store:
+            old.close()
+
+    #Mirror the host inventory into an SQLite database, which new and newly enumerated hosts are then
+    #written to as well, replacing whatever hosts the database held. None stops mirroring.
+    def setDatabase(self,path):
+        old = self.db
+        self.db = None
+        if old is not None:
+            old.close()
+        if path is not None:
+            db = InventoryDB(path,self.schemas)
+            db.replaceAll(self.ENUM_HOSTS)
+            self.db = db
+        self.DB_FILE = path
+
+    #Record a host's current data in the inventory file and the database, if there are any
+    def recordHost(self,index):
+        if self.db is not None:
+            self.db.record(index,self.ENUM_HOSTS[index])
+        if self.inventory is None:
+            return
+        try:
+            self.inventory.append(index,self.ENUM_HOSTS[index])
+        except Exception as e:
+            print('Failed to record host %d in %s: %s' % (index,self.inventory.path,e))
+
+    #Enumerate many hosts at once, at most HOST_WORKERS at a time (each fetching up to SCPD_WORKERS
+    #service descriptions at a time). A failure on one host does not affect the others.
+    #Progress is reported as each host finishes; returns the list of host indexes that failed.
+    def enumerateHosts(self,indexes):
+        failed = []
+        total = len(indexes)
+        done = 0
+        interrupted = False
+        if total == 0:
+            return failed
+
+        pool = ThreadPoolExecutor(max_workers=max(1,min(self.HOST_WORKERS,total)))
+        try:
+            futures = {}
+            for index in indexes:
+                futures[pool.submit(self.enumerateHost,index)] = index
+
+            for future in as_completed(futures):
+                index = futures[future]
+                done += 1
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    print('Caught exception while enumerating host %d: %s' % (index,e))
+                    ok = False
+                if not ok:
+                    failed.append(index)
+                print('[%d/%d] %s %s' % (done,total,self.ENUM_HOSTS[index]['name'],'complete' if ok else 'FAILED'))
+        except KeyboardInterrupt:
+            print('\nCancelling remaining hosts...')
+            interrupted = True
+            raise
+        finally:
+            #Hosts already in progress are left to finish in the background if the user gave up
+            pool.shutdown(wait=not interrupted,cancel_futures=interrupted)
+            #Update the completer once for the whole batch, even if it was interrupted
+            self.updateCmdCompleter(self.ENUM_HOSTS)
+            self.saveCache()
+
+        return sorted(failed)
+
     #Wrapper function...
     def getHostInfo(self,xmlData,xmlHeaders,index):
         if self.ENUM_HOSTS[index]['dataComplete'] == True:
@@ -480,9 +1087,9 @@ class upnp:
 
         if index >= 0 and index < len(self.ENUM_HOSTS):
             try:
-                xmlRoot = minidom.parseString(xmlData)
+                xmlRoot = parseDescription(xmlData)
                 self.parseDeviceInfo(xmlRoot,index)
-                self.ENUM_HOSTS[index]['serverType'] = xmlHeaders.getheader('Server')
+                self.ENUM_HOSTS[index]['serverType'] = xmlHeaders.get('Server')
                 self.ENUM_HOSTS[index]['dataComplete'] = True
                 return True
             except Exception as e:
@@ -492,16 +1099,17 @@ class upnp:
     #Parse device info from the retrieved XML file
     def parseDeviceInfo(self,xmlRoot,index):
         deviceEntryPointer = False
+        services = []
         devTag = "device"
         deviceType = "deviceType"
         deviceListEntries = "deviceList"
         deviceTags = ["friendlyName","modelDescription","modelName","modelNumber","modelURL","presentationURL","UDN","UPC","manufacturer","manufacturerURL"]
 
         #Find all device entries listed in the XML file
-        for device in xmlRoot.getElementsByTagName(devTag):
+        for device in xmlRoot.children(devTag):
             try:
                 #Get the deviceType string
-                deviceTypeName = str(device.getElementsByTagName(deviceType)[0].childNodes[0].data)
+                deviceTypeName = str(device.firstText(deviceType))
             except:
                 continue
 
@@ -511,25 +1119,29 @@ class upnp:
                 continue
 
             #Create a new device entry for this host in the ENUM_HOSTS structure
-            deviceEntryPointer = self.ENUM_HOSTS[index][deviceListEntries][deviceDisplayName] = {}
+            deviceEntryPointer = self.ENUM_HOSTS[index][deviceListEntries][intern(deviceDisplayName)] = Device()
             deviceEntryPointer['fullName'] = deviceTypeName
 
             #Parse out all the device tags for that device
             for tag in deviceTags:
                 try:
-                    deviceEntryPointer[tag] = str(device.getElementsByTagName(tag)[0].childNodes[0].data)
+                    deviceEntryPointer[tag] = str(device.firstText(tag))
                 except Exception as e:
                     if self.VERBOSE:
                         print('Device',deviceEntryPointer['fullName'],'does not have a',tag)
                     continue
             #Get a list of all services for this device listing
-            self.parseServiceList(device,deviceEntryPointer,index)
+            services += self.parseServiceList(device,deviceEntryPointer,index)
 
+        #Get specific service info about all of this host's services
+        self.parseServices(services,index)
         return
 
     #Parse the list of services specified in the XML file
+    #Returns the new service entries; their service descriptions are retrieved separately by parseServices
     def parseServiceList(self,xmlRoot,device,index):
         serviceEntryPointer = False
+        services = []
         dictName = "services"
         serviceListTag = "serviceList"
         serviceTag = "service"
@@ -539,9 +1151,9 @@ class upnp:
         try:
             device[dictName] = {}
             #Get a list of all services offered by this device
-            for service in xmlRoot.getElementsByTagName(serviceListTag)[0].getElementsByTagName(serviceTag):
+            for service in xmlRoot.children(serviceListTag)[0].children(serviceTag):
                 #Get the full service descriptor
-                serviceName = str(service.getElementsByTagName(serviceNameTag)[0].childNodes[0].data)
+                serviceName = str(service.firstText(serviceNameTag))
 
                 #Get the service name from the service descriptor string
                 serviceDisplayName = self.parseServiceTypeName(serviceName)
@@ -549,29 +1161,95 @@ class upnp:
                     continue
 
                 #Create new service entry for the device in ENUM_HOSTS
-                serviceEntryPointer = device[dictName][serviceDisplayName] = {}
+                serviceEntryPointer = device[dictName][intern(serviceDisplayName)] = Service()
                 serviceEntryPointer['fullName'] = serviceName
 
                 #Get all of the required service info and add it to ENUM_HOSTS
                 for tag in serviceTags:
-                    serviceEntryPointer[tag] = str(service.getElementsByTagName(tag)[0].childNodes[0].data)
+                    serviceEntryPointer[tag] = str(service.firstText(tag))
 
-                #Get specific service info about this service
-                self.parseServiceInfo(serviceEntryPointer,index)
+                services.append(serviceEntryPointer)
         except Exception as e:
             print('Caught exception while parsing device service list:',e)
+        return services
 
-    #Parse details about each service (arguements, variables, etc)
-    def parseServiceInfo(self,service,index):
-        argIndex = 0
-        argTags = ['direction','relatedStateVariable']
-        actionList = 'actionList'
-        actionTag = 'action'
-        nameTag = 'name'
-        argumentList = 'argumentList'
-        argumentTag = 'argument'
+    #Retrieve the service descriptions for a list of services in parallel, then parse them in order.
+    #Only the downloads run concurrently, so the resulting ENUM_HOSTS entries match parseServiceInfo's.
+    def parseServices(self,services,index):
+        if not services:
+            return
+
+        urls = [self.getServiceURL(service,index) for service in services]
+        cached = [self.lookupCachedService(url) for url in urls]
+
+        #Every description is requested, conditionally if the cache has seen the URL before
+        workers = max(1,min(self.SCPD_WORKERS,len(urls)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            responses = list(pool.map(self.fetchXML,urls,[validators for (contentHash,validators) in cached]))
+
+        for i in range(len(services)):
+            (status,xmlHeaders,xmlData) = responses[i]
+            self.parseServiceResponse(services[i],urls[i],status,xmlHeaders,xmlData,cached[i][0])
+
+    #Parse a fetched service description, consulting and updating the SCPD cache if it is enabled
+    def parseServiceResponse(self,service,xmlFile,status,xmlHeaders,xmlData,cachedHash):
+        if not self.scpdCache or status == False:
+            return self.parseServiceXML(service,xmlFile,xmlData)
+
+        #304 Not Modified: the cached content is still current
+        if status == 304 and cachedHash:
+            contentHash = cachedHash
+        else:
+            contentHash = self.scpdCache.contentHash(xmlData)
+        self.scpdCache.storeURL(xmlFile,contentHash,xmlHeaders.get('ETag'),xmlHeaders.get('Last-Modified'))
+
+        if self.applyCachedService(service,contentHash):
+            return True
+        if status == 304:
+            (status,xmlHeaders,xmlData) = self.fetchXML(xmlFile,{})
+            if status == False:
+                return self.parseServiceXML(service,xmlFile,False)
+            contentHash = self.scpdCache.contentHash(xmlData)
+            self.scpdCache.storeURL(xmlFile,contentHash,xmlHeaders.get('ETag'),xmlHeaders.get('Last-Modified'))
+
+        if self.parseServiceXML(service,xmlFile,xmlData) != True:
+            return False
+        #The shared schema is read-only, so the cache can hold it as is
+        self.scpdCache.put(contentHash,service.schema)
+        return True
+
+    #Look up a service description URL in the SCPD cache; returns (contentHash,validatorHeaders)
+    def lookupCachedService(self,url):
+        if not self.scpdCache:
+            return (None,{})
+        return self.scpdCache.lookupURL(url)
+
+    #Fill in a service's actions and state variables from the SCPD cache; returns False on a cache miss
+    def applyCachedService(self,service,contentHash):
+        if not self.scpdCache or not contentHash:
+            return False
+        value = self.scpdCache.get(contentHash)
+        if value is None:
+            return False
+        service.schema = self.schemas.share(value)
+        return True
 
-        #Get the full path to the service's XML file
+    #Use the SCPD cache in the given directory, or disable caching if path is None
+    def setCache(self,path):
+        if getattr(self,'scpdCache',None):
+            self.scpdCache.save()
+        self.SCPD_CACHE_DIR = path
+        self.scpdCache = None
+        if path:
+            self.scpdCache = SCPDCache(path)
+
+    #Write out any changes to the SCPD cache index
+    def saveCache(self):
+        if self.scpdCache:
+            self.scpdCache.save()
+
+    #Get the full path to a service's XML file
+    def getServiceURL(self,service,index):
         xmlFile = self.ENUM_HOSTS[index]['proto'] + self.ENUM_HOSTS[index]['name']
         if not xmlFile.endswith('/') and not service['SCPDURL'].startswith('/'):
             try:
@@ -585,24 +1263,40 @@ class upnp:
             xmlFile = service['SCPDURL']
         else:
             xmlFile += service['SCPDURL']
-        service['actions'] = {}
+        return xmlFile
 
+    #Parse details about each service (arguements, variables, etc)
+    def parseServiceInfo(self,service,index):
         #Get the XML file that describes this service
+        xmlFile = self.getServiceURL(service,index)
         (xmlHeaders,xmlData) = self.getXML(xmlFile)
+        return self.parseServiceXML(service,xmlFile,xmlData)
+
+    #Parse a retrieved service description into the service's ENUM_HOSTS entry
+    def parseServiceXML(self,service,xmlFile,xmlData):
+        argIndex = 0
+        argTags = ['direction','relatedStateVariable']
+        actionList = 'actionList'
+        actionTag = 'action'
+        nameTag = 'name'
+        argumentList = 'argumentList'
+        argumentTag = 'argument'
+
+        service['actions'] = {}
         if not xmlData:
             print('Failed to retrieve service descriptor located at:',xmlFile)
             return False
 
         try:
-            xmlRoot = minidom.parseString(xmlData)
+            xmlRoot = parseSCPD(xmlData)
 
             #Get a list of actions for this service
             try:
-                actionList = xmlRoot.getElementsByTagName(actionList)[0]
+                actionList = xmlRoot.children(actionList)[0]
             except:
                 print('Failed to retrieve action list for service %s!' % service['fullName'])
                 return False
-            actions = actionList.getElementsByTagName(actionTag)
+            actions = actionList.children(actionTag)
             if actions == []:
                 return False
 
@@ -610,24 +1304,24 @@ class upnp:
             for action in actions:
                 #Get the action's name
                 try:
-                    actionName = str(action.getElementsByTagName(nameTag)[0].childNodes[0].data).strip()
+                    actionName = intern(str(action.firstText(nameTag)).strip())
                 except:
                     print('Failed to obtain service action name (%s)!' % service['fullName'])
                     continue
 
                 #Add the action to the ENUM_HOSTS dictonary
-                service['actions'][actionName] = {}
+                service['actions'][actionName] = Action()
                 service['actions'][actionName]['arguments'] = {}
 
                 #Parse all of the action's arguments
                 try:
-                    argList = action.getElementsByTagName(argumentList)[0]
+                    argList = action.children(argumentList)[0]
                 except:
                     #Some actions may take no arguments, so continue without raising an error here...
                     continue
 
                 #Get all the arguments in this action's argument list
-                arguments = argList.getElementsByTagName(argumentTag)
+                arguments = argList.children(argumentTag)
                 if arguments == []:
                     if self.VERBOSE:
                         print('Action',actionName,'has no arguments!')
@@ -636,16 +1330,16 @@ class upnp:
                 #Loop through the action's arguments, appending them to the ENUM_HOSTS dictionary
                 for argument in arguments:
                     try:
-                        argName = str(argument.getElementsByTagName(nameTag)[0].childNodes[0].data)
+                        argName = intern(str(argument.firstText(nameTag)))
                     except:
                         print('Failed to get argument name for',actionName)
                         continue
-                    service['actions'][actionName]['arguments'][argName] = {}
+                    service['actions'][actionName]['arguments'][argName] = Argument()
 
                     #Get each required argument tag value and add them to ENUM_HOSTS
                     for tag in argTags:
                         try:
-                            service['actions'][actionName]['arguments'][argName][tag] = str(argument.getElementsByTagName(tag)[0].childNodes[0].data)
+                            service['actions'][actionName]['arguments'][argName][tag] = str(argument.firstText(tag))
                         except:
                             print('Failed to find tag %s for argument %s!' % (tag,argName))
                             continue
@@ -657,6 +1351,8 @@ class upnp:
             print('Caught exception while parsing Service info for service %s: %s' % (service['fullName'],str(e)))
             return False
 
+        #Hosts of the same model share a single copy of the service's actions and state variables
+        service.schema = self.schemas.share(service.schema)
         return True
 
     #Get info about a service's state variables
@@ -680,58 +1376,95 @@ class upnp:
 
         #Get a list of all state variables associated with this service
         try:
-            stateVars = xmlRoot.getElementsByTagName(serviceStateTable)[0].getElementsByTagName(stateVariable)
+            stateVars = xmlRoot.children(serviceStateTable)[0].children(stateVariable)
         except:
             #Don't necessarily want to throw an error here, as there may be no service state variables
             return False
 
         #Loop through all state variables
         for var in stateVars:
-            for tag in varVals:
-                #Get variable name
-                try:
-                    varName = str(var.getElementsByTagName(nameTag)[0].childNodes[0].data)
-                except:
-                    print('Failed to get service state variable name for service %s!' % servicePointer['fullName'])
-                    continue
+            #Get variable name
+            try:
+                varName = intern(str(var.firstText(nameTag)))
+            except:
+                print('Failed to get service state variable name for service %s!' % servicePointer['fullName'])
+                continue
 
-                servicePointer['serviceStateVariables'][varName] = {}
-                try:
-                    servicePointer['serviceStateVariables'][varName]['dataType'] = str(var.getElementsByTagName(dataType)[0].childNodes[0].data)
-                except:
-                    servicePointer['serviceStateVariables'][varName]['dataType'] = na
+            servicePointer['serviceStateVariables'][varName] = StateVariable()
+            try:
+                servicePointer['serviceStateVariables'][varName]['dataType'] = str(var.firstText(dataType))
+            except:
+                servicePointer['serviceStateVariables'][varName]['dataType'] = na
+            #sendEvents is an attribute of <stateVariable>, but some devices give it as a child element
+            if sendEvents in var.attributes:
+                servicePointer['serviceStateVariables'][varName]['sendEvents'] = str(var.attributes[sendEvents])
+            else:
                 try:
-                    servicePointer['serviceStateVariables'][varName]['sendEvents'] = str(var.getElementsByTagName(sendEvents)[0].childNodes[0].data)
+                    servicePointer['serviceStateVariables'][varName]['sendEvents'] = str(var.firstText(sendEvents))
                 except:
                     servicePointer['serviceStateVariables'][varName]['sendEvents'] = na
 
-                servicePointer['serviceStateVariables'][varName][allowedValueList] = []
+            servicePointer['serviceStateVariables'][varName][allowedValueList] = []
 
-                #Get a list of allowed values for this variable
-                try:
-                    vals = var.getElementsByTagName(allowedValueList)[0].getElementsByTagName(allowedValue)
-                except:
-                    pass
-                else:
-                    #Add the list of allowed values to the ENUM_HOSTS dictionary
-                    for val in vals:
-                        servicePointer['serviceStateVariables'][varName][allowedValueList].append(str(val.childNodes[0].data))
+            #Get a list of allowed values for this variable
+            try:
+                vals = var.children(allowedValueList)[0].children(allowedValue)
+            except:
+                pass
+            else:
+                #Add the list of allowed values to the ENUM_HOSTS dictionary
+                for val in vals:
+                    servicePointer['serviceStateVariables'][varName][allowedValueList].append(intern(str(val.getText())))
 
-                #Get allowed value range for this variable
+            #Get allowed value range for this variable
+            try:
+                valList = var.children(allowedValueRange)[0]
+            except:
+                pass
+            else:
+                #Add the max and min values to the ENUM_HOSTS dictionary
+                servicePointer['serviceStateVariables'][varName][allowedValueRange] = []
                 try:
-                    valList = var.getElementsByTagName(allowedValueRange)[0]
+                    servicePointer['serviceStateVariables'][varName][allowedValueRange].append(str(valList.firstText(minimum)))
+                    servicePointer['serviceStateVariables'][varName][allowedValueRange].append(str(valList.firstText(maximum)))
                 except:
                     pass
-                else:
-                    #Add the max and min values to the ENUM_HOSTS dictionary
-                    servicePointer['serviceStateVariables'][varName][allowedValueRange] = []
-                    try:
-                        servicePointer['serviceStateVariables'][varName][allowedValueRange].append(str(valList.getElementsByTagName(minimum)[0].childNodes[0].data))
-                        servicePointer['serviceStateVariables'][varName][allowedValueRange].append(str(valList.getElementsByTagName(maximum)[0].childNodes[0].data))
-                    except:
-                        pass
         return True
 
+    #Add a single new host to the command completer without rebuilding the entire completer structure
+    def updateCmdCompleterHost(self,index,hostInfo):
+        hostCommand = 'host'
+        host = str(index)
+
+        if not self.completer:
+            return
+        try:
+            commands = self.completer.commands
+            if not isinstance(commands[hostCommand].get('info'),dict):
+                self.updateCmdCompleter(self.ENUM_HOSTS)
+                return
+
+            commands[hostCommand]['info'][host] = hostInfo
+            for (cmd,subcmd) in [(hostCommand,'get'),(hostCommand,'details'),(hostCommand,'summary'),('save','info')]:
+                commands[cmd][subcmd][host] = None
+            commands[hostCommand]['send'][host] = {}
+        except Exception as e:
+            print("Error updating command completer structure; some command completion features might not work...",e)
+
+    #Get a host's device, service and action names as a tree for the command completer
+    def getActionTree(self,hostData):
+        tree = {}
+        if 'deviceList' in hostData:
+            for device,deviceData in hostData['deviceList'].items():
+                tree[device] = {}
+                if 'services' in deviceData:
+                    for service,serviceData in deviceData['services'].items():
+                        tree[device][service] = {}
+                        if 'actions' in serviceData:
+                            for action,actionData in serviceData['actions'].items():
+                                tree[device][service][action] = None
+        return tree
+
     #Update the command completer
     def updateCmdCompleter(self,struct):
         indexOnlyList = {
@@ -759,21 +1492,25 @@ class upnp:
                 for subcmd in data:
                     self.completer.commands[cmd][subcmd] = topLevelKeys
 
-            #This is for updating the sendCommand key
+            #'host get' also accepts 'all'
+            self.completer.commands[hostCommand]['get'] = dict(topLevelKeys,all=None)
+
+            #This is for updating the sendCommand key. The device, service and action names of each host are
+            #only gathered when they are first completed, so that hosts loaded lazily aren't all read at once.
             structPtr = {}
             for hostIndex,hostData in struct.items():
-                host = str(hostIndex)
-                structPtr[host] = {}
-                if 'deviceList' in hostData:
-                    for device,deviceData in hostData['deviceList'].items():
-                        structPtr[host][device] = {}
-                        if 'services' in deviceData:
-                            for service,serviceData in deviceData['services'].items():
-                                structPtr[host][device][service] = {}
-                                if 'actions' in serviceData:
-                                    for action,actionData in serviceData['actions'].items():
-                                        structPtr[host][device][service][action] = None
+                structPtr[str(hostIndex)] = LazyTree(lambda hostData=hostData: self.getActionTree(hostData))
             self.completer.commands[hostCommand][sendCommand] = structPtr
+
+            #'host send-all' completes every device, service and action offered by any host
+            def sendAllTree():
+                sendAll = {}
+                for hostStruct in structPtr.values():
+                    for device,services in hostStruct.items():
+                        for service,actions in services.items():
+                            sendAll.setdefault(device,{}).setdefault(service,{}).update(actions)
+                return sendAll
+            self.completer.commands[hostCommand]['send-all'] = LazyTree(sendAllTree)
         except Exception as e:
             print("Error updating command completer structure; some command completion features might not work...",e)
         return
\ No newline at end of file